@@ -18,6 +18,8 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 DEV_MODE = os.getenv("DEV_MODE", "false").lower() == "true"
 print(f"DEV_MODE={DEV_MODE}")
+# comma-separated usernames allowed on /admin/* (any user in DEV_MODE)
+ADMIN_USERNAMES = {u.strip() for u in os.getenv("ADMIN_USERNAMES", "").split(",") if u.strip()}
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 router = APIRouter()
@@ -91,6 +93,12 @@ def dev_or_current_user(
     return current_user
 
 
+def admin_user(current_user: User = Depends(get_current_user)) -> User:
+    if DEV_MODE or current_user.username in ADMIN_USERNAMES:
+        return current_user
+    raise HTTPException(status_code=403, detail="Admin only")
+
+
 # ---------- Schemas ----------
 class LoginRequest(BaseModel):
     username: str
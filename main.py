@@ -1,10 +1,36 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from database import Base, engine
+from migrations import run_migrations
 import auth  
-from routes import songs, folders, playlists, settings, history, home, users, recent_searches
+from routes import songs, folders, playlists, settings, history, home, users, recent_searches, admin, stats
+from utils import query_stats
+from services.event_buffer import play_buffer
+from services.retention import start_retention_worker, stop_retention_worker
+from services.scan_jobs import start_scan_workers, stop_scan_workers
+from services.watcher import start_library_watcher, stop_library_watcher
+from services.enrichment import start_enrichment_workers, stop_enrichment_workers
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if play_buffer:
+        play_buffer.start()
+    start_retention_worker()  # no-op unless PLAY_EVENTS_RETENTION_DAYS is set
+    start_enrichment_workers()
+    start_scan_workers()
+    start_library_watcher()  # no-op unless LIBRARY_WATCH=1
+    yield
+    stop_library_watcher()
+    stop_scan_workers()  # a running scan stops after its batch and is re-queued
+    stop_enrichment_workers()
+    stop_retention_worker()
+    if play_buffer:
+        play_buffer.close()  # flush buffered play events before exit
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -14,8 +40,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Ensure tables exist in smuzzi.db
+
+@app.middleware("http")
+async def record_query_stats(request: Request, call_next):
+    rq, token = query_stats.begin_request()
+    try:
+        return await call_next(request)
+    finally:
+        route = request.scope.get("route")
+        name = f"{request.method} {route.path}" if route is not None else f"{request.method} <unmatched>"
+        query_stats.end_request(name, rq, token)
+
+# Ensure tables exist on the primary database (replicas get schema from the primary)
 Base.metadata.create_all(bind=engine)
+run_migrations(engine)
 
 # Register routers
 app.include_router(auth.router, prefix="/api")
@@ -27,4 +65,6 @@ app.include_router(history.router, prefix="/api")
 app.include_router(home.router, prefix="/api")
 app.include_router(users.router, prefix="/api")  
 app.include_router(recent_searches.router, prefix="/api")
+app.include_router(stats.router, prefix="/api")
+app.include_router(admin.router, prefix="/api")
 
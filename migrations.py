@@ -0,0 +1,112 @@
+# migrations.py
+"""
+Bring an existing database up to the models. create_all() only creates missing
+tables, so this adds columns/indexes that were introduced after a table existed.
+
+Rules for new columns on existing tables: nullable, or with a server_default.
+Unique rules on existing tables are declared as unique Index()es (SQLite can't
+ALTER TABLE ADD CONSTRAINT). Extra one-off data fixes go in DATA_MIGRATIONS, or in a
+function called from run_migrations when they need Python (folder paths).
+"""
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateColumn
+
+from database import Base
+from utils.paths import normalize_folder_path
+
+# (name, SQL) — must be idempotent; run in order before indexes are created
+DATA_MIGRATIONS: list[tuple[str, str]] = [
+    # keep the newest row per (user, song) before uq_recent_searches_user_song is created
+    ("dedupe_recent_searches", """
+        DELETE FROM recent_searches WHERE id NOT IN (
+            SELECT MAX(id) FROM recent_searches GROUP BY user_id, song_id
+        )
+    """),
+    # users.liked_count is a denormalized total for /songs/liked; recounting also heals drift
+    ("recount_liked_count", """
+        UPDATE users SET liked_count = (SELECT COUNT(*) FROM likes WHERE likes.user_id = users.id)
+    """),
+    # give unordered playlist rows sparse keys (ORDER_STEP apart) after the ordered ones, by insertion order
+    ("backfill_playlist_order_index", """
+        UPDATE playlist_tracks SET order_index = (
+            SELECT r.base + r.rn * 1024 FROM (
+                SELECT t.id,
+                       ROW_NUMBER() OVER (PARTITION BY t.playlist_id ORDER BY t.id) AS rn,
+                       (SELECT COALESCE(MAX(p.order_index), 0) FROM playlist_tracks p
+                        WHERE p.playlist_id = t.playlist_id) AS base
+                FROM playlist_tracks t WHERE t.order_index IS NULL
+            ) r WHERE r.id = playlist_tracks.id
+        ) WHERE order_index IS NULL
+    """),
+    # cached playlist header totals; recounting also picks up changed song durations
+    ("recount_playlist_totals", """
+        UPDATE playlists SET
+            track_count = (SELECT COUNT(*) FROM playlist_tracks pt WHERE pt.playlist_id = playlists.id),
+            total_duration = (SELECT COALESCE(SUM(s.duration), 0) FROM playlist_tracks pt
+                              JOIN songs s ON s.id = pt.track_id WHERE pt.playlist_id = playlists.id)
+    """),
+]
+
+
+def _add_missing_columns(conn) -> None:
+    insp = inspect(conn)
+    existing_tables = set(insp.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        have = {c["name"] for c in insp.get_columns(table.name)}
+        for col in table.columns:
+            if col.name in have:
+                continue
+            ddl = CreateColumn(col).compile(dialect=conn.dialect)
+            print(f"Migrating: {table.name} ADD COLUMN {col.name}")
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+
+
+def _normalize_folder_paths(conn) -> None:
+    """
+    Folders added before add_folder normalized its path. Scans already built song paths
+    from the normalized form, so only the folder row changes. A folder whose normalized
+    path another folder of the same user already has is left alone.
+    """
+    rows = conn.execute(text("SELECT id, path, user_id FROM folders WHERE path IS NOT NULL")).all()
+    taken = {(r.user_id, r.path) for r in rows}
+    for r in rows:
+        path = normalize_folder_path(r.path)
+        if path == r.path:
+            continue
+        if (r.user_id, path) in taken:
+            print(f"⚠️ Folder {r.id} ({r.path!r}) duplicates {path!r}; not renaming it")
+            continue
+        print(f"Migrating: folder {r.id} path {r.path!r} -> {path!r}")
+        conn.execute(text("UPDATE folders SET path = :path WHERE id = :id"), {"path": path, "id": r.id})
+        taken.add((r.user_id, path))
+
+
+def _backfill_rollups(conn) -> None:
+    """listening_daily is only fed by new plays; fill it once from the existing history."""
+    from services.rollups import backfill_rollups  # imports the models
+    db = Session(bind=conn)  # joins the migration's transaction; its commit doesn't end it
+    try:
+        n = backfill_rollups(db)
+        if n:
+            print(f"Migrating: backfilled {n} listening_daily rows from play history")
+    finally:
+        db.close()
+
+
+def _create_missing_indexes(conn) -> None:
+    for table in Base.metadata.sorted_tables:
+        for idx in table.indexes:
+            idx.create(conn, checkfirst=True)
+
+
+def run_migrations(engine) -> None:
+    with engine.begin() as conn:
+        _add_missing_columns(conn)
+        for name, sql in DATA_MIGRATIONS:
+            conn.execute(text(sql))
+        _normalize_folder_paths(conn)
+        _backfill_rollups(conn)
+        _create_missing_indexes(conn)
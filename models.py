@@ -1,9 +1,9 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, TIMESTAMP, Text, UniqueConstraint,  DateTime, Boolean, Float, Index
+from sqlalchemy import Column, Integer, String, ForeignKey, TIMESTAMP, Text, UniqueConstraint,  DateTime, Boolean, Float, Index, Date, BigInteger
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from datetime import datetime, timezone
 from zoneinfo import ZoneInfo
-from database import Base
+from database import Base, ARCHIVE_SCHEMA
 
 
 # ------------------
@@ -15,6 +15,7 @@ class User(Base):
     username = Column(String, unique=True, nullable=False)
     display_name = Column(String, nullable=True)
     password_hash = Column(String, nullable=False)
+    liked_count = Column(Integer, nullable=False, server_default="0")  # kept in step with likes by routes/songs.py
 
     folders = relationship("Folder", back_populates="user", cascade="all, delete-orphan")
     playlists = relationship("Playlist", back_populates="user", cascade="all, delete-orphan")
@@ -40,11 +41,18 @@ class Song(Base):
     spotify_id = Column(String, nullable=True)
     created_at = Column(TIMESTAMP, server_default=func.now())
     folder_id = Column(Integer, ForeignKey("folders.id"), nullable=True)
+    # file fingerprint for incremental rescans (services/scanner.py)
+    file_size = Column(BigInteger, nullable=True)
+    file_mtime = Column(BigInteger, nullable=True)   # st_mtime_ns
+    inode = Column(BigInteger, nullable=True)
+    deleted_at = Column(DateTime(timezone=True), nullable=True)  # file vanished; row kept for likes/history
 
     folder = relationship("Folder", back_populates="songs")
     # NEW: likes on the song
     likes = relationship("Like", back_populates="song", cascade="all, delete-orphan")
 
+Index("idx_songs_folder_path", Song.folder_id, Song.filepath)
+
 
 # ------------------
 # Playlists
@@ -56,6 +64,9 @@ class Playlist(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     description = Column(Text, nullable=True) 
     created_at = Column(TIMESTAMP, server_default=func.now())
+    # cached for playlist headers; refreshed on every track change (services/playlists.py)
+    track_count = Column(Integer, nullable=False, server_default="0")
+    total_duration = Column(Integer, nullable=False, server_default="0")  # seconds
 
     user = relationship("User", back_populates="playlists")
     tracks = relationship("PlaylistTrack", back_populates="playlist", cascade="all, delete-orphan")
@@ -69,10 +80,12 @@ class PlaylistTrack(Base):
     id = Column(Integer, primary_key=True, index=True)
     playlist_id = Column(Integer, ForeignKey("playlists.id"), nullable=False)
     track_id = Column(Integer, ForeignKey("songs.id"), nullable=False)
-    order_index = Column(Integer)
+    order_index = Column(Integer)  # sparse sort key, see services/playlists.py
 
     playlist = relationship("Playlist", back_populates="tracks")
 
+Index("idx_playlist_tracks_playlist_order", PlaylistTrack.playlist_id, PlaylistTrack.order_index)
+
 
 # ------------------
 # Favorites
@@ -150,6 +163,9 @@ class Like(Base):
         UniqueConstraint("user_id", "song_id", name="uq_user_song_like"),
     )
 
+# keyset pagination of /songs/liked, newest first
+Index("idx_likes_user_created", Like.user_id, Like.created_at.desc(), Like.id.desc())
+
 AMS = ZoneInfo("Europe/Amsterdam")\
 
 
@@ -169,9 +185,36 @@ class PlayEvent(Base):
     duration_played_sec = Column(Integer, nullable=False, default=0)
     is_skip = Column(Boolean, nullable=False, default=False)
     device = Column(String, nullable=True)
+    client_event_id = Column(String, nullable=True)  # idempotency key from /play/batch
+
+    # ids must never be reused once old rows move to the archive
+    __table_args__ = {"sqlite_autoincrement": True}
 
 Index("idx_play_events_user_started", PlayEvent.user_id, PlayEvent.started_at.desc())
 Index("idx_play_events_user_track", PlayEvent.user_id, PlayEvent.track_id, PlayEvent.started_at.desc())
+Index("uq_play_events_user_client_event", PlayEvent.user_id, PlayEvent.client_event_id, unique=True)
+
+# Archived play events (see services/retention.py); same columns, rows keep their ids
+class PlayEventArchive(Base):
+    __tablename__ = "play_events_archive"
+    __table_args__ = {"schema": ARCHIVE_SCHEMA}
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    user_id = Column(Integer, nullable=False)
+    track_id = Column(Integer, nullable=False)
+    context_type = Column(String, nullable=True)
+    context_id = Column(String, nullable=True)
+    source_label = Column(String, nullable=True)
+    started_at = Column(DateTime(timezone=True), nullable=False)
+    ended_at = Column(DateTime(timezone=True), nullable=True)
+    position_start_sec = Column(Integer, nullable=False, default=0)
+    position_end_sec = Column(Integer, nullable=True)
+    duration_played_sec = Column(Integer, nullable=False, default=0)
+    is_skip = Column(Boolean, nullable=False, default=False)
+    device = Column(String, nullable=True)
+    client_event_id = Column(String, nullable=True)
+
+Index("idx_play_events_archive_user_started", PlayEventArchive.user_id, PlayEventArchive.started_at)
+Index("idx_play_events_archive_user_client_event", PlayEventArchive.user_id, PlayEventArchive.client_event_id)
 
 class CollectionEvent(Base):
     __tablename__ = "collection_events"
@@ -194,7 +237,57 @@ class ContextProgress(Base):
     played_pct = Column(Float, nullable=False, default=0.0)
     updated_at = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.now(tz=AMS))
 
-UniqueConstraint(ContextProgress.user_id, ContextProgress.context_type, ContextProgress.context_id, name="uq_user_ctx")
+    # ON CONFLICT target for progress upserts (older DBs carry it as uq_context_progress_user_ctx)
+    __table_args__ = (
+        UniqueConstraint("user_id", "context_type", "context_id", name="uq_user_ctx"),
+    )
+
+# ------------------
+# Daily listening rollups (one row per user, track and Amsterdam-local day)
+# ------------------
+class ListeningDaily(Base):
+    __tablename__ = "listening_daily"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=False)
+    track_id = Column(Integer, nullable=False)
+    day = Column(Date, nullable=False)                      # local day of started_at
+    seconds_played = Column(Integer, nullable=False, default=0)  # counted plays only
+    play_count = Column(Integer, nullable=False, default=0)
+    skip_count = Column(Integer, nullable=False, default=0)
+    last_played_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "track_id", "day", name="uq_listening_daily_user_track_day"),
+    )
+
+Index("idx_listening_daily_user_day", ListeningDaily.user_id, ListeningDaily.day)
+
+# ------------------
+# Id blocks (ids handed out ahead of the INSERT, e.g. by the play-event write buffer)
+# ------------------
+class IdBlock(Base):
+    __tablename__ = "id_blocks"
+    name = Column(String, primary_key=True)        # e.g. "play_events"
+    next_id = Column(Integer, nullable=False)
+
+# ------------------
+# Home tile cache (materialized /home, one row per user+tile)
+# ------------------
+class HomeTile(Base):
+    __tablename__ = "home_tiles"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=False)
+    tile = Column(String, nullable=False)          # tile "type", e.g. recently_played
+    payload = Column(Text, nullable=False)         # serialized tile JSON
+    computed_at = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.now(tz=AMS))
+    valid_until = Column(DateTime(timezone=True), nullable=True)  # time-bound tiles (week rollover)
+    stale = Column(Boolean, nullable=False, default=False)
+    generation = Column(Integer, nullable=False, server_default="0")   # +1 per invalidation; stores compare-and-set on it
+    invalidated_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "tile", name="uq_home_tile_user_tile"),
+    )
 
 # ------------------
 # Recent Searches
@@ -205,4 +298,75 @@ class RecentSearch(Base):
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
     song_id = Column(Integer, ForeignKey("songs.id", ondelete="CASCADE"), nullable=False, index=True)
     searched_at = Column(TIMESTAMP, server_default=func.now(), index=True)
-    song = relationship("Song")  
\ No newline at end of file
+    song = relationship("Song")
+
+# one row per (user, song); a repeat search bumps searched_at (routes/recent_searches.py)
+Index("uq_recent_searches_user_song", RecentSearch.user_id, RecentSearch.song_id, unique=True)
+Index("idx_recent_searches_user_searched", RecentSearch.user_id, RecentSearch.searched_at.desc())
+
+# ------------------
+# Scan jobs (folder rescans run by services/scan_jobs.py workers)
+# ------------------
+class ScanJob(Base):
+    __tablename__ = "scan_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    folder_id = Column(Integer, ForeignKey("folders.id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    status = Column(String, nullable=False, default="queued")   # queued | running | done | failed | cancelled
+    cancel_requested = Column(Boolean, nullable=False, default=False)
+    total = Column(Integer, nullable=False, default=0)          # files to read tags for
+    processed = Column(Integer, nullable=False, default=0)
+    added = Column(Integer, nullable=False, default=0)
+    changed = Column(Integer, nullable=False, default=0)
+    moved = Column(Integer, nullable=False, default=0)
+    removed = Column(Integer, nullable=False, default=0)
+    revived = Column(Integer, nullable=False, default=0)
+    unchanged = Column(Integer, nullable=False, default=0)
+    checkpoint = Column(String, nullable=True)      # last file path whose batch is committed
+    paths = Column(Text, nullable=True)             # JSON {"files": [...], "dirs": [...]} from the watcher; NULL = whole folder
+    worker = Column(String, nullable=True)          # host:pid running it
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.now(tz=AMS))
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+# at most one queued/running job per folder, so two scans of a folder never overlap
+_ACTIVE_SCAN = ScanJob.status.in_(("queued", "running"))
+Index("uq_scan_jobs_active_folder", ScanJob.folder_id, unique=True,
+      sqlite_where=_ACTIVE_SCAN, postgresql_where=_ACTIVE_SCAN)
+Index("idx_scan_jobs_status", ScanJob.status, ScanJob.id)
+
+# ------------------
+# Enrichment queue (Spotify lookups drained by services/enrichment.py workers)
+# ------------------
+class EnrichmentTask(Base):
+    __tablename__ = "enrichment_tasks"
+    id = Column(Integer, primary_key=True, index=True)
+    song_id = Column(Integer, ForeignKey("songs.id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)  # whose credentials
+    status = Column(String, nullable=False, default="pending")   # pending | running | dead (done = deleted)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.now(tz=AMS))
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.now(tz=AMS))
+    updated_at = Column(DateTime(timezone=True), nullable=True)
+
+# one pending/running task per song; re-queueing it is a no-op
+_ACTIVE_ENRICHMENT = EnrichmentTask.status.in_(("pending", "running"))
+Index("uq_enrichment_tasks_active_song", EnrichmentTask.song_id, unique=True,
+      sqlite_where=_ACTIVE_ENRICHMENT, postgresql_where=_ACTIVE_ENRICHMENT)
+Index("idx_enrichment_tasks_status_due", EnrichmentTask.status, EnrichmentTask.next_attempt_at)
+
+# ------------------
+# Spotify search cache (services/search_cache.py)
+# ------------------
+class SpotifySearchCache(Base):
+    __tablename__ = "spotify_search_cache"
+    query = Column(String, primary_key=True)                    # normalized query string, e.g. track:"x" artist:"y"
+    items = Column(Text, nullable=False)                        # JSON list of trimmed track items; [] = no match
+    fetched_at = Column(DateTime(timezone=True), nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    last_used_at = Column(DateTime(timezone=True), nullable=False)   # eviction order
+
+Index("idx_spotify_search_cache_last_used", SpotifySearchCache.last_used_at)
@@ -0,0 +1,55 @@
+# routes/admin.py
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+
+from auth import admin_user
+from database import SessionLocal
+from models import User
+from utils import query_stats
+from services.home import tile_timing_stats
+from services.enrichment import queue_stats, retry_dead_tasks
+
+router = APIRouter(tags=["Admin"], prefix="/admin")
+
+
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+@router.get("/query-stats")
+def get_query_stats(user: User = Depends(admin_user)):
+    """Per-route query counts, DB time and repeated statement shapes (likely N+1s)."""
+    return {
+        "warn_threshold": query_stats.QUERY_WARN_THRESHOLD,
+        "repeated_shape_threshold": query_stats.REPEATED_SHAPE_THRESHOLD,
+        "routes": query_stats.snapshot(),
+    }
+
+
+@router.delete("/query-stats", status_code=204)
+def reset_query_stats(user: User = Depends(admin_user)):
+    query_stats.reset()
+    return None
+
+
+@router.get("/home-tiles")
+def get_home_tile_stats(user: User = Depends(admin_user)):
+    """Per-tile compute times and deadline misses for /home."""
+    return {"tiles": tile_timing_stats()}
+
+
+@router.get("/enrichment")
+def get_enrichment_queue(db: Session = Depends(get_db), user: User = Depends(admin_user)):
+    """Spotify enrichment queue: pending/due/running counts and the latest dead-lettered tasks."""
+    return queue_stats(db)
+
+
+@router.post("/enrichment/retry-dead")
+def retry_dead_enrichment(db: Session = Depends(get_db), user: User = Depends(admin_user)):
+    requeued = retry_dead_tasks(db)
+    db.commit()
+    return {"requeued": requeued}
@@ -1,13 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from auth import get_current_user
 from database import SessionLocal
-from models import Folder, Song, User
-import os
-from mutagen import File as MutagenFile
-from mutagen import MutagenError
+from models import Folder, ScanJob, Song, User
+from schemas import ScanJobOut
+from utils.paths import normalize_folder_path
 
-from services.spotify import enrich_song_from_spotify
+from services.enrichment import enqueue_enrichment
+from services.scan_jobs import enqueue_scan, cancel_job
 
 router = APIRouter()
 
@@ -24,6 +24,7 @@ def get_db():
 # ---------- Routes ----------
 @router.post("/folders")
 def add_folder(path: str, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+    path = normalize_folder_path(path)
     existing = db.query(Folder).filter(Folder.path == path, Folder.user_id == user.id).first()
     if existing:
         return {"id": existing.id, "path": existing.path, "message": "Already exists"}
@@ -40,76 +41,44 @@ def list_folders(db: Session = Depends(get_db), user: User = Depends(get_current
     return db.query(Folder).filter(Folder.user_id == user.id).all()
 
 
-def scan_folder(folder: Folder, db: Session, user_id: int):
-    """Walk a folder, extract metadata, and insert into songs + enrich via Spotify."""
-    added_songs = []
-    for root, _, files in os.walk(folder.path):
-        for filename in files:
-            if filename.lower().endswith((".mp3", ".flac", ".wav", ".ogg")):
-                file_path = os.path.abspath(os.path.join(root, filename))
-
-                # Skip duplicates
-                existing = db.query(Song).filter_by(filepath=file_path, folder_id=folder.id).first()
-                if existing:
-                    continue
-
-                # Read tags / duration
-                audio = None
-                try:
-                    audio = MutagenFile(file_path, easy=True)
-                except MutagenError as e:
-                    print(f"⚠️ Skipping unreadable file {file_path}: {e}")
-                    continue
-                except Exception as e:
-                    print(f"⚠️ Unknown error reading {file_path}: {e}")
-                    continue
-
-                title = (
-                    audio.get("title", [os.path.splitext(filename)[0]])[0]
-                    if audio else os.path.splitext(filename)[0]
-                )
-                artist = (audio.get("artist", ["Unknown Artist"])[0] if audio else None)
-                album = (audio.get("album", ["Unknown Album"])[0] if audio else None)
-                duration = (
-                    int(audio.info.length)
-                    if audio and getattr(audio, "info", None) and getattr(audio.info, "length", None)
-                    else None
-                )
-
-                song = Song(
-                    title=title,
-                    artist=artist,
-                    album=album,
-                    duration=duration,
-                    filename=filename,
-                    filepath=file_path,
-                    folder_id=folder.id,
-                )
-                db.add(song)
-                db.commit()
-                db.refresh(song)
-
-                # Try to enrich with Spotify (best-effort; don’t crash scan)
-                try:
-                    updated = enrich_song_from_spotify(db, song, user_id)
-                    if updated:
-                        print(f"✅ Enriched: {song.artist} - {song.title}")
-                except Exception as e:
-                    print(f"⚠️ Spotify enrich failed for {filename}: {e}")
-
-                added_songs.append(song)
-
-    return added_songs
-
-
-@router.post("/folders/{folder_id}/rescan")
+@router.post("/folders/{folder_id}/rescan", status_code=202)
 def rescan_folder(folder_id: int, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+    """Queue a background scan; poll GET /folders/scan-jobs/{job_id} for progress."""
     folder = db.query(Folder).filter(Folder.id == folder_id, Folder.user_id == user.id).first()
     if not folder:
         raise HTTPException(status_code=404, detail="Folder not found")
 
-    added_songs = scan_folder(folder, db, user.id)
-    return {"message": f"Rescanned folder {folder.path}", "added": len(added_songs)}
+    job, created = enqueue_scan(db, folder.id, user.id)
+    message = f"Queued scan of {folder.path}" if created else f"Scan of {folder.path} already in progress"
+    return {"message": message, "job": ScanJobOut.model_validate(job)}
+
+
+@router.get("/folders/{folder_id}/scan-jobs", response_model=list[ScanJobOut])
+def list_scan_jobs(folder_id: int, limit: int = Query(20, ge=1, le=100),
+                   db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+    return (db.query(ScanJob)
+            .filter(ScanJob.folder_id == folder_id, ScanJob.user_id == user.id)
+            .order_by(ScanJob.id.desc())
+            .limit(limit)
+            .all())
+
+
+def _get_job(db: Session, job_id: int, user: User) -> ScanJob:
+    job = db.query(ScanJob).filter(ScanJob.id == job_id, ScanJob.user_id == user.id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Scan job not found")
+    return job
+
+
+@router.get("/folders/scan-jobs/{job_id}", response_model=ScanJobOut)
+def get_scan_job(job_id: int, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+    return _get_job(db, job_id, user)
+
+
+@router.post("/folders/scan-jobs/{job_id}/cancel", response_model=ScanJobOut)
+def cancel_scan_job(job_id: int, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+    """Queued jobs are cancelled at once; a running scan stops after its current batch."""
+    return cancel_job(db, _get_job(db, job_id, user))
 
 
 @router.post("/folders/{folder_id}/rebuild")
@@ -118,12 +87,8 @@ def rebuild_folder(folder_id: int, db: Session = Depends(get_db), user: User = D
     if not folder:
         raise HTTPException(status_code=404, detail="Folder not found")
 
-    updated = 0
-    for song in db.query(Song).filter(Song.folder_id == folder.id).all():
-        try:
-            if enrich_song_from_spotify(db, song, user.id):
-                updated += 1
-        except Exception as e:
-            print(f"⚠️ Spotify rebuild failed for {song.filename}: {e}")
-
-    return {"message": f"Rebuilt metadata for folder {folder.path}", "updated": updated}
+    # background workers do the lookups (services/enrichment.py)
+    ids = [sid for sid, in db.query(Song.id).filter(Song.folder_id == folder.id, Song.deleted_at == None)]
+    queued = enqueue_enrichment(db, ids, user.id)
+    db.commit()
+    return {"message": f"Queued metadata rebuild for folder {folder.path}", "queued": queued}
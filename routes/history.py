@@ -1,13 +1,16 @@
 # routes/history.py
 from fastapi import APIRouter, Depends
 from sqlalchemy.orm import Session
-from pydantic import BaseModel
-from typing import Optional, Literal
+from pydantic import BaseModel, Field
+from datetime import datetime
+from functools import partial
+from typing import Optional, Literal, List
 
 from database import SessionLocal
 from auth import get_current_user
 from models import User
-from services.play_events import start_event, end_event
+from services.play_events import start_event, end_event, ingest_events
+from services.event_buffer import play_buffer
 
 # ---- Local request models (avoid import issues) ----
 ContextType = Literal["playlist", "likes", "library", "unknown"]
@@ -23,6 +26,21 @@ class PlayStartIn(BaseModel):
 class PlayEndIn(BaseModel):
     event_id: int
     position_end_sec: Optional[int] = None
+
+class PlayBatchEventIn(BaseModel):
+    client_event_id: str = Field(min_length=1, max_length=64)  # client-generated idempotency key
+    track_id: int
+    context_type: Optional[ContextType] = "unknown"
+    context_id: Optional[str] = None
+    source_label: Optional[str] = None
+    device: Optional[str] = None
+    started_at: Optional[datetime] = None      # client clock; defaults to receive time
+    ended_at: Optional[datetime] = None        # omit (with position_end_sec) for a start-only event
+    position_start_sec: int = 0
+    position_end_sec: Optional[int] = None
+
+class PlayBatchIn(BaseModel):
+    events: List[PlayBatchEventIn] = Field(max_length=1000)
 # ----------------------------------------------------
 
 router = APIRouter(tags=["History"], prefix="/play")
@@ -40,8 +58,8 @@ def play_start(
     db: Session = Depends(get_db),
     user: User = Depends(get_current_user),
 ):
-    event_id = start_event(
-        db=db,
+    write = play_buffer.start_event if play_buffer else partial(start_event, db)
+    event_id = write(
         user_id=user.id,
         track_id=payload.track_id,
         context_type=payload.context_type,
@@ -58,10 +76,21 @@ def play_end(
     db: Session = Depends(get_db),
     user: User = Depends(get_current_user),
 ):
-    end_event(
-        db=db,
+    write = play_buffer.end_event if play_buffer else partial(end_event, db)
+    write(
         user_id=user.id,
         event_id=payload.event_id,
         position_end_sec=payload.position_end_sec,
     )
     return {"ok": True}
+
+@router.post("/batch")
+def play_batch(
+    payload: PlayBatchIn,
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    """Replay queued/offline events; safe to retry thanks to client_event_id."""
+    allocate_id = play_buffer.ids.next_id if play_buffer else None
+    results = ingest_events(db, user.id, [e.model_dump() for e in payload.events], allocate_id=allocate_id)
+    return {"results": results}
@@ -1,11 +1,13 @@
 # routes/home.py
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Header
+from fastapi.responses import JSONResponse, Response
 from sqlalchemy.orm import Session
+from typing import Optional
 
 from database import SessionLocal
 from auth import get_current_user
 from models import User
-from services.home import assemble_home  
+from services.home import assemble_home
 
 router = APIRouter(tags=["Home"], prefix="")
 
@@ -17,5 +19,23 @@ def get_db():
         db.close()
 
 @router.get("/home")
-def get_home(db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    return assemble_home(db, user.id)
+def get_home(
+    if_none_match: Optional[str] = Header(default=None),
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    # tiles read through their own replica sessions; `db` only touches the tile cache
+    timings = {}
+    home = assemble_home(db, user.id, timings=timings)
+    etag = f'"{home["etag"]}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "private, no-cache",
+        "Server-Timing": ", ".join(
+            f"{tile};dur={ms:.1f}" if ms is not None else f'{tile};desc="unavailable"'
+            for tile, ms in timings.items()
+        ),
+    }
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=home, headers=headers)
@@ -1,11 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException
-from pydantic import BaseModel
+import json
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, model_validator
 from sqlalchemy.orm import Session
-from database import SessionLocal
+from database import SessionLocal, ReadSessionLocal
 from models import Playlist, PlaylistTrack, Song, User
-from schemas import PlaylistBase, PlaylistCreate, SongBase
+from schemas import PlaylistBase, PlaylistCreate, SongBase, SongListOut
 from auth import get_current_user
-from typing import Optional
+from services.playlists import (
+    next_order_index, apply_track_ops, rebalance_in_background, refresh_playlist_totals, PlaylistEditError,
+)
+from utils.cursors import encode_cursor, decode_cursor
+from typing import Literal, Optional
 
 router = APIRouter()
 
@@ -16,6 +22,13 @@ def get_db():
     finally:
         db.close()
 
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
 # ---------- Payload models ----------
 class SongActionPayload(BaseModel):
     song_id: int
@@ -24,6 +37,20 @@ class PlaylistUpdatePayload(BaseModel):
     name: Optional[str] = None
     description: Optional[str | None] = None
 
+class TrackOp(BaseModel):
+    op: Literal["add", "insert_at", "remove", "move"]
+    song_id: int
+    position: Optional[int] = Field(None, ge=0)  # 0-based; insert_at / move only
+
+    @model_validator(mode="after")
+    def _position_required(self):
+        if self.op in ("insert_at", "move") and self.position is None:
+            raise ValueError(f"{self.op} needs a position")
+        return self
+
+class TrackOpsPayload(BaseModel):
+    ops: list[TrackOp] = Field(..., max_length=1000)
+
 # ---------- Create Playlist (unchanged) ----------
 @router.post("/playlists", response_model=PlaylistBase)
 def create_playlist(
@@ -40,7 +67,7 @@ def create_playlist(
 # ---------- List Playlists (unchanged) ----------
 @router.get("/playlists", response_model=list[PlaylistBase])
 def list_playlists(
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     user: User = Depends(get_current_user),
 ):
     return db.query(Playlist).filter(Playlist.user_id == user.id).all()
@@ -77,10 +104,48 @@ def add_song_to_playlist(
     if exists:
         return {"message": "Song already in playlist"}
 
-    db.add(PlaylistTrack(playlist_id=playlist_id, track_id=payload.song_id))
+    db.add(PlaylistTrack(playlist_id=playlist_id, track_id=payload.song_id,
+                         order_index=next_order_index(db, playlist_id)))
+    db.flush()
+    refresh_playlist_totals(db, playlist_id)
     db.commit()
     return {"message": "Song added to playlist"}
 
+# ---------- Bulk edit (add / insert_at / remove / move) ----------
+@router.post("/playlists/{playlist_id}/tracks/ops")
+def edit_playlist_tracks(
+    playlist_id: int,
+    payload: TrackOpsPayload,
+    background: BackgroundTasks,
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    playlist = (
+        db.query(Playlist)
+        .filter(Playlist.id == playlist_id, Playlist.user_id == user.id)
+        .first()
+    )
+    if not playlist:
+        raise HTTPException(status_code=404, detail="Playlist not found")
+
+    new_ids = {o.song_id for o in payload.ops if o.op in ("add", "insert_at")}
+    if new_ids:
+        found = {sid for (sid,) in db.query(Song.id).filter(Song.id.in_(new_ids))}
+        missing = sorted(new_ids - found)
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Song not found: {missing}")
+
+    try:
+        result = apply_track_ops(db, playlist_id, [o.model_dump() for o in payload.ops])
+    except PlaylistEditError as e:
+        db.rollback()
+        raise HTTPException(status_code=422, detail=str(e))
+    db.commit()
+
+    if result.pop("needs_rebalance"):
+        background.add_task(rebalance_in_background, playlist_id)
+    return result
+
 # ---------- Remove Song from Playlist (CHANGED: JSON body) ----------
 @router.delete("/playlists/{playlist_id}/tracks")
 def remove_song_from_playlist(
@@ -106,14 +171,42 @@ def remove_song_from_playlist(
         raise HTTPException(status_code=404, detail="Track not in playlist")
 
     db.delete(track)
+    db.flush()
+    refresh_playlist_totals(db, playlist_id)
     db.commit()
     return {"message": "Song removed from playlist"}
 
-# ---------- Get Songs in a Playlist (unchanged) ----------
-@router.get("/playlists/{playlist_id}/tracks", response_model=list[SongBase])
+# ---------- Get Songs in a Playlist ----------
+STREAM_CHUNK = 500
+
+def _playlist_tracks_query(db: Session, playlist_id: int):
+    # playlist order; idx_playlist_tracks_playlist_order serves filter + sort
+    return (
+        db.query(Song, PlaylistTrack.order_index, PlaylistTrack.id.label("entry_id"))
+        .join(PlaylistTrack, PlaylistTrack.track_id == Song.id)
+        .filter(PlaylistTrack.playlist_id == playlist_id)
+        .order_by(PlaylistTrack.order_index, PlaylistTrack.id)
+    )
+
+def _stream_playlist_tracks(playlist_id: int):
+    # StreamingResponse outlives the request's get_db session, so the stream opens its own
+    db = ReadSessionLocal()
+    try:
+        rows = (_playlist_tracks_query(db, playlist_id)
+                .execution_options(stream_results=True)
+                .yield_per(STREAM_CHUNK))
+        for song, _, _ in rows:
+            yield json.dumps(SongBase.model_validate(song).model_dump(mode="json")) + "\n"
+    finally:
+        db.close()
+
+@router.get("/playlists/{playlist_id}/tracks", response_model=SongListOut)
 def get_playlist_tracks(
     playlist_id: int,
-    db: Session = Depends(get_db),
+    limit: int = Query(200, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="nextCursor of the previous page"),
+    format: Literal["json", "ndjson"] = "json",
+    db: Session = Depends(get_read_db),
     user: User = Depends(get_current_user),
 ):
     playlist = (
@@ -124,13 +217,28 @@ def get_playlist_tracks(
     if not playlist:
         raise HTTPException(status_code=404, detail="Playlist not found")
 
-    tracks = (
-        db.query(Song)
-        .join(PlaylistTrack, PlaylistTrack.track_id == Song.id)
-        .filter(PlaylistTrack.playlist_id == playlist_id)
-        .all()
-    )
-    return tracks
+    if format == "ndjson":
+        # whole playlist, one SongBase JSON object per line, read through a server-side cursor
+        return StreamingResponse(_stream_playlist_tracks(playlist_id), media_type="application/x-ndjson")
+
+    q = _playlist_tracks_query(db, playlist_id)
+    if cursor:
+        try:
+            last_index, entry_id = decode_cursor(cursor, (int, int))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        q = q.filter(
+            (PlaylistTrack.order_index > last_index) |
+            ((PlaylistTrack.order_index == last_index) & (PlaylistTrack.id > entry_id))
+        )
+
+    rows = q.limit(limit + 1).all()
+    items = rows[:limit]
+    return {
+        "items": [SongBase.model_validate(song) for song, _, _ in items],
+        "nextCursor": encode_cursor(items[-1].order_index, items[-1].entry_id) if len(rows) == limit + 1 else None,
+        "total": playlist.track_count,
+    }
 
 # ---------- Delete Playlist (unchanged) ----------
 @router.delete("/playlists/{playlist_id}")
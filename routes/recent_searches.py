@@ -1,8 +1,10 @@
+import os
+from datetime import datetime, timezone
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import desc
+from sqlalchemy import delete, desc, select
 
-from database import SessionLocal
+from database import SessionLocal, upsert_insert
 from models import RecentSearch, Song, User
 from schemas import RecentSearchOut, RecentSearchCreate, RecentSearchListOut, RecentSearchWithSongListOut
 from auth import get_current_user
@@ -10,6 +12,8 @@ from auth import get_current_user
 
 router = APIRouter(prefix="/recent-searches", tags=["recent-searches"])
 
+RECENT_SEARCHES_MAX = int(os.getenv("RECENT_SEARCHES_MAX", "200"))  # per user; the list endpoint returns ≤ 200
+
 # DB dependency
 def get_db():
     db = SessionLocal()
@@ -41,25 +45,33 @@ def add_recent_search(
     current_user: User = Depends(get_current_user),
 ):
     # ensure song exists
-    song = db.query(Song).filter(Song.id == payload.song_id).first()
-    if not song:
+    if not db.query(Song.id).filter(Song.id == payload.song_id).first():
         raise HTTPException(status_code=404, detail="song_not_found")
 
-    # de-dupe by (user_id, song_id) and move to top
-    existing = (
-        db.query(RecentSearch)
-        .filter(RecentSearch.user_id == current_user.id, RecentSearch.song_id == payload.song_id)
-        .first()
+    # one row per (user, song): a repeat search just moves it to the top
+    now = datetime.now(timezone.utc)
+    stmt = upsert_insert(db, RecentSearch).values(
+        user_id=current_user.id, song_id=payload.song_id, searched_at=now,
     )
-    if existing:
-        db.delete(existing)
-        db.flush()
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[RecentSearch.user_id, RecentSearch.song_id],
+        set_={"searched_at": stmt.excluded.searched_at},
+    ).returning(RecentSearch.id, RecentSearch.song_id, RecentSearch.searched_at)
+    item = db.execute(stmt).one()
 
-    item = RecentSearch(user_id=current_user.id, song_id=payload.song_id)
-    db.add(item)
+    # keep only the newest RECENT_SEARCHES_MAX rows (served by idx_recent_searches_user_searched)
+    keep = (
+        select(RecentSearch.id)
+        .where(RecentSearch.user_id == current_user.id)
+        .order_by(RecentSearch.searched_at.desc())
+        .limit(RECENT_SEARCHES_MAX)
+    )
+    db.execute(
+        delete(RecentSearch)
+        .where(RecentSearch.user_id == current_user.id, RecentSearch.id.not_in(keep))
+    )
     db.commit()
-    db.refresh(item)
-    return item
+    return item._asdict()
 
 @router.delete("/{recent_id}", status_code=204)
 def delete_recent_search(
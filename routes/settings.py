@@ -4,6 +4,7 @@ from database import SessionLocal
 from models import Setting, User
 from schemas import SettingsUpdate, SpotifyCredentials
 from auth import get_current_user
+from services.enrichment import retry_dead_tasks
 
 router = APIRouter(prefix="/settings", tags=["Settings"])
 
@@ -67,6 +68,7 @@ def save_spotify_credentials(
         Setting(user_id=current_user.id, key="spotify_client_secret", value=creds.client_secret),
     ]
     db.add_all(new_settings)
+    retry_dead_tasks(db, current_user.id)  # lookups that failed for lack of credentials
     db.commit()
 
     return {"message": "Spotify credentials saved", "saved": [s.key for s in new_settings]}
@@ -1,18 +1,21 @@
 from fastapi import APIRouter, Depends, HTTPException, Request, Query, Header
 from fastapi.responses import FileResponse, Response, StreamingResponse
-from sqlalchemy import func, or_
+from sqlalchemy import String, and_, cast, delete, func, literal, or_, select
 from sqlalchemy.orm import Session
-from database import SessionLocal
+from database import SessionLocal, ReadSessionLocal, upsert_insert
 from models import Song, Folder, User, Like
-from schemas import SongBase, SongListOut
+from schemas import SongBase, SongListOut, SongIdsIn
 from auth import get_current_user, dev_or_current_user
-from services.spotify import enrich_song_from_spotify
+from services.spotify import enrich_song_from_spotify, SpotifyError, SpotifyNotConfigured, SpotifyRateLimited
+from services.enrichment import enqueue_enrichment
+from services.home import invalidate_home_tiles, FAVORITES, ALL_TILES
 from sqlalchemy.exc import IntegrityError
 
 import os, shlex, subprocess, mimetypes, time, uuid, threading, shutil
 from typing import Optional, Tuple, Literal
 
 from utils.hls_signing import make_hls_token, verify_hls_token
+from utils.cursors import encode_cursor, decode_cursor
 
 router = APIRouter()
 
@@ -40,6 +43,13 @@ def get_db():
     finally:
         db.close()
 
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
 # ========= HELPERS =========
 def _get_song_and_path(db: Session, song_id: int, user_id: Optional[int]) -> tuple[Song, str]:
     q = db.query(Song).join(Song.folder).filter(Song.id == song_id)
@@ -183,13 +193,14 @@ def get_songs(
     sort: Sort = "created_desc",
     q: Optional[str] = None,
     include_total: bool = False,
-    db: Session = Depends(get_db),
+    include_liked: bool = False,
+    db: Session = Depends(get_read_db),
     user: User = Depends(get_current_user),
 ):
     base = (
         db.query(Song)
         .join(Song.folder)
-        .filter(Folder.user_id == user.id)
+        .filter(Folder.user_id == user.id, Song.deleted_at == None)
     )
 
     if q:
@@ -229,12 +240,24 @@ def get_songs(
             # simple id-based paging; fine if titles aren’t heavily duplicated
             ordered = ordered.filter(Song.id > cursor)
 
+    if include_liked:
+        # hearts in the same query: likes has a unique (user_id, song_id) key, so no row fan-out
+        ordered = (ordered
+                   .outerjoin(Like, and_(Like.song_id == Song.id, Like.user_id == user.id))
+                   .add_columns(Like.id.isnot(None).label("is_liked")))
+
     rows = ordered.limit(limit + 1).all()
     items = rows[:limit]
-    next_cursor = items[-1].id if len(rows) == limit + 1 else None
+    songs = [r[0] for r in items] if include_liked else items
+    next_cursor = songs[-1].id if len(rows) == limit + 1 else None
+
+    out = [SongBase.model_validate(s) for s in songs]
+    if include_liked:
+        for song_out, row in zip(out, items):
+            song_out.is_liked = bool(row.is_liked)
 
     return {
-        "items": [SongBase.model_validate(s) for s in items],
+        "items": out,
         "nextCursor": next_cursor,
         "total": base.count() if include_total else None,
     }
@@ -415,24 +438,124 @@ def hls_segment(
 
 
 
-@router.get("/songs/liked")
+def _bump_liked_count(db: Session, user_id: int, delta: int) -> None:
+    if delta:
+        db.query(User).filter(User.id == user_id).update(
+            {User.liked_count: User.liked_count + delta}, synchronize_session=False
+        )
+
+@router.get("/songs/liked", response_model=SongListOut)
 def get_liked_songs(
-    db: Session = Depends(get_db),
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = Query(None, description="nextCursor of the previous page"),
+    include_total: bool = False,
+    db: Session = Depends(get_read_db),
     user: User = Depends(get_current_user),
 ):
-    songs = (
-        db.query(Song)
+    # newest like first; idx_likes_user_created serves both the filter and the order.
+    # The cursor holds created_at as stored: a round trip through datetime changes the text
+    # SQLite compares ("12:00:00" vs "12:00:00.000000") and breaks ties.
+    q = (
+        db.query(Song, Like.id.label("like_id"), cast(Like.created_at, String).label("liked_at"))
         .join(Like, Like.song_id == Song.id)
         .filter(Like.user_id == user.id)
-        .order_by(Like.created_at.desc())
-        .all()
+        .order_by(Like.created_at.desc(), Like.id.desc())
     )
-    return songs
-    
+    if cursor:
+        try:
+            liked_at, like_id = decode_cursor(cursor, (str, int))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        if db.get_bind().dialect.name == "sqlite":
+            last_at = literal(liked_at, String)
+        else:
+            last_at = cast(literal(liked_at, String), Like.created_at.type)
+        q = q.filter(
+            (Like.created_at < last_at) |
+            ((Like.created_at == last_at) & (Like.id < like_id))
+        )
+
+    rows = q.limit(limit + 1).all()
+    items = rows[:limit]
+    next_cursor = encode_cursor(items[-1].liked_at, items[-1].like_id) if len(rows) == limit + 1 else None
+
+    out = [SongBase.model_validate(row.Song) for row in items]
+    for song_out in out:
+        song_out.is_liked = True
+    total = None
+    if include_total:
+        total = db.query(User.liked_count).filter(User.id == user.id).scalar()
+    return {"items": out, "nextCursor": next_cursor, "total": total}
+
+@router.get("/songs/liked/status")
+def get_liked_status(
+    ids: str = Query(..., description="comma-separated song ids, at most 1000"),
+    format: Literal["ids", "bitmap"] = "ids",
+    db: Session = Depends(get_read_db),
+    user: User = Depends(get_current_user),
+):
+    try:
+        song_ids = [int(x) for x in ids.split(",") if x.strip()]
+    except ValueError:
+        raise HTTPException(status_code=422, detail="ids must be comma-separated integers")
+    if len(song_ids) > 1000:
+        raise HTTPException(status_code=422, detail="at most 1000 ids")
+
+    liked = {
+        sid for (sid,) in db.query(Like.song_id)
+        .filter(Like.user_id == user.id, Like.song_id.in_(song_ids))
+    } if song_ids else set()
+    if format == "bitmap":
+        # one character per requested id, in request order: "1" = liked
+        return {"bitmap": "".join("1" if sid in liked else "0" for sid in song_ids)}
+    return {"liked": sorted(liked)}
+
+@router.post("/songs/likes/add")
+def like_songs(
+    payload: SongIdsIn,
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    """Like many songs at once; unknown ids and songs already liked are skipped."""
+    if not payload.song_ids:
+        return {"added": []}
+    stmt = upsert_insert(db, Like).from_select(
+        ["user_id", "song_id"],
+        select(literal(user.id), Song.id).where(Song.id.in_(set(payload.song_ids))),
+    )
+    stmt = stmt.on_conflict_do_nothing(index_elements=[Like.user_id, Like.song_id]).returning(Like.song_id)
+    added = sorted(db.execute(stmt).scalars().all())
+    if added:
+        _bump_liked_count(db, user.id, len(added))
+        invalidate_home_tiles(db, user.id, [FAVORITES])
+    db.commit()
+    return {"added": added}
+
+@router.post("/songs/likes/remove")
+def unlike_songs(
+    payload: SongIdsIn,
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    if not payload.song_ids:
+        return {"removed": []}
+    removed = sorted(db.execute(
+        delete(Like)
+        .where(Like.user_id == user.id, Like.song_id.in_(set(payload.song_ids)))
+        .returning(Like.song_id)
+    ).scalars().all())
+    if removed:
+        _bump_liked_count(db, user.id, -len(removed))
+        invalidate_home_tiles(db, user.id, [FAVORITES])
+    db.commit()
+    return {"removed": removed}
+
 # ========= EXISTING ENDPOINTS =========
 @router.get("/songs/{song_id}")
 def get_song(song_id: int, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    song = db.query(Song).join(Song.folder).filter(Song.id == song_id, Song.folder.has(user_id=user.id)).first()
+    song = (db.query(Song).join(Song.folder)
+            .filter(Song.id == song_id, Song.folder.has(user_id=user.id), Song.deleted_at == None)
+            .first())
     if not song:
         raise HTTPException(status_code=404, detail="Song not found")
     return song
@@ -447,25 +570,31 @@ def enrich_one(song_id: int, db: Session = Depends(get_db), user: User = Depends
     )
     if not song:
         raise HTTPException(status_code=404, detail="Song not found")
-    ok = enrich_song_from_spotify(db, song, user.id)
+    try:
+        ok = enrich_song_from_spotify(db, song, user.id, blocking=False)
+    except SpotifyRateLimited as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(int(e.retry_after))})
+    except SpotifyError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    except SpotifyNotConfigured as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if ok:
+        # titles/covers are baked into cached tiles
+        invalidate_home_tiles(db, None, ALL_TILES)
+        db.commit()
     return {"song_id": song_id, "updated": ok}
 
 @router.post("/songs/enrich-missing")
 def enrich_missing(db: Session = Depends(get_db), user: User = Depends(dev_or_current_user)):
-    songs = (
-        db.query(Song)
+    """Queue every not-yet-matched song for the enrichment workers (services/enrichment.py)."""
+    ids = [sid for sid, in (
+        db.query(Song.id)
         .join(Song.folder)
-        .filter(Song.folder.has(user_id=user.id), (Song.spotify_id == None))
-        .all()
-    )
-    updated = 0
-    for s in songs:
-        try:
-            if enrich_song_from_spotify(db, s, user.id):
-                updated += 1
-        except Exception as e:
-            print(f"⚠️ enrich error for {s.filename}: {e}")
-    return {"count": len(songs), "updated": updated}
+        .filter(Folder.user_id == user.id, Song.spotify_id == None, Song.deleted_at == None)
+    )]
+    queued = enqueue_enrichment(db, ids, user.id)
+    db.commit()
+    return {"count": len(ids), "queued": queued}
 
 @router.post("/songs/{song_id}/like")
 def like_song(
@@ -483,6 +612,8 @@ def like_song(
         return {"liked": True}
 
     db.add(Like(user_id=user.id, song_id=song_id))
+    _bump_liked_count(db, user.id, 1)
+    invalidate_home_tiles(db, user.id, [FAVORITES])
     try:
         db.commit()
     except IntegrityError:
@@ -499,6 +630,8 @@ def unlike_song(
     like = db.query(Like).filter_by(user_id=user.id, song_id=song_id).first()
     if like:
         db.delete(like)
+        _bump_liked_count(db, user.id, -1)
+        invalidate_home_tiles(db, user.id, [FAVORITES])
         db.commit()
     return {"liked": False}
 
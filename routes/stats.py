@@ -0,0 +1,60 @@
+# routes/stats.py
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+from typing import Literal, Optional
+
+from database import ReadSessionLocal
+from auth import get_current_user
+from models import User
+from services.rollups import period_bounds, top_tracks
+from services.analytics import user_snapshot, hour_of_week_heatmap, artist_skip_rates, listening_streaks
+
+router = APIRouter(tags=["Stats"], prefix="/stats")
+
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+@router.get("/top-tracks")
+def get_top_tracks(
+    period: Literal["week", "month", "all"] = "week",
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_read_db),
+    user: User = Depends(get_current_user),
+):
+    start, end = period_bounds(period)
+    return {
+        "period": period,
+        "range": {"start": start.isoformat() if start else None, "end": end.isoformat() if end else None},
+        "items": top_tracks(db, user.id, start, end, limit=limit),
+    }
+
+@router.get("/heatmap")
+def get_heatmap(
+    days: Optional[int] = Query(None, ge=1, description="only the last N days; all time if omitted"),
+    db: Session = Depends(get_read_db),
+    user: User = Depends(get_current_user),
+):
+    snap = user_snapshot(db, user.id)
+    return {"days": days, **hour_of_week_heatmap(snap, days)}
+
+@router.get("/skip-rate/artists")
+def get_artist_skip_rates(
+    min_plays: int = Query(5, ge=1),
+    limit: int = Query(50, ge=1, le=500),
+    days: Optional[int] = Query(None, ge=1),
+    db: Session = Depends(get_read_db),
+    user: User = Depends(get_current_user),
+):
+    snap = user_snapshot(db, user.id)
+    return {"items": artist_skip_rates(db, snap, min_plays=min_plays, limit=limit, days=days)}
+
+@router.get("/streaks")
+def get_streaks(
+    db: Session = Depends(get_read_db),
+    user: User = Depends(get_current_user),
+):
+    return listening_streaks(user_snapshot(db, user.id))
@@ -1,6 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
-from typing import List, Optional, Literal
+from typing import List, Optional, Literal, Union
 
 
 # ------------------
@@ -14,15 +14,19 @@ class SongBase(BaseModel):
     filename: str
     cover_url: str | None
     spotify_id: str | None
+    is_liked: bool | None = None  # only filled when the endpoint was asked to (include_liked)
 
     class Config:
         from_attributes = True 
 
 class SongListOut(BaseModel):
     items: List[SongBase]
-    nextCursor: Optional[int] = None
+    nextCursor: Optional[Union[int, str]] = None   # /songs: last song id; otherwise an opaque token
     total: Optional[int] = None  
 
+class SongIdsIn(BaseModel):
+    song_ids: List[int] = Field(..., max_length=1000)
+
 # ------------------
 # Playlists
 # ------------------
@@ -32,6 +36,8 @@ class PlaylistBase(BaseModel):
     user_id: int
     description: Optional[str] = None
     created_at: datetime
+    track_count: int = 0
+    total_duration: int = 0  # seconds
 
     class Config:
         from_attributes = True
@@ -131,4 +137,29 @@ class RecentSearchWithSongOut(BaseModel):
         from_attributes = True
 
 class RecentSearchWithSongListOut(BaseModel):
-    items: list[RecentSearchWithSongOut]
\ No newline at end of file
+    items: list[RecentSearchWithSongOut]
+
+# ------------------
+# Scan jobs
+# ------------------
+class ScanJobOut(BaseModel):
+    id: int
+    folder_id: int
+    status: str
+    cancel_requested: bool
+    total: int
+    processed: int
+    added: int
+    changed: int
+    moved: int
+    removed: int
+    revived: int
+    unchanged: int
+    checkpoint: str | None = None
+    error: str | None = None
+    created_at: datetime
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+
+    class Config:
+        from_attributes = True
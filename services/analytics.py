@@ -0,0 +1,289 @@
+# services/analytics.py
+"""
+Listening analytics over a per-user columnar snapshot of play events.
+
+A snapshot holds one NumPy array per column (event id, track id, local start time,
+seconds played, skip flag) for all of a user's finished plays, hot and archived. It is
+built once and then refreshed incrementally: each request only reads events with an id
+above the snapshot's watermark minus ANALYTICS_RESCAN_IDS, plus the still-open events it
+saw last time. Ids aren't committed in order (the write-behind buffer's id blocks across
+processes, PostgreSQL sequences), so the trailing window catches rows that appear behind
+the watermark; a row committed more than ANALYTICS_RESCAN_IDS ids behind the newest one
+seen is missed until the snapshot is dropped. Keep it above PLAY_ID_BLOCK_SIZE times the
+number of processes writing play events. Aggregations run on a view taken under the
+snapshot's lock and are vectorized over the arrays.
+
+Times are Amsterdam wall-clock seconds since 1970-01-01 ("local epoch"), so day and
+hour buckets need no timezone math.
+"""
+import os
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from itertools import chain
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+import numpy as np
+from sqlalchemy import BigInteger, case, cast, func, select
+from sqlalchemy.orm import Session
+
+from models import PlayEvent, PlayEventArchive, Song
+from services.rollups import MIN_PLAY_SECONDS
+
+AMS = ZoneInfo("Europe/Amsterdam")
+ANALYTICS_CACHE_USERS = int(os.getenv("ANALYTICS_CACHE_USERS", "32"))  # snapshots kept in memory
+ANALYTICS_RESCAN_IDS = int(os.getenv("ANALYTICS_RESCAN_IDS", "10000"))  # trailing id window re-read per refresh
+FETCH_CHUNK = 100_000
+KEY_CHUNK = 500
+OPEN_EVENT_TTL = 24 * 3600  # stop waiting for an open event to end after a day
+DAY = 86400
+EPOCH = date(1970, 1, 1)
+
+
+def _local_epoch(db: Session, col):
+    """Start time as Amsterdam wall-clock seconds, computed in SQL (parsing 10M datetimes in Python is slow)."""
+    if db.get_bind().dialect.name == "postgresql":
+        return cast(func.extract("epoch", func.timezone("Europe/Amsterdam", col)), BigInteger)
+    return cast(func.strftime("%s", col), BigInteger)  # SQLite stores naive Amsterdam times
+
+
+def _now_local_epoch() -> int:
+    now = datetime.now(tz=AMS).replace(tzinfo=None)
+    return int((now - datetime(1970, 1, 1)).total_seconds())
+
+
+class PlayColumns:
+    """A fixed set of plays (rows of a snapshot at one point in time); what aggregations read."""
+
+    def __init__(self, data: np.ndarray):
+        self._data = data
+
+    def __len__(self) -> int:
+        return self._data.shape[1]
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._data[0]
+
+    @property
+    def track_id(self) -> np.ndarray:
+        return self._data[1]
+
+    @property
+    def started(self) -> np.ndarray:
+        return self._data[2]
+
+    @property
+    def seconds(self) -> np.ndarray:
+        return self._data[3]
+
+    @property
+    def skip(self) -> np.ndarray:
+        return self._data[4] != 0
+
+
+class UserSnapshot:
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.lock = threading.Lock()
+        self.last_id = 0
+        self.loaded = False
+        self.pending: dict[int, int] = {}  # open event id → local start, picked up once it ends
+        # one row per column (id, track_id, started, seconds, is_skip); grown by doubling so
+        # small refreshes don't copy the whole history
+        self._data = np.empty((5, 0), dtype=np.int64)
+        self._n = 0
+        self._recent = np.empty(0, dtype=np.int64)  # ids held within the rescan window
+
+    def __len__(self) -> int:
+        return self._n
+
+    def view(self) -> PlayColumns:
+        """
+        The plays as of now. Rows below _n are never rewritten (a refresh only appends,
+        into the same buffer or a grown copy), so a slice taken under the lock stays consistent.
+        """
+        with self.lock:
+            return PlayColumns(self._data[:, :self._n])
+
+    def _append(self, rows: np.ndarray) -> None:
+        k = len(rows)
+        if self._n + k > self._data.shape[1]:
+            grown = np.empty((5, max(2 * self._data.shape[1], self._n + k, 1024)), dtype=np.int64)
+            grown[:, :self._n] = self._data[:, :self._n]
+            self._data = grown
+        self._data[:, self._n:self._n + k] = rows[:, :5].T
+        self._n += k
+
+    def _fetch(self, db: Session, q, advance: bool = True, known: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Append finished rows of (id, track_id, started, seconds, is_skip, is_open), except
+        `known` ids, and remember open ones. Returns the ids appended.
+        """
+        appended = []
+        result = db.execute(q.execution_options(yield_per=FETCH_CHUNK))
+        for part in result.partitions():
+            # np.array() on Row objects is ~30x slower than on a flat iterator
+            arr = np.fromiter(chain.from_iterable(part), dtype=np.int64, count=len(part) * 6).reshape(-1, 6)
+            if known is not None and len(known):
+                arr = arr[~np.isin(arr[:, 0], known)]
+                if not len(arr):
+                    continue
+            is_open = arr[:, 5] == 1
+            for eid, started in arr[is_open][:, [0, 2]]:
+                self.pending[int(eid)] = int(started)
+            self._append(arr[~is_open])
+            appended.append(arr[~is_open, 0])
+            if advance:
+                self.last_id = max(self.last_id, int(arr[:, 0].max()))
+        return np.concatenate(appended) if appended else np.empty(0, dtype=np.int64)
+
+    def _columns(self, db: Session, src):
+        return (
+            src.c.id, src.c.track_id, _local_epoch(db, src.c.started_at),
+            func.coalesce(src.c.duration_played_sec, 0),
+            case((src.c.is_skip == True, 1), else_=0),
+            case((src.c.ended_at == None, 1), else_=0),
+        )
+
+    def refresh(self, db: Session) -> None:
+        with self.lock:
+            # archived rows were already seen while hot, so only the first load reads the archive.
+            # Both reads run in the same transaction, so a concurrent archive batch can't split them.
+            sources = [PlayEvent.__table__] if self.loaded else [PlayEventArchive.__table__, PlayEvent.__table__]
+            floor = max(0, self.last_id - ANALYTICS_RESCAN_IDS) if self.loaded else 0
+            appended = []
+            for src in sources:
+                appended.append(self._fetch(db, select(*self._columns(db, src))
+                                            .where(src.c.user_id == self.user_id, src.c.id > floor),
+                                            known=self._recent))
+            self.loaded = True
+            if self.pending:  # ended within the window: already appended
+                waiting = np.fromiter(self.pending, dtype=np.int64, count=len(self.pending))
+                for eid in waiting[np.isin(waiting, np.concatenate(appended))].tolist():
+                    self.pending.pop(eid)
+
+            cutoff = _now_local_epoch() - OPEN_EVENT_TTL
+            self.pending = {eid: started for eid, started in self.pending.items() if started >= cutoff}
+            waiting = list(self.pending)
+            hot = PlayEvent.__table__
+            for i in range(0, len(waiting), KEY_CHUNK):
+                ended = select(*self._columns(db, hot)).where(
+                    hot.c.id.in_(waiting[i:i + KEY_CHUNK]), hot.c.ended_at != None)
+                ids = self._fetch(db, ended, advance=False)  # below the watermark
+                appended.append(ids)
+                for eid in ids.tolist():
+                    self.pending.pop(eid, None)
+
+            recent = np.concatenate([self._recent, *appended])
+            self._recent = recent[recent > self.last_id - ANALYTICS_RESCAN_IDS]
+
+
+_lock = threading.Lock()
+_snapshots: "OrderedDict[int, UserSnapshot]" = OrderedDict()
+
+
+def user_snapshot(db: Session, user_id: int) -> PlayColumns:
+    """The user's plays, brought up to date. Least recently used snapshots are evicted."""
+    with _lock:
+        snap = _snapshots.get(user_id)
+        if snap is None:
+            snap = _snapshots[user_id] = UserSnapshot(user_id)
+        _snapshots.move_to_end(user_id)
+        while len(_snapshots) > ANALYTICS_CACHE_USERS:
+            _snapshots.popitem(last=False)
+    snap.refresh(db)
+    return snap.view()
+
+
+def drop_snapshot(user_id: Optional[int] = None) -> None:
+    """Forget cached snapshots (after rewriting history, e.g. a manual data fix)."""
+    with _lock:
+        if user_id is None:
+            _snapshots.clear()
+        else:
+            _snapshots.pop(user_id, None)
+
+
+def _window(snap: PlayColumns, days: Optional[int]) -> np.ndarray:
+    """Mask of counted plays (≥ MIN_PLAY_SECONDS), optionally limited to the last N days."""
+    mask = snap.seconds >= MIN_PLAY_SECONDS
+    if days:
+        mask &= snap.started >= _now_local_epoch() - days * DAY
+    return mask
+
+
+# ---------- Aggregations ----------
+def hour_of_week_heatmap(snap: PlayColumns, days: Optional[int] = None) -> dict:
+    """7×24 grid (Monday first) of minutes played and play counts by local start hour."""
+    mask = _window(snap, days)
+    started = snap.started[mask]
+    weekday = (started // DAY + 3) % 7  # 1970-01-01 was a Thursday
+    bucket = weekday * 24 + (started % DAY) // 3600
+    seconds = np.bincount(bucket, weights=snap.seconds[mask], minlength=168)
+    plays = np.bincount(bucket, minlength=168)
+    return {
+        "minutes": np.round(seconds / 60, 1).reshape(7, 24).tolist(),
+        "plays": plays.reshape(7, 24).tolist(),
+    }
+
+
+def artist_skip_rates(db: Session, snap: PlayColumns, min_plays: int = 5, limit: int = 50,
+                      days: Optional[int] = None) -> list[dict]:
+    """Skip rate per artist over all finished plays, highest first."""
+    mask = np.ones(len(snap), dtype=bool)
+    if days:
+        mask &= snap.started >= _now_local_epoch() - days * DAY
+    # track ids are small dense ints, so bincount beats np.unique (a full sort) here
+    track_plays = np.bincount(snap.track_id[mask])
+    track_skips = np.bincount(snap.track_id[mask], weights=snap.skip[mask], minlength=len(track_plays))
+    tracks = np.flatnonzero(track_plays)
+    if not len(tracks):
+        return []
+    track_plays, track_skips = track_plays[tracks], track_skips[tracks]
+
+    ids = tracks.tolist()
+    artist_of = {}
+    for i in range(0, len(ids), KEY_CHUNK):
+        artist_of.update(db.query(Song.id, Song.artist).filter(Song.id.in_(ids[i:i + KEY_CHUNK])).all())
+    names = np.array([artist_of.get(t) or "Unknown Artist" for t in ids], dtype=object)
+
+    artists, a_inv = np.unique(names, return_inverse=True)
+    plays = np.bincount(a_inv, weights=track_plays)
+    skips = np.bincount(a_inv, weights=track_skips)
+    keep = plays >= min_plays
+    rate = np.divide(skips, plays, out=np.zeros_like(skips), where=plays > 0)
+    order = np.lexsort((-plays[keep], -rate[keep]))[:limit]
+    return [
+        {"artist": a, "plays": int(p), "skips": int(s), "skip_rate": round(float(r), 3)}
+        for a, p, s, r in zip(artists[keep][order], plays[keep][order], skips[keep][order], rate[keep][order])
+    ]
+
+
+def listening_streaks(snap: PlayColumns) -> dict:
+    """Current and longest run of consecutive local days with at least one counted play."""
+    day = snap.started[_window(snap, None)] // DAY
+    if not len(day):
+        return {"active_days": 0, "current": None, "longest": None}
+    first = day.min()
+    days = np.flatnonzero(np.bincount(day - first)) + first  # sorted distinct days
+    breaks = np.flatnonzero(np.diff(days) != 1)
+    starts = np.concatenate([[0], breaks + 1])
+    ends = np.concatenate([breaks, [len(days) - 1]])
+    lengths = ends - starts + 1
+
+    def run(i):
+        return {
+            "days": int(lengths[i]),
+            "start": (EPOCH + timedelta(days=int(days[starts[i]]))).isoformat(),
+            "end": (EPOCH + timedelta(days=int(days[ends[i]]))).isoformat(),
+        }
+
+    today = _now_local_epoch() // DAY
+    longest = int(np.argmax(lengths))  # earliest of equally long runs
+    return {
+        "active_days": int(len(days)),
+        "current": run(len(lengths) - 1) if days[-1] >= today - 1 else None,
+        "longest": run(longest),
+    }
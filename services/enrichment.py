@@ -0,0 +1,232 @@
+# services/enrichment.py
+"""
+Spotify enrichment queue.
+
+Scans, folder rebuilds and /songs/enrich-missing only insert enrichment_tasks rows (in
+the caller's transaction); ENRICH_WORKERS background threads drain them. Every Spotify
+call goes through one token bucket (services/spotify.py), and a 429 pauses it for the
+Retry-After the server asked for. Workers don't sleep through a pause (their task would
+look abandoned after ENRICH_STALE_SECONDS and be claimed twice): the task goes back in
+the queue for that long without using up an attempt. Other failures (network errors,
+5xx) are retried with exponential backoff plus jitter. After ENRICH_MAX_ATTEMPTS, or
+right away when the user has no Spotify credentials, a task is dead-lettered: status
+"dead", last_error kept. Saving credentials, or POST /admin/enrichment/retry-dead, puts
+dead tasks back in the queue. A finished task is deleted.
+"""
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+from zoneinfo import ZoneInfo
+from sqlalchemy import and_, delete, event, func, or_, select, update
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, upsert_insert
+from models import EnrichmentTask, Song
+from services.home import invalidate_home_tiles, ALL_TILES
+from services.spotify import enrich_song_from_spotify, SpotifyNotConfigured, SpotifyRateLimited
+
+AMS = ZoneInfo("Europe/Amsterdam")
+ENRICH_WORKERS = int(os.getenv("ENRICH_WORKERS", "4"))            # songs looked up at once; 0 = leave the queue alone
+ENRICH_MAX_ATTEMPTS = int(os.getenv("ENRICH_MAX_ATTEMPTS", "6"))
+ENRICH_BACKOFF_SECONDS = float(os.getenv("ENRICH_BACKOFF_SECONDS", "30"))   # first retry, doubles
+ENRICH_BACKOFF_MAX_SECONDS = float(os.getenv("ENRICH_BACKOFF_MAX_SECONDS", "21600"))
+ENRICH_POLL_SECONDS = float(os.getenv("ENRICH_POLL_SECONDS", "5"))
+ENRICH_STALE_SECONDS = 600      # a "running" task this old belonged to a worker that died
+TILE_REFRESH_SECONDS = 30       # enriched titles/covers reach the cached home tiles this often
+ENQUEUE_CHUNK = 500
+
+
+def enqueue_enrichment(db: Session, song_ids: list[int], user_id: int) -> int:
+    """Queue songs for enrichment with this user's credentials. Joins the caller's transaction."""
+    if not song_ids:
+        return 0
+    now = datetime.now(tz=AMS)
+    for i in range(0, len(song_ids), ENQUEUE_CHUNK):
+        chunk = song_ids[i:i + ENQUEUE_CHUNK]
+        # a fresh request supersedes what was dead-lettered before
+        db.execute(delete(EnrichmentTask).where(EnrichmentTask.song_id.in_(chunk), EnrichmentTask.status == "dead"))
+        db.execute(upsert_insert(db, EnrichmentTask).on_conflict_do_nothing(), [
+            {"song_id": sid, "user_id": user_id, "status": "pending", "attempts": 0,
+             "next_attempt_at": now, "created_at": now} for sid in chunk
+        ])
+    _wake_after_commit(db)
+    return len(song_ids)
+
+
+def retry_dead_tasks(db: Session, user_id: Optional[int] = None) -> int:
+    """Put dead-lettered tasks (of one user, or everyone's) back in the queue. Does not commit."""
+    q = update(EnrichmentTask).where(EnrichmentTask.status == "dead")
+    if user_id is not None:
+        q = q.where(EnrichmentTask.user_id == user_id)
+    n = db.execute(q.values(status="pending", attempts=0, next_attempt_at=datetime.now(tz=AMS))).rowcount
+    _wake_after_commit(db)
+    return n
+
+
+def _wake_after_commit(db: Session) -> None:
+    """Wake idle workers once the caller commits; before that they can't see the tasks."""
+    if not db.info.get("wake_enrichment"):
+        db.info["wake_enrichment"] = True
+        event.listen(db, "after_commit", _wake_workers, once=True)
+
+
+def _wake_workers(session: Session) -> None:
+    session.info.pop("wake_enrichment", None)
+    _wake.set()
+
+
+def queue_stats(db: Session) -> dict:
+    counts = dict(db.query(EnrichmentTask.status, func.count(EnrichmentTask.id)).group_by(EnrichmentTask.status).all())
+    now = datetime.now(tz=AMS)
+    due = (db.query(func.count(EnrichmentTask.id))
+           .filter(EnrichmentTask.status == "pending", EnrichmentTask.next_attempt_at <= now).scalar())
+    dead = (db.query(EnrichmentTask.song_id, EnrichmentTask.attempts, EnrichmentTask.last_error)
+            .filter(EnrichmentTask.status == "dead").order_by(EnrichmentTask.id.desc()).limit(20).all())
+    return {
+        "pending": counts.get("pending", 0),
+        "due": due,
+        "running": counts.get("running", 0),
+        "dead": counts.get("dead", 0),
+        "recent_dead": [r._asdict() for r in dead],
+    }
+
+
+def backoff_seconds(attempts: int) -> float:
+    """Delay before retry number `attempts` (1-based): doubling, capped, with jitter."""
+    delay = min(ENRICH_BACKOFF_SECONDS * 2 ** (attempts - 1), ENRICH_BACKOFF_MAX_SECONDS)
+    return delay * random.uniform(0.5, 1.0)
+
+
+# ---------- Claiming and running ----------
+def claim_next_task(db: Session) -> Optional[tuple[int, int, int, int]]:
+    """Mark the next due task running; returns (id, song_id, user_id, attempts) or None."""
+    now = datetime.now(tz=AMS)
+    claimable = or_(
+        and_(EnrichmentTask.status == "pending", EnrichmentTask.next_attempt_at <= now),
+        and_(EnrichmentTask.status == "running",
+             EnrichmentTask.updated_at < now - timedelta(seconds=ENRICH_STALE_SECONDS)),
+    )
+    nxt = (select(EnrichmentTask.id).where(claimable)
+           .order_by(EnrichmentTask.next_attempt_at, EnrichmentTask.id).limit(1).scalar_subquery())
+    row = db.execute(
+        update(EnrichmentTask)
+        .where(EnrichmentTask.id == nxt, claimable)
+        .values(status="running", updated_at=now)
+        .returning(EnrichmentTask.id, EnrichmentTask.song_id, EnrichmentTask.user_id, EnrichmentTask.attempts)
+    ).first()
+    db.commit()
+    return tuple(row) if row else None
+
+
+def run_task(task_id: int, song_id: int, user_id: int, attempts: int) -> bool:
+    """Enrich one song. Returns True when its metadata changed."""
+    db = SessionLocal()
+    try:
+        song = db.get(Song, song_id)
+        updated = False
+        if song is not None and song.deleted_at is None:
+            # no waiting out a rate-limit pause: SpotifyRateLimited reschedules the task instead
+            updated = enrich_song_from_spotify(db, song, user_id, blocking=False)
+        db.execute(delete(EnrichmentTask).where(EnrichmentTask.id == task_id))
+        db.commit()
+        return updated
+    except SpotifyRateLimited as e:
+        db.rollback()
+        _reschedule(db, task_id, "pending", attempts, e.retry_after, str(e))
+    except SpotifyNotConfigured as e:
+        db.rollback()
+        _reschedule(db, task_id, "dead", attempts, 0, str(e))
+    except Exception as e:
+        db.rollback()
+        attempts += 1
+        if attempts >= ENRICH_MAX_ATTEMPTS:
+            print(f"⚠️ Giving up on enriching song {song_id} after {attempts} attempts: {e}")
+            _reschedule(db, task_id, "dead", attempts, 0, str(e))
+        else:
+            _reschedule(db, task_id, "pending", attempts, backoff_seconds(attempts), str(e))
+    finally:
+        db.close()
+    return False
+
+
+def _reschedule(db: Session, task_id: int, status: str, attempts: int, delay: float, error: str) -> None:
+    now = datetime.now(tz=AMS)
+    db.execute(
+        update(EnrichmentTask)
+        .where(EnrichmentTask.id == task_id)
+        .values(status=status, attempts=attempts, last_error=error[:2000], updated_at=now,
+                next_attempt_at=now + timedelta(seconds=delay))
+    )
+    db.commit()
+
+
+# ---------- Background workers ----------
+_stop = threading.Event()
+_wake = threading.Event()   # set once an enqueue commits, so idle workers don't wait out the poll
+_threads: list[threading.Thread] = []
+_tiles_lock = threading.Lock()
+_tiles_dirty = False
+_tiles_flushed = 0.0
+
+
+def _refresh_tiles(force: bool) -> None:
+    """Mark home tiles stale after enrichment changed songs, at most every TILE_REFRESH_SECONDS."""
+    global _tiles_dirty, _tiles_flushed
+    with _tiles_lock:
+        if not _tiles_dirty or (not force and time.monotonic() - _tiles_flushed < TILE_REFRESH_SECONDS):
+            return
+        _tiles_dirty = False
+        _tiles_flushed = time.monotonic()
+    db = SessionLocal()
+    try:
+        invalidate_home_tiles(db, None, ALL_TILES)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"⚠️ Home tile invalidation after enrichment failed: {e}")
+    finally:
+        db.close()
+
+
+def _run() -> None:
+    global _tiles_dirty
+    while not _stop.is_set():
+        db = SessionLocal()
+        try:
+            task = claim_next_task(db)
+        except Exception as e:
+            db.rollback()
+            print(f"⚠️ Claiming an enrichment task failed: {e}")
+            task = None
+        finally:
+            db.close()
+        if task is None:
+            _refresh_tiles(force=True)  # queue drained (for now)
+            _wake.wait(ENRICH_POLL_SECONDS)
+            _wake.clear()
+            continue
+        if run_task(*task):
+            with _tiles_lock:
+                _tiles_dirty = True
+        _refresh_tiles(force=False)
+
+
+def start_enrichment_workers(workers: int = ENRICH_WORKERS) -> None:
+    if workers <= 0 or _threads:
+        return
+    _stop.clear()
+    for i in range(workers):
+        t = threading.Thread(target=_run, name=f"enrichment-{i}", daemon=True)
+        t.start()
+        _threads.append(t)
+
+
+def stop_enrichment_workers() -> None:
+    _stop.set()
+    _wake.set()
+    for t in _threads:
+        t.join(timeout=5)
+    _threads.clear()
@@ -0,0 +1,266 @@
+# services/event_buffer.py
+"""
+Optional write-behind buffer for /play/start and /play/end (PLAY_EVENT_BUFFER=true).
+
+Events are queued in-process and written in batched transactions once
+PLAY_BUFFER_MAX_EVENTS are waiting or PLAY_BUFFER_FLUSH_MS has passed. Ids come
+from IdAllocator, so /play/start answers without touching the DB. Buffered events
+are invisible to reads (history, /home) until the next flush; close() flushes
+everything on shutdown.
+"""
+import os
+import threading
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Optional
+from zoneinfo import ZoneInfo
+from sqlalchemy import case, func, insert, update
+from sqlalchemy.exc import InterfaceError, OperationalError
+
+from database import SessionLocal, upsert_insert
+from models import PlayEvent, PlayEventArchive, Song, IdBlock
+from services.play_events import end_event, upsert_context_progress, context_progress_row, _is_skip
+from services.rollups import apply_plays
+from services.home import invalidate_home_tiles, RECENTLY_PLAYED, MOST_LISTENED, CONTINUE_LISTENING
+
+AMS = ZoneInfo("Europe/Amsterdam")
+
+PLAY_EVENT_BUFFER = os.getenv("PLAY_EVENT_BUFFER", "false").lower() == "true"
+PLAY_BUFFER_MAX_EVENTS = int(os.getenv("PLAY_BUFFER_MAX_EVENTS", "200"))
+PLAY_BUFFER_FLUSH_MS = int(os.getenv("PLAY_BUFFER_FLUSH_MS", "1000"))
+PLAY_ID_BLOCK_SIZE = int(os.getenv("PLAY_ID_BLOCK_SIZE", "100"))
+MAX_FLUSH_ATTEMPTS = 5
+
+
+class IdAllocator:
+    """
+    Hands out ids from blocks reserved in the id_blocks table, so several processes
+    can allocate without colliding. Ids of a block lost in a crash are simply skipped.
+    """
+
+    def __init__(self, name: str, model, block_size: int = PLAY_ID_BLOCK_SIZE, archive=None):
+        self.name = name
+        self.model = model
+        self.archive = archive  # archived rows keep their ids, so they count too
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = 0  # exclusive
+
+    def _reserve(self) -> None:
+        db = SessionLocal()
+        try:
+            seed = (db.query(func.max(self.model.id)).scalar() or 0) + 1
+            if self.archive is not None:
+                seed = max(seed, (db.query(func.max(self.archive.id)).scalar() or 0) + 1)
+            stmt = upsert_insert(db, IdBlock).values(name=self.name, next_id=seed)
+            db.execute(stmt.on_conflict_do_nothing(index_elements=[IdBlock.name]))
+            # never hand out ids below rows written without the allocator (buffer was off)
+            start = case((IdBlock.next_id < seed, seed), else_=IdBlock.next_id)
+            end = db.execute(
+                update(IdBlock)
+                .where(IdBlock.name == self.name)
+                .values(next_id=start + self.block_size)
+                .returning(IdBlock.next_id)
+            ).scalar_one()
+            db.commit()
+        finally:
+            db.close()
+        self._next, self._end = end - self.block_size, end
+
+    def next_id(self) -> int:
+        with self._lock:
+            if self._next >= self._end:
+                self._reserve()
+            n = self._next
+            self._next += 1
+            return n
+
+
+class PlayEventBuffer:
+    def __init__(self, max_events: int = PLAY_BUFFER_MAX_EVENTS, flush_ms: int = PLAY_BUFFER_FLUSH_MS):
+        self.max_events = max_events
+        self.flush_interval = flush_ms / 1000
+        self.ids = IdAllocator("play_events", PlayEvent, archive=PlayEventArchive)
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()  # one writer at a time
+        self._starts: dict[int, dict] = {}   # id → row, not yet inserted
+        self._ends: list[dict] = []          # ends for events that are already in the DB
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+
+    # ---------- producers (request threads) ----------
+    def start_event(self, user_id: int, track_id: int, context_type: Optional[str], context_id: Optional[str],
+                    source_label: Optional[str], position_start_sec: int, device: Optional[str]) -> int:
+        row = {
+            "id": self.ids.next_id(),
+            "user_id": user_id,
+            "track_id": track_id,
+            "context_type": context_type,
+            "context_id": context_id,
+            "source_label": source_label,
+            "started_at": datetime.now(tz=AMS),
+            "ended_at": None,
+            "position_start_sec": position_start_sec,
+            "position_end_sec": None,
+            "duration_played_sec": 0,
+            "is_skip": False,
+            "device": device,
+            "_attempts": 0,
+        }
+        with self._cond:
+            self._starts[row["id"]] = row
+            self._wake_if_full()
+        return row["id"]
+
+    def end_event(self, user_id: int, event_id: int, position_end_sec: Optional[int]) -> None:
+        ended_at = datetime.now(tz=AMS)
+        with self._cond:
+            row = self._starts.get(event_id)
+            if row is not None:
+                if row["user_id"] == user_id and row["ended_at"] is None:
+                    row["ended_at"] = ended_at
+                    row["position_end_sec"] = position_end_sec if position_end_sec is not None else row["position_start_sec"]
+                return
+            self._ends.append({"user_id": user_id, "event_id": event_id, "position_end_sec": position_end_sec,
+                               "ended_at": ended_at, "_attempts": 0})
+            self._wake_if_full()
+
+    def _wake_if_full(self) -> None:
+        if len(self._starts) + len(self._ends) >= self.max_events:
+            self._cond.notify()
+
+    # ---------- writer ----------
+    def flush(self) -> int:
+        """Write everything queued so far in one transaction. Returns the number of items written."""
+        with self._flush_lock:
+            with self._cond:
+                starts, self._starts = self._starts, {}
+                ends, self._ends = self._ends, []
+            if not starts and not ends:
+                return 0
+            written, failed_starts, failed_ends = self._write_split(list(starts.values()), ends)
+            if failed_starts or failed_ends:
+                self._requeue({r["id"]: r for r in failed_starts}, failed_ends)
+            return written
+
+    def _write_split(self, starts: list[dict], ends: list[dict]) -> tuple[int, list[dict], list[dict]]:
+        """
+        Write a batch. When it fails on its data, write the halves separately, down to single
+        events, so one bad row (e.g. a track_id failing its foreign key) only holds up itself.
+        A start and an end of the same event stay in the same half: an end written without
+        its row is lost. Returns (items written, failed starts, failed ends).
+        """
+        try:
+            self._write(starts, ends)
+            return len(starts) + len(ends), [], []
+        except (OperationalError, InterfaceError) as e:  # database locked/unreachable: splitting won't help
+            print(f"⚠️ Play event flush failed ({len(starts)} starts, {len(ends)} ends): {e}")
+            return 0, starts, ends
+        except Exception as e:
+            events: dict[int, tuple[list, list]] = {}  # event id → (its start, its ends)
+            for r in starts:
+                events.setdefault(r["id"], ([], []))[0].append(r)
+            for end in ends:
+                events.setdefault(end["event_id"], ([], []))[1].append(end)
+            if len(events) == 1:
+                eid = next(iter(events))
+                print(f"⚠️ Could not write {'play event' if starts else 'end of play event'} {eid}: {e}")
+                return 0, starts, ends
+        groups = list(events.values())
+        mid = len(groups) // 2
+        written, failed_starts, failed_ends = 0, [], []
+        for half in (groups[:mid], groups[mid:]):
+            n, fs, fe = self._write_split([r for rs, _ in half for r in rs], [end for _, es in half for end in es])
+            written += n
+            failed_starts += fs
+            failed_ends += fe
+        return written, failed_starts, failed_ends
+
+    def _requeue(self, starts: dict[int, dict], ends: list[dict]) -> None:
+        with self._cond:
+            for eid, row in starts.items():
+                row["_attempts"] += 1
+                if row["_attempts"] < MAX_FLUSH_ATTEMPTS:
+                    self._starts[eid] = row
+                else:
+                    print(f"⚠️ Dropping play event {eid} after {MAX_FLUSH_ATTEMPTS} failed flushes")
+            for end in ends:
+                end["_attempts"] += 1
+                if end["_attempts"] < MAX_FLUSH_ATTEMPTS:
+                    self._ends.append(end)
+                else:
+                    print(f"⚠️ Dropping end of play event {end['event_id']} after {MAX_FLUSH_ATTEMPTS} failed flushes")
+
+    def _write(self, starts: list[dict], ends: list[dict]) -> None:
+        db = SessionLocal()
+        try:
+            finished = [r for r in starts if r["ended_at"] is not None]
+            track_ids = {r["track_id"] for r in finished}
+            durations = dict(db.query(Song.id, Song.duration).filter(Song.id.in_(track_ids)).all()) if track_ids else {}
+            for r in finished:
+                r["duration_played_sec"] = max(0, r["position_end_sec"] - r["position_start_sec"])
+                r["is_skip"] = _is_skip(r["duration_played_sec"], durations.get(r["track_id"]))
+
+            if starts:
+                db.execute(insert(PlayEvent), [{k: v for k, v in r.items() if k != "_attempts"} for r in starts])
+            apply_plays(db, [SimpleNamespace(**r) for r in finished])
+
+            latest: dict[tuple, dict] = {}
+            for r in finished:
+                if r["context_type"] and r["context_id"]:
+                    ctx = (r["user_id"], r["context_type"], r["context_id"])
+                    if ctx not in latest or r["started_at"] > latest[ctx]["started_at"]:
+                        latest[ctx] = r
+            upsert_context_progress(db, [
+                context_progress_row(db, uid, ct, cid, r["track_id"], r["duration_played_sec"],
+                                     durations.get(r["track_id"]), r["ended_at"])
+                for (uid, ct, cid), r in latest.items()
+            ])
+
+            for end in ends:
+                end_event(db, end["user_id"], end["event_id"], end["position_end_sec"],
+                          ended_at=end["ended_at"], commit=False)
+
+            tiles_by_user: dict[int, set] = {}
+            for r in starts:
+                tiles_by_user.setdefault(r["user_id"], set()).add(RECENTLY_PLAYED)
+            for r in finished:
+                tiles_by_user[r["user_id"]].update((MOST_LISTENED, CONTINUE_LISTENING))
+            for uid, tiles in tiles_by_user.items():
+                invalidate_home_tiles(db, uid, tiles)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if not self._stopping:
+                    self._cond.wait(timeout=self.flush_interval)
+                stopping = self._stopping
+            self.flush()
+            if stopping:
+                return
+
+    # ---------- lifecycle ----------
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="play-event-buffer", daemon=True)
+            self._thread.start()
+
+    def close(self) -> None:
+        """Stop the flusher and write out everything still queued."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+
+play_buffer: Optional[PlayEventBuffer] = PlayEventBuffer() if PLAY_EVENT_BUFFER else None
@@ -1,26 +1,63 @@
 # services/home.py
+import os
+import json
+import time
+import hashlib
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeout
+from functools import partial
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
-from typing import Dict, Any
+from typing import Dict, Any, Iterable, Optional
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
+from sqlalchemy import func, desc, update
 
-from models import PlayEvent, ContextProgress, Song, Like  # Like exists in your repo
+from database import SessionLocal, ReadSessionLocal, upsert_insert
+from models import PlayEvent, ContextProgress, Song, Like, HomeTile  # Like exists in your repo
+from services.rollups import week_bounds, top_tracks
+from utils import query_stats
 
 AMS = ZoneInfo("Europe/Amsterdam")
+# safety net: even without an invalidating event, recompute a cached tile after this long
+HOME_TILE_MAX_AGE = timedelta(seconds=int(os.getenv("HOME_TILE_MAX_AGE_SECONDS", str(6 * 3600))))
+# how long a request waits for its stale tiles. One budget for the page, not per tile: they
+# are built concurrently, so each gets up to this long; late ones are cached when they finish
+HOME_TILE_DEADLINE = int(os.getenv("HOME_TILE_DEADLINE_MS", "800")) / 1000
+HOME_TILE_WORKERS = int(os.getenv("HOME_TILE_WORKERS", "8"))
+# a tile invalidated this recently is rebuilt on the primary: the replica may not have the change yet
+HOME_TILE_REPLICA_LAG = timedelta(seconds=int(os.getenv("HOME_TILE_REPLICA_LAG_SECONDS", "30")))
+
+_tile_pool = ThreadPoolExecutor(max_workers=HOME_TILE_WORKERS, thread_name_prefix="home-tile")
+_tile_stats_lock = threading.Lock()
+_tile_stats: Dict[str, Dict[str, float]] = {}
+_inflight_lock = threading.Lock()
+_inflight: Dict[tuple[int, str], Future] = {}   # (user_id, tile) → build in progress
+
+# Tile types (also the cache keys in home_tiles)
+RECENTLY_PLAYED = "recently_played"
+MOST_LISTENED = "most_listened_last_week"
+CONTINUE_LISTENING = "continue_listening"
+FAVORITES = "favorites_hub"
+NEWLY_ADDED = "newly_added"
 
 def _week_range_ams(now: datetime) -> Dict[str, str]:
-    d = now.astimezone(AMS)
-    monday = (d - timedelta(days=d.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
-    sunday = monday + timedelta(days=6)
-    return {"start": monday.date().isoformat(), "end": sunday.date().isoformat()}
+    monday, sunday = week_bounds(now)
+    return {"start": monday.isoformat(), "end": sunday.isoformat()}
+
+def _songs_by_id(db: Session, ids) -> Dict[int, Song]:
+    """Resolve many track ids with a single IN query."""
+    ids = set(ids)
+    if not ids:
+        return {}
+    return {s.id: s for s in db.query(Song).filter(Song.id.in_(ids)).all()}
 
 def tile_recently_played(db: Session, user_id: int, limit=10) -> Dict[str, Any]:
     evs = (db.query(PlayEvent)
            .filter(PlayEvent.user_id == user_id)
            .order_by(PlayEvent.started_at.desc())
            .limit(100).all())
-    items, seen = [], set()
+    candidates, seen = [], set()
     last_track = None
     for ev in evs:
         if not ev.started_at:
@@ -31,7 +68,12 @@ def tile_recently_played(db: Session, user_id: int, limit=10) -> Dict[str, Any]:
             continue
         seen.add(key)
         last_track = ev.track_id
-        trk = db.query(Song).get(ev.track_id)
+        candidates.append(ev)
+
+    songs = _songs_by_id(db, (ev.track_id for ev in candidates))
+    items = []
+    for ev in candidates:
+        trk = songs.get(ev.track_id)
         if not trk:
             continue
         items.append({
@@ -48,43 +90,9 @@ def tile_recently_played(db: Session, user_id: int, limit=10) -> Dict[str, Any]:
     return {"type": "recently_played", "title": "Recently played", "items": items}
 
 def tile_most_listened_last_week(db: Session, user_id: int, limit=5) -> Dict[str, Any]:
-    now = datetime.now(tz=AMS)
-    rng = _week_range_ams(now)
-    # assume CET/CEST; using local midnight boundaries
-    start = datetime.fromisoformat(rng["start"] + "T00:00:00+02:00")
-    end   = datetime.fromisoformat(rng["end"]   + "T23:59:59+02:00")
-
-    q = (db.query(
-            PlayEvent.track_id.label("track_id"),
-            func.sum(PlayEvent.duration_played_sec).label("seconds"),
-            func.count(PlayEvent.id).label("plays"),
-            func.max(PlayEvent.ended_at).label("last_played_at"),
-        )
-        .filter(
-            PlayEvent.user_id == user_id,
-            PlayEvent.started_at >= start, PlayEvent.started_at <= end,
-            PlayEvent.duration_played_sec >= 30
-        )
-        .group_by(PlayEvent.track_id)
-        .order_by(desc("seconds"))
-        .limit(limit))
-
-    items = []
-    for row in q.all():
-        trk = db.query(Song).get(row.track_id)
-        if not trk:
-            continue
-        items.append({
-            "kind": "track",
-            "track_id": trk.id,
-            "title": trk.title,
-            "artist": getattr(trk, "artist", ""),
-            "album": getattr(trk, "album", ""),
-            "cover_url": getattr(trk, "cover_url", None),
-            "play_count": int(row.plays or 0),
-            "minutes_played": round((row.seconds or 0)/60, 1),
-            "last_played_at": row.last_played_at.isoformat() if row.last_played_at else None
-        })
+    # reads the daily rollups; week bounds are Amsterdam calendar days, so DST is handled
+    start, end = week_bounds(datetime.now(tz=AMS))
+    items = top_tracks(db, user_id, start, end, limit=limit)
     return {"type": "most_listened_last_week", "title": "Most listened last week", "items": items}
 
 def tile_continue_listening(db: Session, user_id: int, limit=3) -> Dict[str, Any]:
@@ -107,15 +115,13 @@ def tile_continue_listening(db: Session, user_id: int, limit=3) -> Dict[str, Any
     return {"type": "continue_listening", "title": "Continue listening", "items": items}
 
 def tile_favorites(db: Session, user_id: int, limit=8) -> Dict[str, Any]:
-    likes = (db.query(Like)
-             .filter(Like.user_id == user_id)
-             .order_by(Like.created_at.desc())
-             .limit(limit).all())
+    rows = (db.query(Like, Song)
+            .join(Song, Song.id == Like.song_id)
+            .filter(Like.user_id == user_id)
+            .order_by(Like.created_at.desc())
+            .limit(limit).all())
     items = []
-    for lk in likes:
-        trk = lk.song  # you have a relationship on Like -> Song
-        if not trk:
-            continue
+    for lk, trk in rows:
         items.append({
             "track_id": trk.id,
             "title": trk.title,
@@ -143,7 +149,7 @@ def tile_newly_added(db: Session, user_id: int, limit=12) -> Dict[str, Any]:
 
     q = (
         db.query(Song)
-        .filter(ts_expr != None)                
+        .filter(ts_expr != None, Song.deleted_at == None)
         .order_by(desc(ts_expr))
         .limit(limit)
     )
@@ -165,21 +171,198 @@ def tile_newly_added(db: Session, user_id: int, limit=12) -> Dict[str, Any]:
         })
 
     return {"type": "newly_added", "title": "New in your library", "items": items}
-def assemble_home(db: Session, user_id: int) -> Dict[str, Any]:
+
+# Page order of the tiles on /home
+TILES = [
+    (MOST_LISTENED, tile_most_listened_last_week),
+    (RECENTLY_PLAYED, tile_recently_played),
+    (CONTINUE_LISTENING, tile_continue_listening),
+    (FAVORITES, tile_favorites),
+    (NEWLY_ADDED, tile_newly_added),
+]
+ALL_TILES = [t for t, _ in TILES]
+
+# ---------- Cache ----------
+def _aware(dt: Optional[datetime]) -> Optional[datetime]:
+    # SQLite hands back naive Amsterdam wall-clock times
+    if dt is not None and dt.tzinfo is None:
+        return dt.replace(tzinfo=AMS)
+    return dt
+
+def _tile_valid_until(tile: str, now: datetime) -> Optional[datetime]:
+    if tile == MOST_LISTENED:
+        d = now.astimezone(AMS)
+        next_monday = (d + timedelta(days=7 - d.weekday())).date()
+        return datetime(next_monday.year, next_monday.month, next_monday.day, tzinfo=AMS)
+    return None
+
+def _is_fresh(row: HomeTile, now: datetime) -> bool:
+    if row.stale:
+        return False
+    if row.valid_until is not None and now >= _aware(row.valid_until):
+        return False
+    return now - _aware(row.computed_at) < HOME_TILE_MAX_AGE
+
+def invalidate_home_tiles(db: Session, user_id: Optional[int], tiles: Iterable[str]) -> None:
+    """Mark cached tiles stale; user_id=None hits every user. Joins the caller's transaction."""
+    q = db.query(HomeTile).filter(HomeTile.tile.in_(list(tiles)))
+    if user_id is not None:
+        q = q.filter(HomeTile.user_id == user_id)
+    # the generation bump makes a tile computed before this commit fail its store (_store_tile)
+    q.update({HomeTile.stale: True, HomeTile.generation: HomeTile.generation + 1,
+              HomeTile.invalidated_at: datetime.now(tz=AMS)}, synchronize_session=False)
+
+def _reserve_tiles(db: Session, user_id: int, tiles: Iterable[str]) -> None:
+    # stale placeholder rows, so an invalidation during the first compute has a generation to bump
+    rows = [{"user_id": user_id, "tile": tile, "payload": "", "computed_at": datetime.now(tz=AMS),
+             "stale": True, "generation": 0} for tile in tiles]
+    db.execute(upsert_insert(db, HomeTile).on_conflict_do_nothing(), rows)
+    db.commit()
+
+def _store_tile(db: Session, user_id: int, tile: str, payload: str, generation: int, now: datetime) -> bool:
+    """
+    Cache a computed tile, unless it was invalidated since `generation` was read (before the
+    compute started): then its data may predate the change, and the row stays stale.
+    """
+    stored = db.execute(
+        update(HomeTile)
+        .where(HomeTile.user_id == user_id, HomeTile.tile == tile, HomeTile.generation == generation)
+        .values(payload=payload, computed_at=now, valid_until=_tile_valid_until(tile, now), stale=False)
+        # one per tile by design: each build stores itself, when it finishes
+        .execution_options(**{query_stats.PER_ITEM: True})
+    ).rowcount
+    db.commit()
+    return bool(stored)
+
+def _build_tile(build, user_id: int, tile: str, generation: int, primary: bool) -> tuple[str, float]:
+    """
+    Run one tile on its own (read) session and cache the result (compare-and-set, see
+    _store_tile), also when the request that asked for it stopped waiting; returns (payload, seconds).
+    """
+    t0 = time.perf_counter()
     now = datetime.now(tz=AMS)
-    tiles = [
-        tile_most_listened_last_week(db, user_id),
-        tile_recently_played(db, user_id),
-        tile_continue_listening(db, user_id),
-        tile_favorites(db, user_id),
-        tile_newly_added(db, user_id),
-    ]
+    db = SessionLocal() if primary else ReadSessionLocal()
+    try:
+        payload = json.dumps(build(db, user_id), separators=(",", ":"))
+    finally:
+        db.close()
+    secs = time.perf_counter() - t0
+    db = SessionLocal()
+    try:
+        _store_tile(db, user_id, tile, payload, generation, now)
+    except Exception as e:
+        db.rollback()
+        print(f"⚠️ Could not cache tile {tile} for user {user_id}: {e}")
+    finally:
+        db.close()
+    return payload, secs
+
+def _submit_tile(build, user_id: int, tile: str, generation: int, primary: bool) -> Future:
+    """
+    At most one build per (user, tile) at a time: a request finding one in flight waits on
+    it rather than queueing another, so a slow aggregate can't fill the pool. Its result
+    may predate a newer invalidation; then it is served once but not stored (generation check).
+    """
+    key = (user_id, tile)
+    with _inflight_lock:
+        fut = _inflight.get(key)
+        if fut is not None:
+            return fut
+        # copy_context keeps per-request query stats attached to the tile's queries
+        fut = _tile_pool.submit(contextvars.copy_context().run, _build_tile, build, user_id, tile, generation, primary)
+        _inflight[key] = fut
+    fut.add_done_callback(partial(_build_done, key))
+    return fut
+
+def _build_done(key: tuple[int, str], fut: Future) -> None:
+    with _inflight_lock:
+        if _inflight.get(key) is fut:
+            del _inflight[key]
+
+def _record_tile_timing(tile: str, ms: float, timed_out: bool, failed: bool = False) -> None:
+    with _tile_stats_lock:
+        st = _tile_stats.setdefault(tile, {"computed": 0, "timed_out": 0, "failed": 0, "total_ms": 0.0, "max_ms": 0.0})
+        if failed:
+            st["failed"] += 1
+        elif timed_out:
+            st["timed_out"] += 1
+        else:
+            st["computed"] += 1
+            st["total_ms"] += ms
+            st["max_ms"] = max(st["max_ms"], ms)
+
+def tile_timing_stats() -> Dict[str, Any]:
+    with _tile_stats_lock:
+        return {
+            tile: {
+                "computed": st["computed"],
+                "timed_out": st["timed_out"],
+                "failed": st["failed"],
+                "avg_ms": round(st["total_ms"] / st["computed"], 2) if st["computed"] else None,
+                "max_ms": round(st["max_ms"], 2),
+            }
+            for tile, st in _tile_stats.items()
+        }
+
+def assemble_home(db: Session, user_id: int, timings: Optional[Dict[str, Optional[float]]] = None) -> Dict[str, Any]:
+    """
+    Serve /home from the per-user tile cache. Stale/missing tiles are computed concurrently,
+    each on its own read session, within one HOME_TILE_DEADLINE_MS for the page. A tile that
+    misses it falls back to its last cached payload (or is left out) and is cached once its
+    build finishes; so does a tile whose build failed. `db` must be a primary session.
+    If `timings` is given it is filled with per-tile ms (0 = cache hit, None = timed out or failed).
+    """
+    now = datetime.now(tz=AMS)
+    timings = timings if timings is not None else {}
+
+    cached = {r.tile: r for r in db.query(HomeTile).filter(HomeTile.user_id == user_id).all()}
+    if len(cached) < len(TILES):
+        _reserve_tiles(db, user_id, [t for t in ALL_TILES if t not in cached])
+        cached = {r.tile: r for r in db.query(HomeTile).filter(HomeTile.user_id == user_id).all()}
+    previous = {t: r.payload for t, r in cached.items() if r.payload}  # "" = placeholder, never computed
+    payloads: Dict[str, str] = {}
+    pending: Dict[str, Future] = {}
+    for tile, build in TILES:
+        row = cached[tile]
+        if _is_fresh(row, now):
+            payloads[tile] = row.payload
+            timings[tile] = 0.0
+            continue
+        primary = row.invalidated_at is not None and now - _aware(row.invalidated_at) < HOME_TILE_REPLICA_LAG
+        pending[tile] = _submit_tile(build, user_id, tile, row.generation, primary)
+
+    deadline = time.monotonic() + HOME_TILE_DEADLINE
+    for tile, fut in pending.items():
+        try:
+            payload, secs = fut.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeout:
+            print(f"⚠️ Home tile {tile} missed its {HOME_TILE_DEADLINE * 1000:.0f} ms deadline for user {user_id}")
+            _record_tile_timing(tile, 0.0, timed_out=True)
+        except Exception as e:  # e.g. database locked, replica down: the other tiles still render
+            print(f"⚠️ Home tile {tile} failed for user {user_id}: {e}")
+            _record_tile_timing(tile, 0.0, timed_out=False, failed=True)
+        else:
+            payloads[tile] = payload
+            timings[tile] = secs * 1000
+            _record_tile_timing(tile, secs * 1000, timed_out=False)
+            continue
+        timings[tile] = None
+        if tile in previous:
+            payloads[tile] = previous[tile]
+
+    week_range = _week_range_ams(now)
+    etag = hashlib.sha1(
+        "\n".join([json.dumps(week_range)] + [payloads.get(t, "") for t, _ in TILES]).encode("utf-8")
+    ).hexdigest()
+
+    tiles = [json.loads(payloads[t]) for t, _ in TILES if t in payloads]
     tiles = [t for t in tiles if t.get("items")]
     return {
         "version": "1.0",
         "generated_at": now.isoformat(),
         "timezone": "Europe/Amsterdam",
-        "week_range": _week_range_ams(now),
+        "week_range": week_range,
         "tiles": tiles,
-        "paging": {"next": None}
+        "paging": {"next": None},
+        "etag": etag,
     }
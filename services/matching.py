@@ -1,7 +1,13 @@
 # services/matching.py
+import os
 import re
+from functools import lru_cache
+import numpy as np
 from unidecode import unidecode
-from rapidfuzz import fuzz
+from rapidfuzz import fuzz, process
+
+# normalize() results kept around; the same titles/artists come up for every candidate
+NORMALIZE_CACHE_SIZE = int(os.getenv("NORMALIZE_CACHE_SIZE", "65536"))
 
 # Clean out common junk added by YouTube rips etc.
 NOISE_PATTERNS = [
@@ -20,17 +26,26 @@ NOISE_PATTERNS = [
     r'lyric video', r'full album', r'album version',
     r'hq', r'hd'
 ]
+# one pass instead of one per pattern; at a given spot the earliest pattern in the list wins
+_NOISE_RE = re.compile("|".join(NOISE_PATTERNS), re.I)
+_BRACKETS_RE = re.compile(r'[\[\]\(\)\{\}]')
+_DISALLOWED_RE = re.compile(r'[^a-z0-9&\'\-\s]')
+_SPACES_RE = re.compile(r'\s+')
+_EXTENSION_RE = re.compile(r'\.[a-z0-9]{2,5}$', re.I)
+_TRACK_NO_RE = re.compile(r'^\s*\d+\s*[-_. ]\s*')
+_ARTIST_TITLE_RE = re.compile(r'^(?P<artist>.+?)\s*-\s*(?P<title>.+)$')
+_TITLE_BY_RE = re.compile(r'^(?P<title>.+?)\s+by\s+(?P<artist>.+)$')
 
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
 def normalize(s: str) -> str:
     if not s:
         return ""
     s = unidecode(s.lower())
     s = s.replace("–", "-").replace("—", "-").replace("_", " ")
-    for pat in NOISE_PATTERNS:
-        s = re.sub(pat, "", s, flags=re.I)
-    s = re.sub(r'[\[\]\(\)\{\}]', ' ', s)             # strip brackets
-    s = re.sub(r'[^a-z0-9&\'\-\s]', ' ', s)           # allowed chars
-    s = re.sub(r'\s+', ' ', s).strip()
+    s = _NOISE_RE.sub("", s)
+    s = _BRACKETS_RE.sub(' ', s)             # strip brackets
+    s = _DISALLOWED_RE.sub(' ', s)           # allowed chars
+    s = _SPACES_RE.sub(' ', s).strip()
     return s
 
 def parse_filename(filename: str) -> tuple[str, str | None]:
@@ -41,19 +56,19 @@ def parse_filename(filename: str) -> tuple[str, str | None]:
     'Title by Artist.mp3'
     Fallback: (basename, None)
     """
-    base = re.sub(r'\.[a-z0-9]{2,5}$', '', filename, flags=re.I)
+    base = _EXTENSION_RE.sub('', filename)
     base = normalize(base)
 
     # drop leading track numbers: "01 - ..." / "07. ..."
-    base = re.sub(r'^\s*\d+\s*[-_. ]\s*', '', base)
+    base = _TRACK_NO_RE.sub('', base)
 
     # pattern "artist - title"
-    m = re.match(r'^(?P<artist>.+?)\s*-\s*(?P<title>.+)$', base)
+    m = _ARTIST_TITLE_RE.match(base)
     if m:
         return (m.group('title').strip(), m.group('artist').strip())
 
     # pattern "title by artist"
-    m = re.match(r'^(?P<title>.+?)\s+by\s+(?P<artist>.+)$', base)
+    m = _TITLE_BY_RE.match(base)
     if m:
         return (m.group('title').strip(), m.group('artist').strip())
 
@@ -67,3 +82,13 @@ def fuzzy_score(a: str, b: str) -> int:
         return 0
     # token_set_ratio is forgiving about word order / extra tokens
     return fuzz.token_set_ratio(a, b)
+
+def fuzzy_scores(a: str, choices: list[str]) -> list[float]:
+    """fuzzy_score(a, c) for every c in choices, in one rapidfuzz call."""
+    a = normalize(a)
+    if not a or not choices:
+        return [0.0] * len(choices)
+    normalized = [normalize(c) for c in choices]
+    # float64 so the scores are exactly what fuzz.token_set_ratio returns one by one
+    scores = process.cdist([a], normalized, scorer=fuzz.token_set_ratio, dtype=np.float64)[0]
+    return [float(sc) if c else 0.0 for sc, c in zip(scores, normalized)]
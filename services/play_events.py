@@ -1,10 +1,15 @@
 # services/play_events.py
 from datetime import datetime
+from types import SimpleNamespace
 from zoneinfo import ZoneInfo
+from sqlalchemy import Integer, and_, case, func, insert, literal, select, tuple_, update
 from sqlalchemy.orm import Session
-from typing import Optional
+from typing import Callable, Optional
 
-from models import PlayEvent, ContextProgress, Song   # Song exists in your models.py
+from database import upsert_insert
+from models import PlayEvent, PlayEventArchive, ContextProgress, Song, Playlist, PlaylistTrack, Like, Folder
+from services.rollups import apply_plays
+from services.home import invalidate_home_tiles, RECENTLY_PLAYED, MOST_LISTENED, CONTINUE_LISTENING
 
 AMS = ZoneInfo("Europe/Amsterdam")
 MIN_COUNT_SECONDS = 30  # or 40% of track duration if known
@@ -30,41 +35,302 @@ def start_event(
         device=device,
     )
     db.add(ev)
+    invalidate_home_tiles(db, user_id, [RECENTLY_PLAYED])
     db.commit()
     db.refresh(ev)
     return ev.id
 
-def end_event(db: Session, user_id: int, event_id: int, position_end_sec: Optional[int]) -> None:
-    ev = db.query(PlayEvent).filter(PlayEvent.id == event_id, PlayEvent.user_id == user_id).first()
-    if not ev or ev.ended_at:
-        return
+def _playlist_id(context_id: str) -> Optional[int]:
+    # clients send "pl:12" or plain "12"
+    raw = context_id[3:] if context_id.startswith("pl:") else context_id
+    return int(raw) if raw.isdigit() else None
 
-    ev.ended_at = datetime.now(tz=AMS)
-    ev.position_end_sec = position_end_sec if position_end_sec is not None else ev.position_start_sec
-    ev.duration_played_sec = max(0, ev.position_end_sec - ev.position_start_sec)
+def _context_rows(user_id: int, context_type: str, context_id: str):
+    """
+    A playback context's rows as (select, track id column, sort key columns, descending),
+    or None when the context isn't one we can resolve.
+    """
+    if context_type == "library":
+        # the library view sends which list was playing; other ids (e.g. "home") have no fixed order
+        if context_id == "likes":
+            context_type = "likes"
+        elif context_id != "allTracks":
+            return None
+    if context_type == "playlist":
+        pid = _playlist_id(context_id)
+        if pid is None:
+            return None
+        q = (select(PlaylistTrack.track_id)
+             .join(Playlist, Playlist.id == PlaylistTrack.playlist_id)
+             .where(PlaylistTrack.playlist_id == pid, Playlist.user_id == user_id))
+        return q, PlaylistTrack.track_id, (PlaylistTrack.order_index, PlaylistTrack.id), False
+    if context_type == "likes":
+        q = select(Like.song_id).where(Like.user_id == user_id)
+        return q, Like.song_id, (Like.created_at, Like.id), True
+    if context_type == "library":
+        # same order as the default /songs listing
+        q = (select(Song.id).join(Song.folder)
+             .where(Folder.user_id == user_id, Song.deleted_at == None))
+        return q, Song.id, (Song.created_at, Song.id), True
+    return None
 
-    trk = db.query(Song).filter(Song.id == ev.track_id).first()
-    if trk and getattr(trk, "duration_sec", None):
-        ev.is_skip = ev.duration_played_sec < min(MIN_COUNT_SECONDS, int(0.4 * trk.duration_sec))
-    else:
-        ev.is_skip = ev.duration_played_sec < MIN_COUNT_SECONDS
+def context_position(db: Session, user_id: int, context_type: str, context_id: str,
+                     track_id: int) -> Optional[tuple[int, int]]:
+    """
+    (index of the track's first appearance, number of tracks) in a playback context, or None
+    when the context can't be resolved or doesn't hold the track. Counted in SQL, so the
+    context's track list never leaves the database.
+    """
+    ctx = _context_rows(user_id, context_type, context_id)
+    if ctx is None:
+        return None
+    q, track_col, keys, descending = ctx
+    order = [k.desc() for k in keys] if descending else list(keys)
+    key = db.execute(q.with_only_columns(*keys).where(track_col == track_id).order_by(*order).limit(1)).first()
+    if key is None:
+        return None
+    before = tuple_(*keys) > tuple_(*key) if descending else tuple_(*keys) < tuple_(*key)
+    total, index = db.execute(q.with_only_columns(func.count(), func.sum(case((before, 1), else_=0)))).one()
+    return index or 0, total
 
-    db.commit()
+def context_progress_row(
+    db: Session,
+    user_id: int,
+    context_type: str,
+    context_id: str,
+    track_id: int,
+    played_sec: int,
+    track_duration: Optional[int],
+    updated_at: datetime,
+) -> dict:
+    """
+    Progress through a context after playing `track_id`: last_index is its position in the
+    context's track list, played_pct counts the tracks before it plus the played share of it.
+    """
+    last_index, played_pct = None, 0.0
+    pos = context_position(db, user_id, context_type, context_id, track_id)
+    if pos is not None:
+        last_index, total = pos
+        frac = min(1.0, played_sec / track_duration) if track_duration else 1.0
+        played_pct = round((last_index + frac) / total, 4)
+    return {
+        "user_id": user_id,
+        "context_type": context_type,
+        "context_id": context_id,
+        "last_track_id": track_id,
+        "last_index": last_index,
+        "played_pct": played_pct,
+        "updated_at": updated_at,
+    }
+
+def end_event(
+    db: Session,
+    user_id: int,
+    event_id: int,
+    position_end_sec: Optional[int],
+    ended_at: Optional[datetime] = None,
+    commit: bool = True,
+) -> None:
+    """
+    Close a play event in one transaction: a single UPDATE ... RETURNING computes duration
+    and skip flag in SQL, then rollups and context progress are upserted.
+    With commit=False the caller owns the transaction.
+    """
+    ended_at = ended_at or datetime.now(tz=AMS)
+    start = PlayEvent.position_start_sec
+    end = literal(position_end_sec, Integer) if position_end_sec is not None else start
+    played = case((end > start, end - start), else_=0)
+    track_duration = select(Song.duration).where(Song.id == PlayEvent.track_id).scalar_subquery()
+    pct_40 = track_duration * 2 // 5  # integer division, like int(0.4 * duration)
+    skip_below = case(
+        (and_(track_duration > 0, pct_40 < MIN_COUNT_SECONDS), pct_40),
+        else_=MIN_COUNT_SECONDS,
+    )
 
-    # minimal context progress (used by "Continue listening")
+    ev = db.execute(
+        update(PlayEvent)
+        .where(PlayEvent.id == event_id, PlayEvent.user_id == user_id, PlayEvent.ended_at.is_(None))
+        .values(ended_at=ended_at, position_end_sec=end, duration_played_sec=played, is_skip=played < skip_below)
+        .returning(
+            PlayEvent.user_id, PlayEvent.track_id, PlayEvent.context_type, PlayEvent.context_id,
+            PlayEvent.started_at, PlayEvent.ended_at, PlayEvent.duration_played_sec, PlayEvent.is_skip,
+            track_duration.label("track_duration"),
+        )
+        .execution_options(synchronize_session=False)
+    ).first()
+    if ev is None:
+        return  # unknown, someone else's, or already ended
+
+    apply_plays(db, [ev])
+
+    # context progress (used by "Continue listening")
     if ev.context_type and ev.context_id:
-        cp = (db.query(ContextProgress)
-                .filter(ContextProgress.user_id == user_id,
-                        ContextProgress.context_type == ev.context_type,
-                        ContextProgress.context_id == ev.context_id)
-                .first())
-        if not cp:
-            cp = ContextProgress(
-                user_id=user_id,
-                context_type=ev.context_type,
-                context_id=ev.context_id,
-            )
-            db.add(cp)
-        cp.last_track_id = ev.track_id
-        cp.updated_at = datetime.now(tz=AMS)
+        upsert_context_progress(db, [context_progress_row(
+            db, user_id, ev.context_type, ev.context_id, ev.track_id,
+            ev.duration_played_sec, ev.track_duration, ended_at,
+        )])
+
+    invalidate_home_tiles(db, user_id, [MOST_LISTENED, CONTINUE_LISTENING])
+    if commit:
         db.commit()
+
+# ---------- Batch ingestion (/play/batch) ----------
+KEY_CHUNK = 500  # stay under SQLite's bound-parameter limit for IN lists
+
+def _as_ams(dt: Optional[datetime]) -> Optional[datetime]:
+    if dt is None:
+        return None
+    return dt.replace(tzinfo=AMS) if dt.tzinfo is None else dt.astimezone(AMS)
+
+def _is_skip(played_sec: int, track_duration: Optional[int]) -> bool:
+    if track_duration:
+        return played_sec < min(MIN_COUNT_SECONDS, int(0.4 * track_duration))
+    return played_sec < MIN_COUNT_SECONDS
+
+def _finish(row: dict, ended_at: Optional[datetime], position_end_sec: Optional[int], durations: dict) -> None:
+    row["ended_at"] = ended_at or datetime.now(tz=AMS)
+    row["position_end_sec"] = position_end_sec if position_end_sec is not None else row["position_start_sec"]
+    row["duration_played_sec"] = max(0, row["position_end_sec"] - row["position_start_sec"])
+    row["is_skip"] = _is_skip(row["duration_played_sec"], durations.get(row["track_id"]))
+
+def upsert_context_progress(db: Session, rows: list[dict]) -> None:
+    """
+    rows as built by context_progress_row, stamped with the play's end. A row older than
+    the stored progress (a late offline batch) leaves it alone. Does not commit.
+    """
+    if not rows:
+        return
+    stmt = upsert_insert(db, ContextProgress)
+    ex = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ContextProgress.user_id, ContextProgress.context_type, ContextProgress.context_id],
+        set_={
+            "last_track_id": ex.last_track_id,
+            "last_index": ex.last_index,
+            "played_pct": ex.played_pct,
+            "updated_at": ex.updated_at,
+        },
+        where=ContextProgress.updated_at < ex.updated_at,
+    )
+    db.execute(stmt, rows)
+
+def ingest_events(
+    db: Session,
+    user_id: int,
+    events: list[dict],
+    allocate_id: Optional[Callable[[], int]] = None,
+) -> list[dict]:
+    """
+    Apply a batch of client-recorded events in one transaction.
+
+    Each event carries a client_event_id idempotency key. Unknown keys are inserted
+    (complete if they carry an end, open otherwise); a key whose stored event is still
+    open gets completed; anything else is reported as a duplicate and left alone. Keys
+    of archived events (services/retention.py) count too; those are never completed.
+    Returns one {client_event_id, event_id, status} per distinct key, in input order.
+    `allocate_id` supplies explicit ids when the write-behind buffer owns id assignment.
+    """
+    # last write wins for repeated keys inside one batch, but an end is never dropped
+    by_key: dict[str, dict] = {}
+    for e in events:
+        prev = by_key.get(e["client_event_id"])
+        if prev is not None and e.get("ended_at") is None and e.get("position_end_sec") is None:
+            continue
+        by_key[e["client_event_id"]] = e
+    keys = list(by_key)
+
+    existing: dict[str, PlayEvent] = {}
+    for i in range(0, len(keys), KEY_CHUNK):
+        for ev in (db.query(PlayEvent)
+                   .filter(PlayEvent.user_id == user_id,
+                           PlayEvent.client_event_id.in_(keys[i:i + KEY_CHUNK]))):
+            existing[ev.client_event_id] = ev
+    archived: dict[str, int] = {}
+    unseen = [k for k in keys if k not in existing]
+    for i in range(0, len(unseen), KEY_CHUNK):
+        archived.update((key, eid) for eid, key in db.execute(
+            select(PlayEventArchive.id, PlayEventArchive.client_event_id)
+            .where(PlayEventArchive.user_id == user_id,
+                   PlayEventArchive.client_event_id.in_(unseen[i:i + KEY_CHUNK]))))
+
+    track_ids = {e["track_id"] for e in by_key.values()} | {ev.track_id for ev in existing.values()}
+    durations = dict(db.query(Song.id, Song.duration).filter(Song.id.in_(track_ids)).all()) if track_ids else {}
+
+    new_rows, finished_updates, results = [], [], {}
+    for key, e in by_key.items():
+        has_end = e.get("ended_at") is not None or e.get("position_end_sec") is not None
+        ev = existing.get(key)
+        if ev is not None:
+            if ev.ended_at is None and has_end:
+                row = {"id": ev.id, "user_id": user_id, "track_id": ev.track_id,
+                       "started_at": _as_ams(ev.started_at), "position_start_sec": ev.position_start_sec,
+                       "context_type": ev.context_type, "context_id": ev.context_id}
+                _finish(row, _as_ams(e.get("ended_at")), e.get("position_end_sec"), durations)
+                finished_updates.append(row)
+                results[key] = {"client_event_id": key, "event_id": ev.id, "status": "completed"}
+            else:
+                results[key] = {"client_event_id": key, "event_id": ev.id, "status": "duplicate"}
+            continue
+        if key in archived:
+            results[key] = {"client_event_id": key, "event_id": archived[key], "status": "duplicate"}
+            continue
+
+        row = {
+            "user_id": user_id,
+            "client_event_id": key,
+            "track_id": e["track_id"],
+            "context_type": e.get("context_type"),
+            "context_id": e.get("context_id"),
+            "source_label": e.get("source_label"),
+            "device": e.get("device"),
+            "started_at": _as_ams(e.get("started_at")) or datetime.now(tz=AMS),
+            "ended_at": None,
+            "position_start_sec": e.get("position_start_sec") or 0,
+            "position_end_sec": None,
+            "duration_played_sec": 0,
+            "is_skip": False,
+        }
+        if allocate_id is not None:
+            row["id"] = allocate_id()
+        if has_end:
+            _finish(row, _as_ams(e.get("ended_at")), e.get("position_end_sec"), durations)
+        new_rows.append(row)
+
+    if new_rows:
+        inserted = dict((key, event_id) for event_id, key in db.execute(
+            insert(PlayEvent).returning(PlayEvent.id, PlayEvent.client_event_id), new_rows,
+        ))
+        for row in new_rows:
+            key = row["client_event_id"]
+            row["id"] = inserted[key]
+            results[key] = {"client_event_id": key, "event_id": row["id"],
+                            "status": "created" if row["ended_at"] is None else "completed"}
+
+    if finished_updates:
+        db.execute(update(PlayEvent), [
+            {k: r[k] for k in ("id", "ended_at", "position_end_sec", "duration_played_sec", "is_skip")}
+            for r in finished_updates
+        ])
+
+    finished = [r for r in new_rows if r["ended_at"] is not None] + finished_updates
+    apply_plays(db, [SimpleNamespace(**r) for r in finished])
+
+    # one progress write per context: its most recent finished play, stamped with its end
+    latest: dict[tuple, dict] = {}
+    for r in finished:
+        if r["context_type"] and r["context_id"]:
+            ctx = (r["context_type"], r["context_id"])
+            if ctx not in latest or r["ended_at"] > latest[ctx]["ended_at"]:
+                latest[ctx] = r
+    upsert_context_progress(db, [
+        context_progress_row(db, user_id, ct, cid, r["track_id"], r["duration_played_sec"],
+                             durations.get(r["track_id"]), r["ended_at"])
+        for (ct, cid), r in latest.items()
+    ])
+
+    tiles = [RECENTLY_PLAYED]
+    if finished:
+        tiles += [MOST_LISTENED, CONTINUE_LISTENING]
+    invalidate_home_tiles(db, user_id, tiles)
+    db.commit()
+    return [results[k] for k in keys]
@@ -0,0 +1,181 @@
+# services/playlists.py
+"""
+Playlist track order, plus the cached header totals (track_count, total_duration).
+
+PlaylistTrack.order_index is a sparse integer key: rows are ORDER_STEP apart, so
+putting a track between two others takes the midpoint and touches one row. When two
+neighbours end up adjacent (no integer left between them) the playlist is renumbered;
+edits that leave gaps below REBALANCE_MIN_GAP schedule a renumber in the background
+so the next edit doesn't have to.
+"""
+from typing import Optional
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import Playlist, PlaylistTrack, Song
+
+ORDER_STEP = 1024
+REBALANCE_MIN_GAP = 8
+
+
+class PlaylistEditError(ValueError):
+    pass
+
+
+def next_order_index(db: Session, playlist_id: int) -> int:
+    last = (db.query(func.max(PlaylistTrack.order_index))
+            .filter(PlaylistTrack.playlist_id == playlist_id)
+            .scalar())
+    return (last or 0) + ORDER_STEP
+
+
+def refresh_playlist_totals(db: Session, playlist_id: int) -> None:
+    """Recompute the cached track_count / total_duration of a playlist. Does not commit."""
+    count = select(func.count(PlaylistTrack.id)).where(PlaylistTrack.playlist_id == playlist_id)
+    duration = (select(func.coalesce(func.sum(Song.duration), 0))
+                .join(PlaylistTrack, PlaylistTrack.track_id == Song.id)
+                .where(PlaylistTrack.playlist_id == playlist_id))
+    db.execute(
+        update(Playlist)
+        .where(Playlist.id == playlist_id)
+        .values(
+            track_count=count.scalar_subquery(),
+            total_duration=duration.scalar_subquery(),
+        )
+    )
+
+
+def index_between(prev: Optional[int], nxt: Optional[int]) -> Optional[int]:
+    """A key strictly between two neighbours (None = list edge), or None when they're adjacent."""
+    if prev is None and nxt is None:
+        return ORDER_STEP
+    if prev is None:
+        return nxt - ORDER_STEP
+    if nxt is None:
+        return prev + ORDER_STEP
+    if nxt - prev < 2:
+        return None
+    return (prev + nxt) // 2
+
+
+def _ordered_rows(db: Session, playlist_id: int) -> list[PlaylistTrack]:
+    return (db.query(PlaylistTrack)
+            .filter(PlaylistTrack.playlist_id == playlist_id)
+            .order_by(PlaylistTrack.order_index, PlaylistTrack.id)
+            .all())
+
+
+def min_gap(keys: list[int]) -> Optional[int]:
+    gaps = [b - a for a, b in zip(keys, keys[1:])]
+    return min(gaps) if gaps else None
+
+
+def rebalance_playlist(db: Session, playlist_id: int) -> int:
+    """Renumber a playlist to ORDER_STEP spacing, keeping its order. Does not commit."""
+    rows = (db.query(PlaylistTrack.id)
+            .filter(PlaylistTrack.playlist_id == playlist_id)
+            .order_by(PlaylistTrack.order_index, PlaylistTrack.id)
+            .all())
+    if rows:
+        db.execute(update(PlaylistTrack), [
+            {"id": r.id, "order_index": (i + 1) * ORDER_STEP} for i, r in enumerate(rows)
+        ])
+    return len(rows)
+
+
+def rebalance_in_background(playlist_id: int) -> None:
+    """BackgroundTasks entry point: renumber in its own session after the response went out."""
+    db = SessionLocal()
+    try:
+        rebalance_playlist(db, playlist_id)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"⚠️ Playlist {playlist_id} rebalance failed: {e}")
+    finally:
+        db.close()
+
+
+def apply_track_ops(db: Session, playlist_id: int, ops: list[dict]) -> dict:
+    """
+    Apply an edit list to a playlist in one transaction (caller commits). Each op is
+    {"op": "add" | "insert_at" | "remove" | "move", "song_id": int, "position": int?};
+    positions are 0-based, required for insert_at / move, and clamped to the list. Adding a track that is already in
+    the playlist is a no-op, like the single add endpoint. Raises PlaylistEditError
+    (nothing applied) when an op refers to a track that isn't in the playlist or lacks
+    its position.
+    """
+    rows = _ordered_rows(db, playlist_id)
+    order = [(r.track_id, r.order_index) for r in rows]   # working copy, in play order
+    row_by_track = {r.track_id: r for r in rows}
+    added: set[int] = set()
+    renumbered = False
+
+    def position_of(track_id: int) -> int:
+        for i, (tid, _) in enumerate(order):
+            if tid == track_id:
+                return i
+        return -1
+
+    def place(track_id: int, pos: int) -> None:
+        nonlocal order, renumbered
+        pos = max(0, min(pos, len(order)))
+        prev = order[pos - 1][1] if pos > 0 else None
+        nxt = order[pos][1] if pos < len(order) else None
+        key = index_between(prev, nxt)
+        if key is None:  # neighbours are adjacent: renumber everything, then retry
+            order = [(tid, (i + 1) * ORDER_STEP) for i, (tid, _) in enumerate(order)]
+            renumbered = True
+            prev = order[pos - 1][1] if pos > 0 else None
+            nxt = order[pos][1] if pos < len(order) else None
+            key = index_between(prev, nxt)
+        order.insert(pos, (track_id, key))
+
+    for i, op in enumerate(ops):
+        kind, track_id = op["op"], op["song_id"]
+        if kind in ("insert_at", "move") and op.get("position") is None:
+            raise PlaylistEditError(f"op {i}: {kind} needs a position")
+        current = position_of(track_id)
+        if kind in ("add", "insert_at"):
+            if current >= 0:
+                continue
+            place(track_id, len(order) if kind == "add" else op["position"])
+            added.add(track_id)
+        elif current < 0:
+            raise PlaylistEditError(f"op {i}: track {track_id} is not in the playlist")
+        elif kind == "remove":
+            order.pop(current)
+            added.discard(track_id)
+        else:  # move
+            order.pop(current)
+            place(track_id, op["position"])
+
+    keys = dict(order)
+    removed = [r.id for tid, r in row_by_track.items() if tid not in keys]
+    if removed:
+        db.query(PlaylistTrack).filter(PlaylistTrack.id.in_(removed)).delete(synchronize_session=False)
+    changed = [
+        {"id": r.id, "order_index": keys[tid]}
+        for tid, r in row_by_track.items()
+        if tid in keys and keys[tid] != r.order_index
+    ]
+    if changed:
+        db.execute(update(PlaylistTrack), changed)
+    if added:
+        # plain executemany: ORM add_all() would INSERT ... RETURNING once per row to fetch ids
+        db.execute(insert(PlaylistTrack), [
+            {"playlist_id": playlist_id, "track_id": tid, "order_index": keys[tid]} for tid in added
+        ])
+    if added or removed:
+        refresh_playlist_totals(db, playlist_id)
+
+    gap = min_gap([k for _, k in order])
+    return {
+        "track_count": len(order),
+        "added": len(added),
+        "removed": len(removed),
+        "updated": len(changed),
+        "renumbered": renumbered,
+        "needs_rebalance": gap is not None and gap < REBALANCE_MIN_GAP,
+    }
@@ -0,0 +1,127 @@
+# services/retention.py
+"""
+Tiered retention for play_events.
+
+Rows older than PLAY_EVENTS_RETENTION_DAYS move, in batches and keeping their ids, to
+play_events_archive (a separate SQLite file ATTACHed as "archive"; a plain table on other
+backends). Their listening time is already in listening_daily, since end_event and
+/play/batch fold every finished play into the rollups as it happens, so the hot table
+only has to hold what recent-history reads (recently played, open events) need.
+
+Full-history readers (rollup rebuild, analytics) go through play_history(), which
+unions both tiers. Run `python -m services.retention [--days N] [--vacuum]`, or set
+PLAY_EVENTS_RETENTION_DAYS to let the app archive once a day in the background.
+"""
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Optional
+from zoneinfo import ZoneInfo
+from sqlalchemy import select, insert, delete, union_all
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import PlayEvent, PlayEventArchive
+
+AMS = ZoneInfo("Europe/Amsterdam")
+PLAY_EVENTS_RETENTION_DAYS = int(os.getenv("PLAY_EVENTS_RETENTION_DAYS", "0"))  # 0 = keep everything hot
+ARCHIVE_BATCH = int(os.getenv("PLAY_ARCHIVE_BATCH", "5000"))
+RETENTION_INTERVAL_SECONDS = 24 * 3600
+
+_COLUMNS = [c.name for c in PlayEvent.__table__.columns]
+
+
+def play_history(*columns: str):
+    """
+    Subquery over hot + archived play events with the given (default: all) columns,
+    e.g. `db.query(h.c.track_id).filter(h.c.user_id == uid)` with h = play_history().
+    """
+    names = list(columns) or _COLUMNS
+    hot = select(*[PlayEvent.__table__.c[n] for n in names])
+    cold = select(*[PlayEventArchive.__table__.c[n] for n in names])
+    return union_all(hot, cold).subquery("play_history")
+
+
+def archive_play_events(db: Session, older_than_days: int, batch_size: int = ARCHIVE_BATCH) -> int:
+    """Move play events started before the cutoff into the archive. Returns rows moved."""
+    cutoff = datetime.now(tz=AMS) - timedelta(days=older_than_days)
+    hot = PlayEvent.__table__
+    moved = 0
+    while True:
+        ids = [r[0] for r in db.execute(
+            select(hot.c.id).where(hot.c.started_at < cutoff).order_by(hot.c.id).limit(batch_size)
+        )]
+        if not ids:
+            break
+        db.execute(insert(PlayEventArchive.__table__).from_select(
+            _COLUMNS, select(*[hot.c[n] for n in _COLUMNS]).where(hot.c.id.in_(ids))
+        ))
+        db.execute(delete(hot).where(hot.c.id.in_(ids)))
+        db.commit()  # one batch per transaction keeps write locks short
+        moved += len(ids)
+    return moved
+
+
+def vacuum(db: Session) -> None:
+    """Give freed pages back to the OS (SQLite). Needs exclusive access; run off-peak."""
+    if db.get_bind().dialect.name == "sqlite":
+        db.commit()
+        with db.get_bind().connect() as conn:
+            conn.exec_driver_sql("VACUUM")
+
+
+# ---------- Background worker ----------
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+
+def _run() -> None:
+    while not _stop.is_set():
+        db = SessionLocal()
+        try:
+            moved = archive_play_events(db, PLAY_EVENTS_RETENTION_DAYS)
+            if moved:
+                print(f"Archived {moved} play events older than {PLAY_EVENTS_RETENTION_DAYS} days")
+        except Exception as e:
+            db.rollback()
+            print(f"⚠️ Play event archiving failed: {e}")
+        finally:
+            db.close()
+        _stop.wait(RETENTION_INTERVAL_SECONDS)
+
+
+def start_retention_worker() -> None:
+    global _thread
+    if PLAY_EVENTS_RETENTION_DAYS > 0 and _thread is None:
+        _stop.clear()
+        _thread = threading.Thread(target=_run, name="play-event-retention", daemon=True)
+        _thread.start()
+
+
+def stop_retention_worker() -> None:
+    global _thread
+    _stop.set()
+    if _thread is not None:
+        _thread.join(timeout=5)
+        _thread = None
+
+
+if __name__ == "__main__":
+    import argparse
+    from database import Base, engine
+
+    parser = argparse.ArgumentParser(description="Move old play events into the archive.")
+    parser.add_argument("--days", type=int, default=PLAY_EVENTS_RETENTION_DAYS or 180,
+                        help="archive events that started more than this many days ago")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM afterwards (SQLite)")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        n = archive_play_events(session, args.days)
+        print(f"Archived {n} play events")
+        if args.vacuum:
+            vacuum(session)
+    finally:
+        session.close()
@@ -0,0 +1,190 @@
+# services/rollups.py
+"""
+Daily listening rollups: (user, track, Amsterdam-local day) → seconds, plays, skips.
+
+end_event feeds them incrementally; `python -m services.rollups` rebuilds them from
+the raw play history, hot and archived (after a manual data fix). On startup,
+run_migrations fills an empty table from existing history (backfill_rollups).
+"""
+from datetime import datetime, date, timedelta
+from zoneinfo import ZoneInfo
+from typing import Any, Dict, Iterable, Optional
+from sqlalchemy.orm import Session
+from sqlalchemy import func, desc, case
+
+from database import upsert_insert
+from models import ListeningDaily, Song
+from services.retention import play_history
+
+AMS = ZoneInfo("Europe/Amsterdam")
+MIN_PLAY_SECONDS = 30  # a play counts towards "most listened" from 30s on
+REBUILD_CHUNK = 10_000
+
+
+def local_day(dt: datetime) -> date:
+    """Amsterdam calendar day of a timestamp (SQLite hands back naive local times)."""
+    if dt.tzinfo is None:
+        return dt.date()
+    return dt.astimezone(AMS).date()
+
+
+def _aggregate(events: Iterable[Any], into: Optional[Dict[tuple, dict]] = None) -> Dict[tuple, dict]:
+    acc = into if into is not None else {}
+    for ev in events:
+        if not ev.started_at or not ev.ended_at:
+            continue
+        key = (ev.user_id, ev.track_id, local_day(ev.started_at))
+        row = acc.get(key)
+        if row is None:
+            row = acc[key] = {
+                "user_id": key[0], "track_id": key[1], "day": key[2],
+                "seconds_played": 0, "play_count": 0, "skip_count": 0, "last_played_at": None,
+            }
+        secs = ev.duration_played_sec or 0
+        if secs >= MIN_PLAY_SECONDS:
+            row["seconds_played"] += secs
+            row["play_count"] += 1
+        if ev.is_skip:
+            row["skip_count"] += 1
+        if row["last_played_at"] is None or ev.ended_at > row["last_played_at"]:
+            row["last_played_at"] = ev.ended_at
+    return acc
+
+
+def apply_plays(db: Session, events: Iterable[Any]) -> None:
+    """
+    Fold finished events into the rollups with one upsert (executemany).
+    Accepts PlayEvent rows or anything with the same attributes. Does not commit.
+    """
+    rows = list(_aggregate(events).values())
+    if not rows:
+        return
+    stmt = upsert_insert(db, ListeningDaily)
+    ex = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ListeningDaily.user_id, ListeningDaily.track_id, ListeningDaily.day],
+        set_={
+            "seconds_played": ListeningDaily.seconds_played + ex.seconds_played,
+            "play_count": ListeningDaily.play_count + ex.play_count,
+            "skip_count": ListeningDaily.skip_count + ex.skip_count,
+            "last_played_at": case(
+                (ListeningDaily.last_played_at.is_(None), ex.last_played_at),
+                (ex.last_played_at > ListeningDaily.last_played_at, ex.last_played_at),
+                else_=ListeningDaily.last_played_at,
+            ),
+        },
+    )
+    db.execute(stmt, rows)
+
+
+def rebuild_rollups(db: Session, user_id: Optional[int] = None) -> int:
+    """Recompute rollups from raw play events (hot + archive). Returns the number of rollup rows written."""
+    q = db.query(ListeningDaily)
+    if user_id is not None:
+        q = q.filter(ListeningDaily.user_id == user_id)
+    q.delete(synchronize_session=False)
+
+    h = play_history("user_id", "track_id", "started_at", "ended_at", "duration_played_sec", "is_skip")
+    evq = db.query(h).filter(h.c.ended_at != None)
+    if user_id is not None:
+        evq = evq.filter(h.c.user_id == user_id)
+
+    acc: Dict[tuple, dict] = {}
+    _aggregate(evq.yield_per(REBUILD_CHUNK), into=acc)
+
+    rows = list(acc.values())
+    for i in range(0, len(rows), REBUILD_CHUNK):
+        db.bulk_insert_mappings(ListeningDaily, rows[i:i + REBUILD_CHUNK])
+    db.commit()
+    return len(rows)
+
+
+def backfill_rollups(db: Session) -> int:
+    """
+    Rebuild the rollups if there are none yet but there are finished plays (a database
+    from before listening_daily existed). Returns the number of rollup rows written.
+    """
+    if db.query(ListeningDaily.user_id).first() is not None:
+        return 0
+    h = play_history("ended_at")
+    if db.query(h.c.ended_at).filter(h.c.ended_at != None).first() is None:
+        return 0
+    return rebuild_rollups(db)
+
+
+# ---------- Periods ----------
+def week_bounds(now: datetime) -> tuple[date, date]:
+    d = now.astimezone(AMS).date()
+    monday = d - timedelta(days=d.weekday())
+    return monday, monday + timedelta(days=6)
+
+
+def month_bounds(now: datetime) -> tuple[date, date]:
+    d = now.astimezone(AMS).date()
+    first = d.replace(day=1)
+    next_first = (first + timedelta(days=32)).replace(day=1)
+    return first, next_first - timedelta(days=1)
+
+
+def period_bounds(period: str, now: Optional[datetime] = None) -> tuple[Optional[date], Optional[date]]:
+    now = now or datetime.now(tz=AMS)
+    if period == "week":
+        return week_bounds(now)
+    if period == "month":
+        return month_bounds(now)
+    return None, None  # all time
+
+
+# ---------- Top lists ----------
+def top_tracks(db: Session, user_id: int, start: Optional[date], end: Optional[date], limit: int = 5) -> list[dict]:
+    """Top tracks by seconds played between two local days (inclusive), read from the rollups."""
+    seconds = func.sum(ListeningDaily.seconds_played)
+    q = (db.query(
+            ListeningDaily.track_id.label("track_id"),
+            seconds.label("seconds"),
+            func.sum(ListeningDaily.play_count).label("plays"),
+            func.max(ListeningDaily.last_played_at).label("last_played_at"),
+        )
+        .filter(ListeningDaily.user_id == user_id, ListeningDaily.play_count > 0))
+    if start is not None:
+        q = q.filter(ListeningDaily.day >= start)
+    if end is not None:
+        q = q.filter(ListeningDaily.day <= end)
+    rows = q.group_by(ListeningDaily.track_id).order_by(desc("seconds")).limit(limit).all()
+
+    ids = [r.track_id for r in rows]
+    songs = {s.id: s for s in db.query(Song).filter(Song.id.in_(ids)).all()} if ids else {}
+    items = []
+    for row in rows:
+        trk = songs.get(row.track_id)
+        if not trk:
+            continue
+        items.append({
+            "kind": "track",
+            "track_id": trk.id,
+            "title": trk.title,
+            "artist": getattr(trk, "artist", ""),
+            "album": getattr(trk, "album", ""),
+            "cover_url": getattr(trk, "cover_url", None),
+            "play_count": int(row.plays or 0),
+            "minutes_played": round((row.seconds or 0) / 60, 1),
+            "last_played_at": row.last_played_at.isoformat() if row.last_played_at else None,
+        })
+    return items
+
+
+if __name__ == "__main__":
+    import argparse
+    from database import SessionLocal, Base, engine
+
+    parser = argparse.ArgumentParser(description="Rebuild daily listening rollups from play_events.")
+    parser.add_argument("--user", type=int, default=None, help="only rebuild this user id")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        n = rebuild_rollups(session, args.user)
+        print(f"Rebuilt {n} rollup rows")
+    finally:
+        session.close()
@@ -0,0 +1,343 @@
+# services/scan_jobs.py
+"""
+Folder scans as background jobs.
+
+POST /folders/{id}/rescan only inserts a scan_jobs row. SCAN_JOB_WORKERS threads claim
+queued jobs and run scan_folder; after every committed batch the job row gets its
+counters and checkpoint (last committed path), and a cancel request stops the scan at
+that point. The heartbeat is refreshed from a separate thread every
+SCAN_JOB_HEARTBEAT_SECONDS while the job runs, as the walk of a big or network-mounted
+library can take far longer than a batch. A partial unique index allows one queued/running job per
+folder, so enqueueing while a scan is active hands back the active job. Jobs from the
+filesystem watcher (services/watcher.py) carry the paths to look at instead of
+walking the whole folder; they are merged while queued.
+
+A job left "running" by a process that died is put back in the queue: at startup when
+it belonged to a dead pid on this host, otherwise by any worker once its heartbeat is
+older than SCAN_JOB_STALE_SECONDS. It then resumes after its checkpoint. On shutdown
+the running scan stops after its batch and is re-queued the same way.
+Run `python -m services.scan_jobs` for a standalone worker (e.g. with SCAN_JOB_WORKERS=0
+in the API).
+"""
+import json
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+from typing import Optional
+from zoneinfo import ZoneInfo
+from sqlalchemy import and_, case, func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import Folder, ScanJob
+from services.scanner import scan_folder, scan_paths, ScanCancelled, ScanResult
+
+AMS = ZoneInfo("Europe/Amsterdam")
+SCAN_JOB_WORKERS = int(os.getenv("SCAN_JOB_WORKERS", "1"))      # 0 = jobs run elsewhere
+SCAN_JOB_POLL_SECONDS = float(os.getenv("SCAN_JOB_POLL_SECONDS", "5"))
+SCAN_JOB_STALE_SECONDS = int(os.getenv("SCAN_JOB_STALE_SECONDS", "900"))  # well above the heartbeat interval
+SCAN_JOB_HEARTBEAT_SECONDS = float(os.getenv("SCAN_JOB_HEARTBEAT_SECONDS", "60"))
+SCAN_JOB_MAX_PATHS = int(os.getenv("SCAN_JOB_MAX_PATHS", "10000"))  # bigger path sets become a whole-folder scan
+ACTIVE = ("queued", "running")
+
+
+def _worker_id() -> str:
+    # per call, not at import: server workers may be forked after this module loads
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def active_job(db: Session, folder_id: int) -> Optional[ScanJob]:
+    return db.query(ScanJob).filter(ScanJob.folder_id == folder_id, ScanJob.status.in_(ACTIVE)).first()
+
+
+def request_scan(db: Session, folder_id: int, user_id: int,
+                 files: Optional[list[str]] = None, dirs: Optional[list[str]] = None) -> tuple[Optional[ScanJob], bool]:
+    """
+    Make sure a queued job covers a scan of the folder: of only these files/directories
+    (the watcher), or of all of it when both are None. A queued job is widened to cover
+    the request. Returns (job, created), or (None, False) while a scan of the folder is
+    running, as that one may already be past the paths; ask again later.
+    """
+    want = None if files is None and dirs is None else _merge({"files": [], "dirs": []}, files or [], dirs or [])
+    for _ in range(3):
+        job = active_job(db, folder_id)
+        if job is None:
+            job = ScanJob(folder_id=folder_id, user_id=user_id, status="queued",
+                          paths=None if want is None else json.dumps(want))
+            db.add(job)
+            try:
+                db.commit()
+            except IntegrityError:  # uq_scan_jobs_active_folder: another one was queued meanwhile
+                db.rollback()
+                continue
+            db.refresh(job)
+            _wake.set()
+            return job, True
+        if job.status == "running":
+            return None, False
+        if job.paths is None:
+            return job, False  # a queued whole-folder scan covers anything
+        merged = None if want is None else _merge(json.loads(job.paths), want["files"], want["dirs"])
+        widened = db.execute(
+            update(ScanJob)
+            .where(ScanJob.id == job.id, ScanJob.status == "queued", ScanJob.paths == job.paths)
+            # an interrupted job may hold a checkpoint; new paths could sort below it
+            .values(paths=None if merged is None else json.dumps(merged), checkpoint=None)
+        ).rowcount
+        db.commit()
+        if widened:
+            db.refresh(job)
+            return job, False
+    return None, False
+
+
+def enqueue_scan(db: Session, folder_id: int, user_id: int) -> tuple[ScanJob, bool]:
+    """Queue a whole-folder scan. Returns (job, created); an already running job is returned as is."""
+    job, created = request_scan(db, folder_id, user_id)
+    if job is None:
+        job = active_job(db, folder_id)
+    if job is None:
+        raise RuntimeError(f"Could not queue a scan for folder {folder_id}")
+    return job, created
+
+
+def _merge(paths: dict, files: list[str], dirs: list[str]) -> Optional[dict]:
+    """Union of two path sets; None (= scan the whole folder) once it exceeds SCAN_JOB_MAX_PATHS."""
+    merged = {"files": sorted(set(paths["files"]) | set(files)), "dirs": sorted(set(paths["dirs"]) | set(dirs))}
+    if len(merged["files"]) + len(merged["dirs"]) > SCAN_JOB_MAX_PATHS:
+        return None
+    return merged
+
+
+def cancel_job(db: Session, job: ScanJob) -> ScanJob:
+    """Cancel a queued job right away; a running one stops after its current batch."""
+    now = datetime.now(tz=AMS)
+    db.execute(
+        update(ScanJob)
+        .where(ScanJob.id == job.id, ScanJob.status.in_(ACTIVE))
+        .values(
+            cancel_requested=True,
+            status=case((ScanJob.status == "queued", "cancelled"), else_=ScanJob.status),
+            finished_at=case((ScanJob.status == "queued", now), else_=ScanJob.finished_at),
+        )
+    )
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+# ---------- Claiming ----------
+def _claimable(stale_before: datetime):
+    return or_(
+        ScanJob.status == "queued",
+        and_(ScanJob.status == "running", ScanJob.heartbeat_at < stale_before),
+    )
+
+
+def claim_next_job(db: Session) -> Optional[int]:
+    """Atomically mark the oldest claimable job as running by this process; returns its id."""
+    now = datetime.now(tz=AMS)
+    claimable = _claimable(now - timedelta(seconds=SCAN_JOB_STALE_SECONDS))
+    oldest = select(ScanJob.id).where(claimable).order_by(ScanJob.id).limit(1).scalar_subquery()
+    # the repeated condition makes a concurrent claim of the same row a no-op
+    job_id = db.execute(
+        update(ScanJob)
+        .where(ScanJob.id == oldest, claimable)
+        .values(status="running", worker=_worker_id(), heartbeat_at=now,
+                started_at=func.coalesce(ScanJob.started_at, now))
+        .returning(ScanJob.id)
+    ).scalar()
+    db.commit()
+    return job_id
+
+
+def requeue_orphaned_jobs(db: Session) -> int:
+    """Re-queue running jobs of dead processes on this host (e.g. after a crash or restart)."""
+    host, me = socket.gethostname(), os.getpid()
+    orphaned = []
+    for job_id, worker in db.query(ScanJob.id, ScanJob.worker).filter(ScanJob.status == "running"):
+        w_host, _, w_pid = (worker or "").rpartition(":")
+        if w_host != host or not w_pid.isdigit():
+            continue
+        pid = int(w_pid)
+        if pid == me or not _pid_alive(pid):  # pid == me: a restarted container reuses pids
+            orphaned.append(job_id)
+    if orphaned:
+        db.execute(update(ScanJob).where(ScanJob.id.in_(orphaned), ScanJob.status == "running")
+                   .values(status="queued", worker=None))
+        db.commit()
+    return len(orphaned)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+# ---------- Running ----------
+def _heartbeat(job_id: int, me: str, done: threading.Event) -> None:
+    """Keep a running job's heartbeat fresh until `done` is set or the job is taken over."""
+    while not done.wait(SCAN_JOB_HEARTBEAT_SECONDS):
+        db = SessionLocal()
+        try:
+            beat = db.execute(
+                update(ScanJob)
+                .where(ScanJob.id == job_id, ScanJob.worker == me, ScanJob.status == "running")
+                .values(heartbeat_at=datetime.now(tz=AMS))
+            ).rowcount
+            db.commit()
+            if not beat:
+                return  # finished or taken over; progress() notices the latter
+        except Exception as e:
+            db.rollback()
+            print(f"⚠️ Scan job {job_id} heartbeat failed: {e}")
+        finally:
+            db.close()
+
+
+def run_job(job_id: int) -> None:
+    """Run a claimed job to completion, cancellation or failure, in its own session."""
+    db = SessionLocal()
+    me = _worker_id()
+    lost = False
+    done = threading.Event()
+    beat = threading.Thread(target=_heartbeat, args=(job_id, me, done), name=f"scan-job-{job_id}-heartbeat",
+                            daemon=True)
+    beat.start()
+    try:
+        job = db.get(ScanJob, job_id)
+        folder = db.get(Folder, job.folder_id)
+        if folder is None:
+            _finish(db, job_id, me, "failed", error="Folder not found")
+            return
+        # a resumed job keeps what it already wrote; the new run's diff no longer sees it
+        base = {k: getattr(job, k) for k in ("processed", "added", "changed", "moved", "removed", "revived")}
+        resume_after = job.checkpoint
+
+        def progress(result: ScanResult, done: int, total: int, checkpoint: Optional[str]) -> None:
+            nonlocal lost
+            cancel = db.execute(
+                update(ScanJob)
+                .where(ScanJob.id == job_id, ScanJob.worker == me, ScanJob.status == "running")
+                .values(
+                    total=base["processed"] + total,
+                    processed=base["processed"] + done,
+                    added=base["added"] + len(result.added),
+                    changed=base["changed"] + result.changed,
+                    moved=base["moved"] + result.moved,
+                    removed=base["removed"] + result.removed,
+                    revived=base["revived"] + result.revived,
+                    unchanged=result.unchanged,
+                    checkpoint=checkpoint,
+                )
+                .returning(ScanJob.cancel_requested)
+            ).first()
+            db.commit()
+            if cancel is None:  # taken over after a stale heartbeat: stop writing
+                lost = True
+                raise ScanCancelled()
+            if cancel[0] or _stop.is_set():
+                raise ScanCancelled()
+
+        if job.paths is None:
+            result = scan_folder(db, folder, job.user_id, resume_after=resume_after, progress=progress)
+        else:
+            paths = json.loads(job.paths)
+            result = scan_paths(db, folder, job.user_id, paths["files"], paths["dirs"],
+                                resume_after=resume_after, progress=progress)
+        if lost:
+            print(f"⚠️ Scan job {job_id} was taken over by another worker")
+        elif result.cancelled and _stop.is_set():
+            _finish(db, job_id, me, "queued")  # shutting down: resume on next start
+        else:
+            _finish(db, job_id, me, "cancelled" if result.cancelled else "done")
+    except Exception as e:
+        db.rollback()
+        print(f"⚠️ Scan job {job_id} failed: {e}")
+        _finish(db, job_id, me, "failed", error=str(e)[:2000])
+    finally:
+        done.set()
+        beat.join()
+        db.close()
+
+
+def _finish(db: Session, job_id: int, me: str, status: str, error: Optional[str] = None) -> None:
+    now = datetime.now(tz=AMS)
+    db.execute(
+        update(ScanJob)
+        .where(ScanJob.id == job_id, ScanJob.worker == me)
+        .values(status=status, error=error, heartbeat_at=now,
+                worker=None if status == "queued" else me,
+                finished_at=None if status == "queued" else now)
+    )
+    db.commit()
+
+
+# ---------- Background workers ----------
+_stop = threading.Event()
+_wake = threading.Event()   # set by enqueue_scan so an idle worker doesn't wait out the poll
+_threads: list[threading.Thread] = []
+
+
+def _run() -> None:
+    while not _stop.is_set():
+        db = SessionLocal()
+        try:
+            job_id = claim_next_job(db)
+        except Exception as e:
+            db.rollback()
+            print(f"⚠️ Claiming a scan job failed: {e}")
+            job_id = None
+        finally:
+            db.close()
+        if job_id is None:
+            _wake.wait(SCAN_JOB_POLL_SECONDS)
+            _wake.clear()
+            continue
+        run_job(job_id)
+
+
+def start_scan_workers(workers: int = SCAN_JOB_WORKERS) -> None:
+    if workers <= 0 or _threads:
+        return
+    db = SessionLocal()
+    try:
+        n = requeue_orphaned_jobs(db)
+        if n:
+            print(f"Re-queued {n} interrupted scan jobs")
+    finally:
+        db.close()
+    _stop.clear()
+    for i in range(workers):
+        t = threading.Thread(target=_run, name=f"scan-jobs-{i}", daemon=True)
+        t.start()
+        _threads.append(t)
+
+
+def stop_scan_workers() -> None:
+    _stop.set()
+    _wake.set()
+    for t in _threads:
+        t.join(timeout=10)
+    _threads.clear()
+
+
+if __name__ == "__main__":
+    from database import Base, engine
+    from migrations import run_migrations
+
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    start_scan_workers(max(SCAN_JOB_WORKERS, 1))
+    try:
+        while True:
+            _stop.wait(3600)
+    except KeyboardInterrupt:
+        stop_scan_workers()
@@ -0,0 +1,318 @@
+# services/scanner.py
+"""
+Incremental folder scan.
+
+Every song remembers the fingerprint of its file (size, mtime_ns, inode). A rescan
+loads the folder's path → fingerprint map in one query, walks the tree with
+os.scandir (inode comes free with the directory entry, size/mtime cost one stat),
+and diffs the two:
+
+- new path                 → read tags, insert in batches (SCAN_INSERT_BATCH per commit), queue enrichment
+- new path, same inode+size as a vanished song → rename: update path only
+- known path, fingerprint changed → re-read duration (and tags, unless Spotify-enriched)
+- known path, no fingerprint yet  → backfill the fingerprint, no tag read
+- vanished path            → tombstone (deleted_at); likes, playlists and history stay
+- tombstoned path is back  → revive
+
+An unchanged rescan only stats files and reads the map; nothing is written. Tags of
+new and changed files are read on a thread or process pool (SCAN_POOL, SCAN_WORKERS)
+and handed back in chunks to the scan thread, which does all the writing.
+
+Scans started from the API run as background jobs (services/scan_jobs.py).
+"""
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Iterator, Optional
+from zoneinfo import ZoneInfo
+from sqlalchemy import insert, update
+from sqlalchemy.orm import Session
+
+from models import Folder, Song
+from services.enrichment import enqueue_enrichment
+from services.home import invalidate_home_tiles, NEWLY_ADDED, ALL_TILES
+from utils.tags import read_tags, read_many
+
+AMS = ZoneInfo("Europe/Amsterdam")
+AUDIO_EXTENSIONS = (".mp3", ".flac", ".wav", ".ogg")
+
+# Tag reading fans out to a pool; the scan thread stays the only DB writer.
+SCAN_POOL = os.getenv("SCAN_POOL", "thread")         # thread | process | none
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", "8"))
+SCAN_CHUNK = int(os.getenv("SCAN_CHUNK", "32"))       # files per pool task
+SCAN_WRITE_CHUNK = int(os.getenv("SCAN_WRITE_CHUNK", "500"))  # changed rows per UPDATE batch
+SCAN_INSERT_BATCH = int(os.getenv("SCAN_INSERT_BATCH", "500"))  # new songs per INSERT transaction
+
+
+class ScanCancelled(Exception):
+    """Raised from a progress callback to stop a scan after the current batch."""
+
+
+@dataclass(frozen=True)
+class FileStat:
+    size: int
+    mtime_ns: int
+    inode: int
+
+
+@dataclass
+class ScanResult:
+    added: list[int] = field(default_factory=list)   # ids of the inserted songs
+    changed: int = 0
+    moved: int = 0
+    removed: int = 0
+    revived: int = 0
+    unchanged: int = 0
+    cancelled: bool = False
+
+    def summary(self) -> dict:
+        return {
+            "added": len(self.added),
+            "changed": self.changed,
+            "moved": self.moved,
+            "removed": self.removed,
+            "revived": self.revived,
+            "unchanged": self.unchanged,
+        }
+
+
+def walk_audio_files(root: str) -> dict[str, FileStat]:
+    """Absolute path → fingerprint for every audio file below root."""
+    found: dict[str, FileStat] = {}
+    stack = [os.path.abspath(root)]
+    while stack:
+        path = stack.pop()
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.lower().endswith(AUDIO_EXTENSIONS):
+                        try:
+                            st = entry.stat()
+                        except OSError as e:
+                            print(f"⚠️ Can't stat {entry.path}: {e}")
+                            continue
+                        found[entry.path] = FileStat(st.st_size, st.st_mtime_ns, entry.inode())
+        except OSError as e:
+            print(f"⚠️ Can't list {path}: {e}")
+    return found
+
+
+def extract_tags(paths: list[str], read: Callable[[str], Optional[dict]] = read_tags,
+                 pool: str = SCAN_POOL, workers: int = SCAN_WORKERS,
+                 chunk: int = SCAN_CHUNK) -> Iterator[tuple[str, Optional[dict]]]:
+    """
+    Yield (path, tags) for every path, in order, reading on a pool. Results come back
+    chunk by chunk with a bounded number of chunks in flight, so memory stays flat on
+    huge libraries. A process pool needs a picklable (module-level) read function.
+    """
+    if pool == "none" or workers <= 1 or len(paths) <= chunk:
+        for path, tags in zip(paths, read_many(paths, read)):
+            yield path, tags
+        return
+
+    if pool == "process":
+        # spawn: forking a threaded server process is unsafe
+        executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+    else:
+        executor = ThreadPoolExecutor(workers, thread_name_prefix="scan-tags")
+    chunks = [paths[i:i + chunk] for i in range(0, len(paths), chunk)]
+    in_flight = workers * 2
+    with executor:
+        futures = [executor.submit(read_many, c, read) for c in chunks[:in_flight]]
+        for i, part in enumerate(chunks):
+            if i + in_flight < len(chunks):
+                futures.append(executor.submit(read_many, chunks[i + in_flight], read))
+            try:
+                results = futures[i].result()
+            except Exception as e:  # e.g. a worker process died
+                print(f"⚠️ Tag reading failed for {len(part)} files: {e}")
+                results = [None] * len(part)
+            futures[i] = None
+            yield from zip(part, results)
+
+
+def _write_updates(db: Session, updates: list[dict]) -> None:
+    # executemany by primary key; rows differ in which columns they set, so group by shape
+    by_shape: dict[tuple, list[dict]] = {}
+    for u in updates:
+        by_shape.setdefault(tuple(sorted(u)), []).append(u)
+    for rows in by_shape.values():
+        db.execute(update(Song), rows)
+    db.commit()
+
+
+def _insert_songs(db: Session, rows: list[dict], user_id: int) -> list[int]:
+    """Insert one batch of new songs and queue their Spotify enrichment, in one transaction."""
+    ids = db.execute(insert(Song).returning(Song.id), rows).scalars().all()
+    enqueue_enrichment(db, ids, user_id)
+    db.commit()
+    return ids
+
+
+def _fingerprint(st: FileStat) -> dict:
+    return {"file_size": st.size, "file_mtime": st.mtime_ns, "inode": st.inode}
+
+
+_KNOWN_COLUMNS = (Song.id, Song.filepath, Song.file_size, Song.file_mtime, Song.inode,
+                  Song.deleted_at, Song.spotify_id)
+
+
+def scan_folder(db: Session, folder: Folder, user_id: int,
+                read: Callable[[str], Optional[dict]] = read_tags,
+                resume_after: Optional[str] = None,
+                progress: Optional[Callable[[ScanResult, int, int, Optional[str]], None]] = None) -> ScanResult:
+    """
+    Rescan a folder. Tag reads happen in path order and are committed in batches;
+    after each batch progress(result, done, total, checkpoint) is called with the last
+    committed path, and may raise ScanCancelled to stop there (result.cancelled is set).
+    resume_after skips the paths up to a checkpoint: the diff already leaves out files
+    whose rows were written, this also skips the unreadable ones. A file that appears
+    below the checkpoint meanwhile is picked up by the next scan.
+    """
+    if not os.path.isdir(folder.path):
+        # unmounted drive or typo: don't tombstone the whole folder
+        print(f"⚠️ Folder {folder.path} is not available; skipping scan")
+        return ScanResult()
+    on_disk = walk_audio_files(folder.path)
+    known = {row.filepath: row for row in db.query(*_KNOWN_COLUMNS).filter(Song.folder_id == folder.id)}
+    return _apply_scan(db, folder, user_id, on_disk, known, read, resume_after, progress)
+
+
+def scan_paths(db: Session, folder: Folder, user_id: int, files: list[str], dirs: list[str] = (),
+               read: Callable[[str], Optional[dict]] = read_tags,
+               resume_after: Optional[str] = None,
+               progress: Optional[Callable[[ScanResult, int, int, Optional[str]], None]] = None) -> ScanResult:
+    """
+    Like scan_folder, limited to some files and directory subtrees of the folder (what
+    the watcher saw change). Paths that no longer exist are tombstoned, and a rename
+    is recognised when both its old and new path are in the set.
+    """
+    on_disk: dict[str, FileStat] = {}
+    for path in files:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue  # gone: its row (if any) is tombstoned below
+        if path.lower().endswith(AUDIO_EXTENSIONS) and os.path.isfile(path):
+            on_disk[path] = FileStat(st.st_size, st.st_mtime_ns, st.st_ino)
+    for d in dirs:
+        if os.path.isdir(d):
+            on_disk.update(walk_audio_files(d))
+
+    base = db.query(*_KNOWN_COLUMNS).filter(Song.folder_id == folder.id)
+    known = {}
+    for i in range(0, len(files), SCAN_WRITE_CHUNK):
+        known.update((r.filepath, r) for r in base.filter(Song.filepath.in_(files[i:i + SCAN_WRITE_CHUNK])))
+    for d in dirs:
+        under = base.filter(Song.filepath.startswith(d.rstrip(os.sep) + os.sep, autoescape=True))
+        known.update((r.filepath, r) for r in under)
+    return _apply_scan(db, folder, user_id, on_disk, known, read, resume_after, progress)
+
+
+def _apply_scan(db: Session, folder: Folder, user_id: int, on_disk: dict[str, FileStat], known: dict,
+                read, resume_after, progress) -> ScanResult:
+    """Diff files on disk against their rows (see the module docstring) and write the difference."""
+    result = ScanResult()
+    updates: list[dict] = []
+    new_paths = []
+    changed: dict[str, object] = {}
+    for path, st in on_disk.items():
+        row = known.get(path)
+        if row is None:
+            new_paths.append(path)
+            continue
+        same = (row.file_size, row.file_mtime) == (st.size, st.mtime_ns)
+        if row.file_size is None:
+            # scanned before fingerprints existed: record it, trust the stored tags
+            updates.append({"id": row.id, **_fingerprint(st), "deleted_at": None})
+            result.unchanged += 1
+        elif not same:
+            changed[path] = row  # re-read below
+        elif row.deleted_at is not None:
+            updates.append({"id": row.id, "deleted_at": None, "inode": st.inode})
+            result.revived += 1
+        else:
+            if row.inode != st.inode:  # restored from backup / copied over: same content, new inode
+                updates.append({"id": row.id, "inode": st.inode})
+            result.unchanged += 1
+
+    vanished = {row.id: row for path, row in known.items() if path not in on_disk and row.deleted_at is None}
+    by_inode = {(row.inode, row.file_size): row for row in vanished.values() if row.inode is not None}
+    still_new = []
+    for path in new_paths:
+        st = on_disk[path]
+        row = by_inode.pop((st.inode, st.size), None)
+        if row is not None:
+            del vanished[row.id]
+            updates.append({"id": row.id, "filepath": path, "filename": os.path.basename(path),
+                            "file_mtime": st.mtime_ns})
+            result.moved += 1
+        else:
+            still_new.append(path)
+
+    now = datetime.now(tz=AMS)
+    for row in vanished.values():
+        updates.append({"id": row.id, "deleted_at": now})
+        result.removed += 1
+
+    if updates:
+        _write_updates(db, updates)
+
+    # one sorted pass, so "every path up to the checkpoint is written" holds for resumes
+    to_read = sorted([*changed, *still_new])
+    if resume_after is not None:
+        to_read = [p for p in to_read if p > resume_after]
+    total, done = len(to_read), 0
+
+    changed_updates: list[dict] = []
+    new_rows: list[dict] = []
+
+    def flush(last_path: str) -> None:
+        nonlocal changed_updates, new_rows
+        if changed_updates:
+            _write_updates(db, changed_updates)
+            changed_updates = []
+        if new_rows:
+            result.added.extend(_insert_songs(db, new_rows, user_id))
+            new_rows = []
+        if progress:
+            progress(result, done, total, last_path)
+
+    try:
+        if progress:
+            progress(result, done, total, resume_after)
+        for path, tags in extract_tags(to_read, read):
+            done += 1
+            row = changed.get(path)
+            if tags is None:
+                pass  # unreadable; the reader logged it
+            elif row is not None:
+                if row.spotify_id:  # keep enriched metadata, the audio may still have changed length
+                    tags = {"duration": tags["duration"]}
+                changed_updates.append({"id": row.id, **tags, **_fingerprint(on_disk[path]), "deleted_at": None})
+                result.changed += 1
+            else:
+                new_rows.append({
+                    **tags,
+                    "filename": os.path.basename(path),
+                    "filepath": path,
+                    "folder_id": folder.id,
+                    **_fingerprint(on_disk[path]),
+                })
+            if len(changed_updates) >= SCAN_WRITE_CHUNK or len(new_rows) >= SCAN_INSERT_BATCH:
+                flush(path)
+        if to_read:
+            flush(to_read[-1])
+    except ScanCancelled:
+        result.cancelled = True
+
+    if result.added or result.changed or result.moved or result.removed or result.revived:
+        # removals/renames change what tiles may show; additions only the "new" tile
+        tiles = ALL_TILES if (result.changed or result.moved or result.removed or result.revived) else [NEWLY_ADDED]
+        invalidate_home_tiles(db, None, tiles)
+        db.commit()
+    return result
@@ -0,0 +1,125 @@
+# services/search_cache.py
+"""
+Persistent cache of Spotify search results, keyed by the normalized query string that
+_search_spotify_best_match builds, so rebuilds and re-enrichment (and the same
+artist/title in another user's folder) don't search again.
+
+Entries keep the candidate list trimmed to the fields matching uses. A search with no
+results is cached too, for a shorter time (SPOTIFY_CACHE_NEGATIVE_TTL_HOURS), as the
+track may appear later. The table holds at most SPOTIFY_CACHE_MAX_ENTRIES rows: expired
+rows go first, then the least recently used ones. last_used_at is only bumped when it
+is over an hour old, so a cache hit doesn't cost a write every time.
+"""
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.orm import Session
+
+from database import upsert_insert
+from models import SpotifySearchCache
+
+AMS = ZoneInfo("Europe/Amsterdam")
+SPOTIFY_CACHE_TTL_DAYS = int(os.getenv("SPOTIFY_CACHE_TTL_DAYS", "30"))
+SPOTIFY_CACHE_NEGATIVE_TTL_HOURS = int(os.getenv("SPOTIFY_CACHE_NEGATIVE_TTL_HOURS", "24"))
+SPOTIFY_CACHE_MAX_ENTRIES = int(os.getenv("SPOTIFY_CACHE_MAX_ENTRIES", "50000"))
+TOUCH_AFTER = timedelta(hours=1)
+PRUNE_EVERY = 500   # stores between size checks
+
+_stores = 0
+_stores_lock = threading.Lock()
+
+
+def _trim(item: dict) -> dict:
+    """The parts of a track item that scoring and enrich_song_from_spotify read."""
+    album = item.get("album") or {}
+    images = album.get("images") or []
+    return {
+        "id": item.get("id"),
+        "name": item.get("name"),
+        "artists": [{"name": a.get("name")} for a in item.get("artists") or []],
+        "album": {"name": album.get("name"), "images": [{"url": images[0].get("url")}] if images else []},
+        "duration_ms": item.get("duration_ms"),
+    }
+
+
+def lookup(db: Session, queries: list[str]) -> dict[str, list[dict]]:
+    """Cached, unexpired candidate lists for the given queries (missing ones are left out)."""
+    now = datetime.now(tz=AMS)
+    rows = db.execute(
+        select(SpotifySearchCache.query, SpotifySearchCache.items, SpotifySearchCache.last_used_at)
+        .where(SpotifySearchCache.query.in_(queries), SpotifySearchCache.expires_at > now)
+    ).all()
+    stale = [r.query for r in rows if _aware(r.last_used_at) < now - TOUCH_AFTER]
+    if stale:
+        try:
+            db.execute(update(SpotifySearchCache).where(SpotifySearchCache.query.in_(stale)).values(last_used_at=now)
+                       .execution_options(synchronize_session=False))
+            db.commit()
+        except Exception as e:  # best-effort; e.g. the database is busy
+            db.rollback()
+            print(f"⚠️ Spotify cache touch failed: {e}")
+    return {r.query: json.loads(r.items) for r in rows}
+
+
+def store(db: Session, results: dict[str, list[dict]]) -> None:
+    """Cache fresh search results (commits; best-effort)."""
+    global _stores
+    if not results:
+        return
+    now = datetime.now(tz=AMS)
+    rows = [{
+        "query": q,
+        "items": json.dumps([_trim(it) for it in items]),
+        "fetched_at": now,
+        "expires_at": now + (timedelta(days=SPOTIFY_CACHE_TTL_DAYS) if items
+                             else timedelta(hours=SPOTIFY_CACHE_NEGATIVE_TTL_HOURS)),
+        "last_used_at": now,
+    } for q, items in results.items()]
+    stmt = upsert_insert(db, SpotifySearchCache)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[SpotifySearchCache.query],
+        set_={c: stmt.excluded[c] for c in ("items", "fetched_at", "expires_at", "last_used_at")},
+    )
+    try:
+        db.execute(stmt, rows)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"⚠️ Spotify cache store failed: {e}")
+        return
+    with _stores_lock:
+        _stores += len(rows)
+        due = _stores >= PRUNE_EVERY
+        if due:
+            _stores = 0
+    if due:
+        prune(db)
+
+
+def prune(db: Session, max_entries: int = SPOTIFY_CACHE_MAX_ENTRIES) -> int:
+    """Drop expired entries, then the least recently used ones beyond max_entries (and 10% more)."""
+    now = datetime.now(tz=AMS)
+    try:
+        # no session sync: SQLite hands back naive datetimes, which don't compare with now
+        removed = db.execute(delete(SpotifySearchCache).where(SpotifySearchCache.expires_at <= now)
+                             .execution_options(synchronize_session=False)).rowcount
+        count = db.query(func.count()).select_from(SpotifySearchCache).scalar()
+        if count > max_entries:
+            excess = count - max_entries + max_entries // 10
+            oldest = select(SpotifySearchCache.query).order_by(SpotifySearchCache.last_used_at).limit(excess)
+            removed += db.execute(delete(SpotifySearchCache).where(SpotifySearchCache.query.in_(oldest))
+                                  .execution_options(synchronize_session=False)).rowcount
+        db.commit()
+        return removed
+    except Exception as e:
+        db.rollback()
+        print(f"⚠️ Spotify cache prune failed: {e}")
+        return 0
+
+
+def _aware(dt: datetime) -> datetime:
+    # SQLite hands back naive Amsterdam wall-clock time
+    return dt if dt.tzinfo else dt.replace(tzinfo=AMS)
@@ -1,14 +1,94 @@
 # services/spotify.py
+import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 import requests
+from requests.adapters import HTTPAdapter
 from sqlalchemy.orm import Session
 from models import Setting, Song
-from services.matching import normalize, parse_filename, fuzzy_score
+from services.matching import normalize, parse_filename, fuzzy_scores
+from services import search_cache
+from utils.rate_limit import TokenBucket
 
+# Base URLs are configurable so tests (and proxies) can point at a local stub
+SPOTIFY_ACCOUNTS_URL = os.getenv("SPOTIFY_ACCOUNTS_URL", "https://accounts.spotify.com").rstrip("/")
+SPOTIFY_API_URL = os.getenv("SPOTIFY_API_URL", "https://api.spotify.com/v1").rstrip("/")
+SPOTIFY_TIMEOUT = float(os.getenv("SPOTIFY_TIMEOUT", "15"))
 SPOTIFY_TOKEN_CACHE_SECONDS = 3200  # ~53 min
 _last_token_cache: dict[tuple[int, str], tuple[str, float]] = {}
 # key: (user_id, "app"), val: (token, expiry_ts)
 
+# One bucket for every Spotify call in the process; a 429 pauses it for Retry-After.
+# With blocking=False (request threads, enrichment workers) a call waits at most
+# SPOTIFY_SYNC_MAX_WAIT seconds for a token and otherwise fails fast with SpotifyRateLimited.
+SPOTIFY_SYNC_MAX_WAIT = float(os.getenv("SPOTIFY_SYNC_MAX_WAIT", "1"))
+_bucket = TokenBucket(
+    rate=float(os.getenv("SPOTIFY_RATE_PER_SECOND", "5")),
+    burst=int(os.getenv("SPOTIFY_RATE_BURST", "10")),
+)
+
+# Shared keep-alive session: connections (and TLS) are reused instead of set up per call.
+# SPOTIFY_MAX_CONCURRENCY bounds requests in flight across all threads.
+SPOTIFY_MAX_CONCURRENCY = int(os.getenv("SPOTIFY_MAX_CONCURRENCY", "8"))
+SPOTIFY_PARALLEL_QUERIES = os.getenv("SPOTIFY_PARALLEL_QUERIES", "1") == "1"
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=SPOTIFY_MAX_CONCURRENCY))
+_session.mount("http://", HTTPAdapter(pool_connections=2, pool_maxsize=SPOTIFY_MAX_CONCURRENCY))
+_in_flight = threading.BoundedSemaphore(SPOTIFY_MAX_CONCURRENCY)
+_query_pool = ThreadPoolExecutor(SPOTIFY_MAX_CONCURRENCY, thread_name_prefix="spotify-search")
+
+
+class SpotifyError(Exception):
+    """Failed call (5xx, rejected token, unexpected status); worth retrying later."""
+
+
+class SpotifyRateLimited(SpotifyError):
+    def __init__(self, retry_after: float):
+        super().__init__(f"Spotify rate limit, retry after {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class SpotifyNotConfigured(Exception):
+    pass
+
+
+def _retry_after(resp: requests.Response) -> float:
+    value = resp.headers.get("Retry-After", "")
+    try:
+        return max(float(value), 1.0)
+    except ValueError:
+        pass
+    try:  # HTTP-date form
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 1.0)
+    except (TypeError, ValueError):
+        return 5.0
+
+
+def _request(method: str, url: str, blocking: bool = True, **kwargs) -> requests.Response:
+    """
+    Rate-limited Spotify call; raises SpotifyRateLimited on 429 and SpotifyError on 5xx.
+    With blocking=False it also raises SpotifyRateLimited, without calling out, when no
+    token is free within SPOTIFY_SYNC_MAX_WAIT (e.g. while a 429 pause lasts).
+    """
+    if blocking:
+        _bucket.acquire()
+    else:
+        wait = _bucket.try_acquire(SPOTIFY_SYNC_MAX_WAIT)
+        if wait:
+            raise SpotifyRateLimited(max(wait, 1.0))
+    with _in_flight:
+        resp = _session.request(method, url, timeout=SPOTIFY_TIMEOUT, **kwargs)
+    if resp.status_code == 429:
+        wait = _retry_after(resp)
+        _bucket.pause(wait)
+        raise SpotifyRateLimited(wait)
+    if resp.status_code >= 500:
+        raise SpotifyError(f"Spotify {resp.status_code} for {url}")
+    return resp
+
 
 def _get_cached_token(user_id: int) -> str | None:
     key = (user_id, "app")
@@ -19,7 +99,7 @@ def _get_cached_token(user_id: int) -> str | None:
     return None
 
 
-def get_spotify_token(db: Session, user_id: int) -> str:
+def get_spotify_token(db: Session, user_id: int, blocking: bool = True) -> str:
     """Fetch a client credentials token for this user."""
     cid = db.query(Setting).filter(
         Setting.user_id == user_id, Setting.key == "spotify_client_id"
@@ -28,17 +108,18 @@ def get_spotify_token(db: Session, user_id: int) -> str:
         Setting.user_id == user_id, Setting.key == "spotify_client_secret"
     ).first()
     if not cid or not secret:
-        raise Exception("Missing Spotify client credentials in settings")
+        raise SpotifyNotConfigured("Missing Spotify client credentials in settings")
 
     cached = _get_cached_token(user_id)
     if cached:
         return cached
 
-    resp = requests.post(
-        "https://accounts.spotify.com/api/token",
+    resp = _request(
+        "POST",
+        f"{SPOTIFY_ACCOUNTS_URL}/api/token",
         data={"grant_type": "client_credentials"},
         auth=(cid.value, secret.value),
-        timeout=15,
+        blocking=blocking,
     )
     data = resp.json()
     if resp.status_code != 200 or "access_token" not in data:
@@ -49,48 +130,61 @@ def get_spotify_token(db: Session, user_id: int) -> str:
     return token
 
 
-def _spotify_search(token: str, query: str, limit: int = 10) -> list[dict]:
-    r = requests.get(
-        "https://api.spotify.com/v1/search",
+def _spotify_search(token: str, query: str, limit: int = 10, blocking: bool = True) -> list[dict]:
+    r = _request(
+        "GET",
+        f"{SPOTIFY_API_URL}/search",
         headers={"Authorization": f"Bearer {token}"},
         params={"q": query, "type": "track", "limit": limit},
-        timeout=15,
+        blocking=blocking,
     )
-    j = r.json()
-    return j.get("tracks", {}).get("items", []) if r.status_code == 200 else []
-
+    if r.status_code == 401:  # expired or revoked: fetch a fresh one next time
+        for key, (cached, _) in list(_last_token_cache.items()):
+            if cached == token:
+                del _last_token_cache[key]
+        raise SpotifyError("Spotify rejected the access token")
+    if r.status_code != 200:
+        # not "no results": returning [] here would be cached as a miss for a day
+        raise SpotifyError(f"Spotify {r.status_code} for search {query!r}: {r.text[:200]}")
+    return r.json().get("tracks", {}).get("items", [])
 
-def _score_candidate(guess_title: str, guess_artist: str | None, guess_duration_s: int | None, item: dict) -> float:
-    sp_title = item.get("name") or ""
-    sp_artists = ", ".join([a["name"] for a in item.get("artists", [])]) if item.get("artists") else ""
-    sp_ms = item.get("duration_ms") or 0
-    sp_s = int(sp_ms / 1000)
 
+def _score_candidates(guess_title: str, guess_artist: str | None, guess_duration_s: int | None, items: list[dict]) -> list[float]:
+    """Score every candidate of one search; title and artist similarity are computed in one batch each."""
+    if not items:
+        return []
     # Fuzzy title score (weight high)
-    title_score = fuzzy_score(guess_title, sp_title)
+    title_scores = fuzzy_scores(guess_title, [it.get("name") or "" for it in items])
 
     # Artist score if we have a guess
-    artist_score = fuzzy_score(guess_artist, sp_artists) if guess_artist else 0
+    if guess_artist:
+        sp_artists = [", ".join([a["name"] for a in it.get("artists", [])]) if it.get("artists") else "" for it in items]
+        artist_scores = fuzzy_scores(guess_artist, sp_artists)
+    else:
+        artist_scores = [0] * len(items)
 
-    # Duration closeness (±2s → full points, then decay)
-    dur_bonus = 0
-    if guess_duration_s and sp_s:
-        diff = abs(guess_duration_s - sp_s)
-        if diff <= 2:
-            dur_bonus = 20
-        elif diff <= 5:
-            dur_bonus = 10
-        elif diff <= 10:
-            dur_bonus = 5
+    totals = []
+    for it, title_score, artist_score in zip(items, title_scores, artist_scores):
+        sp_s = int((it.get("duration_ms") or 0) / 1000)
 
-    total = (0.7 * title_score) + (0.2 * artist_score) + dur_bonus
-    return total
+        # Duration closeness (±2s → full points, then decay)
+        dur_bonus = 0
+        if guess_duration_s and sp_s:
+            diff = abs(guess_duration_s - sp_s)
+            if diff <= 2:
+                dur_bonus = 20
+            elif diff <= 5:
+                dur_bonus = 10
+            elif diff <= 10:
+                dur_bonus = 5
 
+        totals.append((0.7 * title_score) + (0.2 * artist_score) + dur_bonus)
+    return totals
 
-def _search_spotify_best_match(db: Session, user_id: int, title_guess: str, artist_guess: str | None, duration_s: int | None) -> dict | None:
-    """Returns best Spotify track item dict or None."""
-    token = get_spotify_token(db, user_id)
 
+def _search_spotify_best_match(db: Session, user_id: int, title_guess: str, artist_guess: str | None, duration_s: int | None,
+                               blocking: bool = True) -> dict | None:
+    """Returns best Spotify track item dict or None."""
     queries = []
     t = normalize(title_guess)
     a = normalize(artist_guess) if artist_guess else None
@@ -103,15 +197,39 @@ def _search_spotify_best_match(db: Session, user_id: int, title_guess: str, arti
     best = None
     best_score = -1
 
-    for q in queries:
-        items = _spotify_search(token, q, limit=10)
-        for it in items:
-            sc = _score_candidate(title_guess, artist_guess, duration_s, it)
-            if sc > best_score:
-                best_score = sc
-                best = it
-        if best_score >= 90:
-            break
+    # Cached results first (services/search_cache.py); the token is only fetched on a miss
+    cached = search_cache.lookup(db, queries)
+    token = None
+    fetched: dict[str, list[dict]] = {}
+    pending = {}
+    try:
+        for i, q in enumerate(queries):
+            if q in cached:
+                items = cached[q]
+            else:
+                if token is None:
+                    token = get_spotify_token(db, user_id, blocking=blocking)
+                    # The remaining misses go out together, but results are taken in order with
+                    # the same early exit, so the pick is what the one-by-one loop would choose;
+                    # the rest are cancelled. Only while the rate budget has room: when
+                    # rate-bound, extra queries cost other songs.
+                    rest = [r for r in queries[i:] if r not in cached]
+                    if SPOTIFY_PARALLEL_QUERIES and len(rest) > 1 and _bucket.available() >= len(rest):
+                        pending = {r: _query_pool.submit(_spotify_search, token, r, 10, blocking) for r in rest}
+                items = fetched[q] = (pending[q].result() if q in pending
+                                      else _spotify_search(token, q, limit=10, blocking=blocking))
+            for it, sc in zip(items, _score_candidates(title_guess, artist_guess, duration_s, items)):
+                if sc > best_score:
+                    best_score = sc
+                    best = it
+            if best_score >= 90:
+                break
+    finally:
+        for q, fut in pending.items():
+            fut.cancel()
+            if q not in fetched and fut.done() and not fut.cancelled() and fut.exception() is None:
+                fetched[q] = fut.result()  # answered anyway: keep it for next time
+        search_cache.store(db, fetched)
 
     if best and best_score >= 80:
         best["_smuzzi_score"] = best_score
@@ -119,10 +237,11 @@ def _search_spotify_best_match(db: Session, user_id: int, title_guess: str, arti
     return None
 
 
-def enrich_song_from_spotify(db: Session, song: Song, user_id: int) -> bool:
+def enrich_song_from_spotify(db: Session, song: Song, user_id: int, blocking: bool = True) -> bool:
     """
     Try to fill artist/title/album/duration/cover_url/spotify_id using Spotify.
-    Returns True if updated, False if left unchanged.
+    Returns True if updated, False if left unchanged. With blocking=False (request threads,
+    enrichment workers) it raises SpotifyRateLimited instead of waiting out the rate limit.
     """
     title_guess = song.title or ""
     artist_guess = song.artist
@@ -134,7 +253,7 @@ def enrich_song_from_spotify(db: Session, song: Song, user_id: int) -> bool:
             artist_guess = fname_artist
 
     duration_s = song.duration if song.duration and song.duration > 0 else None
-    best = _search_spotify_best_match(db, user_id, title_guess, artist_guess, duration_s)
+    best = _search_spotify_best_match(db, user_id, title_guess, artist_guess, duration_s, blocking=blocking)
     if not best:
         return False
 
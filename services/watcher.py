@@ -0,0 +1,327 @@
+# services/watcher.py
+"""
+Live library updates: an inotify watcher over every Folder.path (Linux, through ctypes,
+no extra dependency). Off unless LIBRARY_WATCH=1.
+
+inotify watches directories, not trees, so every directory below a folder gets a watch
+(all on one fd). Events are boiled down to "these audio files / these directories
+changed" per folder and held until the folder has been quiet for WATCH_DEBOUNCE_SECONDS
+(or WATCH_MAX_DELAY_SECONDS after the first one). They then go to the scan job queue as
+an incremental job (services/scan_jobs.py), so the watcher and manual rescans never scan
+a folder at the same time. Once a folder has more than SCAN_JOB_MAX_PATHS pending paths
+it just gets a whole-folder scan, which keeps memory flat however big the burst.
+
+When the kernel queue overflows (IN_Q_OVERFLOW) events were lost: every folder is
+re-watched and gets a whole-folder scan, which is cheap when little changed. The same
+happens when a folder is (re)watched, to catch up on changes nobody saw. Folders added
+or removed through the API are picked up every WATCH_SYNC_SECONDS; on an unexpected
+error the watcher starts over with a fresh inotify instance.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+from database import SessionLocal
+from models import Folder
+from services.scanner import AUDIO_EXTENSIONS
+from services.scan_jobs import request_scan, SCAN_JOB_MAX_PATHS
+
+LIBRARY_WATCH = os.getenv("LIBRARY_WATCH", "0") == "1"
+WATCH_DEBOUNCE_SECONDS = float(os.getenv("WATCH_DEBOUNCE_SECONDS", "2"))
+WATCH_MAX_DELAY_SECONDS = float(os.getenv("WATCH_MAX_DELAY_SECONDS", "30"))
+WATCH_SYNC_SECONDS = float(os.getenv("WATCH_SYNC_SECONDS", "60"))
+
+
+# ---------- inotify ----------
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW)
+_EVENT = struct.Struct("iIII")  # struct inotify_event: wd, mask, cookie, len; then name
+
+
+class Inotify:
+    """Minimal inotify(7) binding: one non-blocking fd, add/remove watches, read events."""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add = libc.inotify_add_watch
+        self._add.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm = libc.inotify_rm_watch
+        self._rm.argtypes = [ctypes.c_int, ctypes.c_int]
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), "inotify_init1")
+        self.fd = fd
+        self._poll = select.poll()
+        self._poll.register(fd, select.POLLIN)
+
+    def add_watch(self, path: str, mask: int = WATCH_MASK) -> int:
+        wd = self._add(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd: int) -> None:
+        self._rm(self.fd, wd)  # fails harmlessly when the kernel already dropped it
+
+    def read(self, timeout: float) -> list[tuple[int, int, str]]:
+        """(wd, mask, name) for the events that arrive within timeout seconds."""
+        if not self._poll.poll(max(timeout, 0) * 1000):
+            return []
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events, i = [], 0
+        while i + _EVENT.size <= len(buf):
+            wd, mask, _cookie, length = _EVENT.unpack_from(buf, i)
+            name = buf[i + _EVENT.size:i + _EVENT.size + length].rstrip(b"\0")
+            events.append((wd, mask, os.fsdecode(name)))
+            i += _EVENT.size + length
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+# ---------- Watcher ----------
+@dataclass
+class _Pending:
+    first: float
+    last: float
+    files: set[str] = field(default_factory=set)
+    dirs: set[str] = field(default_factory=set)
+    full: bool = False
+
+
+class LibraryWatcher:
+    def __init__(self):
+        self._ino: Optional[Inotify] = None
+        self._dirs: dict[int, str] = {}                 # wd → directory
+        self._wds: dict[str, int] = {}                  # directory → wd
+        self._roots: dict[int, tuple[str, int]] = {}    # folder id → (path, user id)
+        self._pending: dict[int, _Pending] = {}
+        self._out_of_watches = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="library-watcher", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self) -> None:
+        next_sync = 0.0
+        while not self._stop.is_set():
+            try:
+                if self._ino is None:
+                    self._ino = Inotify()
+                    next_sync = 0.0
+                now = time.monotonic()
+                if now >= next_sync:
+                    self._sync_folders(now)
+                    next_sync = now + WATCH_SYNC_SECONDS
+                timeout = min(next_sync - now, 1.0)
+                for wd, mask, name in self._ino.read(timeout):
+                    self._handle(wd, mask, name, time.monotonic())
+                self._flush(time.monotonic())
+            except Exception as e:
+                print(f"⚠️ Library watcher failed, starting over: {e}")
+                self._reset()
+                self._stop.wait(5)
+        self._reset()
+
+    def _reset(self) -> None:
+        if self._ino is not None:
+            try:
+                self._ino.close()
+            except OSError:
+                pass
+        self._ino = None
+        self._dirs.clear()
+        self._wds.clear()
+        self._roots.clear()  # the next sync re-watches everything and catches up with a full scan
+        self._pending.clear()
+
+    # --- folders and watches ---
+    def _sync_folders(self, now: float) -> None:
+        db = SessionLocal()
+        try:
+            folders = {f.id: (f.path, f.user_id)  # stored normalized (add_folder)
+                       for f in db.query(Folder.id, Folder.path, Folder.user_id)}
+        finally:
+            db.close()
+        for fid in set(self._roots) - set(folders):
+            root, _ = self._roots.pop(fid)
+            self._pending.pop(fid, None)
+            self._unwatch_tree(root, keep_watched=True)
+        for fid, (root, uid) in folders.items():
+            if fid in self._roots and root in self._wds:
+                continue
+            self._roots[fid] = (root, uid)
+            if os.path.isdir(root):  # new, moved, or back after being unmounted/deleted
+                self._watch_tree(root)
+                self._pending_for(fid, now).full = True
+
+    def _watch_tree(self, top: str) -> None:
+        stack = [top]
+        while stack:
+            path = stack.pop()
+            try:
+                wd = self._ino.add_watch(path)
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    if not self._out_of_watches:
+                        print("⚠️ Out of inotify watches; raise fs.inotify.max_user_watches. "
+                              "Some directories are only picked up by a rescan.")
+                    self._out_of_watches = True
+                    return
+                continue  # vanished or unreadable
+            old = self._dirs.get(wd)
+            if old is not None and old != path:  # same directory under a new name
+                self._wds.pop(old, None)
+            self._dirs[wd] = path
+            self._wds[path] = wd
+            try:
+                with os.scandir(path) as it:
+                    stack.extend(e.path for e in it if e.is_dir(follow_symlinks=False))
+            except OSError:
+                pass
+
+    def _unwatch_tree(self, top: str, keep_watched: bool = False) -> None:
+        prefix = top.rstrip(os.sep) + os.sep
+        for path in [p for p in self._wds if p == top or p.startswith(prefix)]:
+            if keep_watched and self._folders_for(path):
+                continue  # also inside another folder
+            wd = self._wds.pop(path)
+            self._dirs.pop(wd, None)
+            self._ino.rm_watch(wd)
+
+    def _folders_for(self, path: str) -> list[int]:
+        return [fid for fid, (root, _) in self._roots.items()
+                if path == root or path.startswith(root.rstrip(os.sep) + os.sep)]
+
+    # --- events ---
+    def _handle(self, wd: int, mask: int, name: str, now: float) -> None:
+        if mask & IN_Q_OVERFLOW:
+            print("⚠️ Library watcher queue overflowed; rescanning all folders")
+            for fid, (root, _) in list(self._roots.items()):
+                if os.path.isdir(root):
+                    self._watch_tree(root)  # directories created during the gap have no watch yet
+                    self._pending_for(fid, now).full = True
+            return
+        directory = self._dirs.get(wd)
+        if directory is None:
+            return
+        if mask & IN_IGNORED:  # watch gone: directory deleted, or we removed it
+            del self._dirs[wd]
+            if self._wds.get(directory) == wd:
+                del self._wds[directory]
+            return
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            return  # the parent's event (or the next folder sync, for a folder root) covers it
+
+        path = os.path.join(directory, name)
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self._watch_tree(path)
+            elif mask & IN_MOVED_FROM:
+                self._unwatch_tree(path)
+            if mask & (IN_CREATE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE):
+                self._mark(path, True, now)
+        elif name.lower().endswith(AUDIO_EXTENSIONS):
+            self._mark(path, False, now)
+
+    def _pending_for(self, fid: int, now: float) -> _Pending:
+        p = self._pending.get(fid)
+        if p is None:
+            p = self._pending[fid] = _Pending(first=now, last=now)
+        p.last = now
+        return p
+
+    def _mark(self, path: str, is_dir: bool, now: float) -> None:
+        for fid in self._folders_for(path):
+            p = self._pending_for(fid, now)
+            if p.full:
+                continue
+            (p.dirs if is_dir else p.files).add(path)
+            if len(p.files) + len(p.dirs) > SCAN_JOB_MAX_PATHS:
+                p.full = True
+                p.files.clear()
+                p.dirs.clear()
+
+    def _flush(self, now: float) -> None:
+        due = [fid for fid, p in self._pending.items()
+               if now - p.last >= WATCH_DEBOUNCE_SECONDS or now - p.first >= WATCH_MAX_DELAY_SECONDS]
+        if not due:
+            return
+        db = SessionLocal()
+        try:
+            for fid in due:
+                p = self._pending[fid]
+                _, uid = self._roots[fid]
+                try:
+                    if p.full:
+                        job, _ = request_scan(db, fid, uid)
+                    else:
+                        job, _ = request_scan(db, fid, uid, sorted(p.files), sorted(p.dirs))
+                except Exception as e:
+                    db.rollback()
+                    print(f"⚠️ Queueing a scan of folder {fid} failed: {e}")
+                    job = None
+                if job is None:  # e.g. a scan of this folder is running; try again after it had time
+                    p.first = p.last = now
+                else:
+                    del self._pending[fid]
+        finally:
+            db.close()
+
+
+_watcher: Optional[LibraryWatcher] = None
+
+
+def start_library_watcher() -> None:
+    global _watcher
+    if not LIBRARY_WATCH or _watcher is not None:
+        return
+    if not sys.platform.startswith("linux"):
+        print("⚠️ LIBRARY_WATCH needs inotify (Linux); folders only update on rescan")
+        return
+    _watcher = LibraryWatcher()
+    _watcher.start()
+
+
+def stop_library_watcher() -> None:
+    global _watcher
+    if _watcher is not None:
+        _watcher.close()
+        _watcher = None
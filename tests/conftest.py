@@ -0,0 +1,38 @@
+# tests/conftest.py
+import os
+import sys
+import tempfile
+
+# A throwaway SQLite file per test run, set before database.py creates its engines.
+# (Not :memory: — /home tiles are built on worker threads, each with its own connection.)
+_tmp = tempfile.mkdtemp(prefix="smuzzi-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp, 'smuzzi.db')}"
+os.environ["PLAY_ARCHIVE_PATH"] = os.path.join(_tmp, "smuzzi_archive.db")
+os.environ.pop("DATABASE_READ_URL", None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import main  # noqa: F401  (registers every model, creates the tables, runs migrations)
+from database import SessionLocal
+
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def client():
+    from fastapi.testclient import TestClient
+    return TestClient(main.app)  # not entered: background workers stay off
+
+
+def auth_headers(user_id: int) -> dict:
+    from auth import create_access_token
+    return {"Authorization": "Bearer " + create_access_token({"sub": f"user{user_id}", "id": user_id})}
@@ -0,0 +1,57 @@
+# tests/test_analytics.py
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from models import PlayEvent
+from services.analytics import UserSnapshot, hour_of_week_heatmap
+
+AMS = ZoneInfo("Europe/Amsterdam")
+USER = 4242
+
+
+def _play(db, eid: int, ended: bool = True) -> None:
+    started = datetime.now(tz=AMS) - timedelta(hours=1)
+    db.add(PlayEvent(id=eid, user_id=USER, track_id=eid % 7 + 1, started_at=started,
+                     ended_at=started + timedelta(minutes=2) if ended else None,
+                     duration_played_sec=120 if ended else 0, is_skip=False))
+    db.commit()
+
+
+def test_refresh_picks_up_late_and_open_rows_once(db):
+    snap = UserSnapshot(USER)
+    for eid in range(100_010, 100_020):
+        _play(db, eid)
+    _play(db, 100_020, ended=False)
+    snap.refresh(db)
+    assert len(snap) == 10
+
+    _play(db, 100_005)  # committed after higher ids, e.g. another process's id block
+    snap.refresh(db)
+    assert len(snap) == 11
+
+    db.query(PlayEvent).filter(PlayEvent.id == 100_020).update(
+        {PlayEvent.ended_at: datetime.now(tz=AMS), PlayEvent.duration_played_sec: 60})
+    db.commit()
+    snap.refresh(db)
+    snap.refresh(db)
+    view = snap.view()
+    assert len(view) == 12
+    assert sorted(view.ids.tolist()) == list(range(100_005, 100_006)) + list(range(100_010, 100_021))
+
+
+def test_view_is_unaffected_by_later_refreshes(db):
+    user = USER + 1
+    snap = UserSnapshot(user)
+    started = datetime.now(tz=AMS) - timedelta(hours=2)
+    db.add_all([PlayEvent(user_id=user, track_id=1, started_at=started, ended_at=started,
+                          duration_played_sec=60, is_skip=False) for _ in range(3)])
+    db.commit()
+    snap.refresh(db)
+    view = snap.view()
+    db.add_all([PlayEvent(user_id=user, track_id=2, started_at=started, ended_at=started,
+                          duration_played_sec=60, is_skip=False) for _ in range(2000)])  # grows the buffer
+    db.commit()
+    snap.refresh(db)
+    assert len(view) == 3 and len(view.started) == len(view.seconds) == 3
+    assert sum(map(sum, hour_of_week_heatmap(view)["plays"])) == 3
+    assert len(snap.view()) == 2003
@@ -0,0 +1,52 @@
+# tests/test_enrichment.py
+import time
+from datetime import datetime
+
+import services.enrichment as enrichment
+from models import EnrichmentTask, Folder, Setting, Song, User
+from services import spotify
+from utils.rate_limit import TokenBucket
+
+
+def _song(db, name: str) -> tuple[User, Song]:
+    user = User(username=name, password_hash="x")
+    db.add(user)
+    db.flush()
+    folder = Folder(path=f"/music/{name}", user_id=user.id)
+    db.add(folder)
+    db.flush()
+    song = Song(title="Some Song", artist="Someone", filename="a.mp3", filepath="a.mp3", folder_id=folder.id)
+    db.add_all([song, Setting(user_id=user.id, key="spotify_client_id", value="id"),
+                Setting(user_id=user.id, key="spotify_client_secret", value="secret")])
+    db.commit()
+    return user, song
+
+
+def test_workers_are_woken_only_after_the_enqueue_commits(db):
+    user, song = _song(db, "waker")
+    enrichment._wake.clear()
+    enrichment.enqueue_enrichment(db, [song.id], user.id)
+    assert not enrichment._wake.is_set()  # a woken worker would find nothing yet
+    db.commit()
+    assert enrichment._wake.is_set()
+
+
+def test_worker_reschedules_instead_of_waiting_out_a_pause(db, monkeypatch):
+    user, song = _song(db, "patient")
+    enrichment.enqueue_enrichment(db, [song.id], user.id)
+    db.commit()
+    task = db.query(EnrichmentTask).filter(EnrichmentTask.song_id == song.id).one()
+    db.query(EnrichmentTask).filter(EnrichmentTask.id == task.id).update({"status": "running"})
+    db.commit()
+
+    bucket = TokenBucket(rate=5, burst=10)
+    bucket.pause(900)  # longer than ENRICH_STALE_SECONDS
+    monkeypatch.setattr(spotify, "_bucket", bucket)
+
+    started = time.monotonic()
+    assert enrichment.run_task(task.id, song.id, user.id, 0) is False
+    assert time.monotonic() - started < 2
+    db.expire_all()
+    task = db.get(EnrichmentTask, task.id)
+    assert (task.status, task.attempts) == ("pending", 0)
+    assert (task.next_attempt_at.replace(tzinfo=None) - datetime.now(enrichment.AMS).replace(tzinfo=None)).total_seconds() > 800
@@ -0,0 +1,51 @@
+# tests/test_event_buffer.py
+from datetime import datetime
+
+from sqlalchemy.exc import OperationalError
+
+from models import PlayEvent
+from services.event_buffer import AMS, PlayEventBuffer, MAX_FLUSH_ATTEMPTS
+
+
+def test_bad_event_does_not_take_the_batch_down(db):
+    buf = PlayEventBuffer(max_events=1000)
+    good = [buf.start_event(7, 100 + i, None, None, None, 0, None) for i in range(9)]
+    bad = buf.start_event(None, 999, None, None, None, 0, None)  # NOT NULL user_id fails the insert
+    good += [buf.start_event(7, 200 + i, None, None, None, 0, None) for i in range(6)]
+
+    assert buf.flush() == len(good)
+    assert {i for i, in db.query(PlayEvent.id).filter(PlayEvent.id.in_(good + [bad]))} == set(good)
+    assert list(buf._starts) == [bad]  # only the bad row is retried
+
+    for _ in range(MAX_FLUSH_ATTEMPTS):
+        buf.flush()
+    assert not buf._starts  # and eventually dropped
+
+
+def test_split_keeps_an_end_with_its_start(db, monkeypatch):
+    buf = PlayEventBuffer(max_events=1000)
+    bad = buf.start_event(None, 999, None, None, None, 0, None)
+    started = buf.start_event(7, 300, None, None, None, 0, None)
+    others = [buf.start_event(7, 301 + i, None, None, None, 0, None) for i in range(2)]
+    # the end arrived while an earlier flush of its start was failing: queued separately
+    buf._ends.append({"user_id": 7, "event_id": started, "position_end_sec": 95, "ended_at": datetime.now(tz=AMS),
+                      "_attempts": 0})
+
+    write = buf._write
+    locked = True
+
+    def flaky_write(starts, ends):
+        ids = {r["id"] for r in starts}
+        if locked and started in ids and bad not in ids:  # with bad in it, the batch fails on bad first
+            raise OperationalError("INSERT", {}, Exception("database is locked"))
+        return write(starts, ends)
+
+    monkeypatch.setattr(buf, "_write", flaky_write)
+    buf.flush()
+    locked = False
+    buf.flush()
+
+    ev = db.query(PlayEvent).filter(PlayEvent.id == started).one()
+    assert ev.ended_at is not None and ev.position_end_sec == 95
+    assert db.query(PlayEvent).filter(PlayEvent.id.in_(others)).count() == 2
+    assert list(buf._starts) == [bad] and not buf._ends
@@ -0,0 +1,35 @@
+# tests/test_folders.py
+from conftest import auth_headers
+from database import engine
+from migrations import _normalize_folder_paths
+from models import Folder, User
+
+
+def _user(db, name: str) -> User:
+    user = User(username=name, password_hash="x")
+    db.add(user)
+    db.commit()
+    return user
+
+
+def test_add_folder_stores_a_normalized_path(db, client, tmp_path):
+    user = _user(db, "folders")
+    r = client.post("/api/folders", params={"path": f"{tmp_path}/music/../music/"}, headers=auth_headers(user.id))
+    assert r.json()["path"] == f"{tmp_path}/music"
+
+    r = client.post("/api/folders", params={"path": f"{tmp_path}/music"}, headers=auth_headers(user.id))
+    assert r.json()["message"] == "Already exists"
+
+
+def test_migration_normalizes_existing_folder_paths(db):
+    user = _user(db, "legacy")
+    messy = Folder(path="/srv/legacy/music/", user_id=user.id)
+    clash = Folder(path="/srv/legacy/other/", user_id=user.id)
+    db.add_all([messy, clash, Folder(path="/srv/legacy/other", user_id=user.id)])
+    db.commit()
+
+    with engine.begin() as conn:
+        _normalize_folder_paths(conn)
+    db.expire_all()
+    assert messy.path == "/srv/legacy/music"
+    assert clash.path == "/srv/legacy/other/"  # would collide with its twin: left for a manual merge
@@ -0,0 +1,94 @@
+# tests/test_home_cache.py
+import threading
+import time
+
+from database import SessionLocal
+from models import HomeTile, User
+import services.home as home
+
+
+def _user(db, name: str) -> int:
+    user = User(username=name, password_hash="x")
+    db.add(user)
+    db.commit()
+    return user.id
+
+
+def _row(db, user_id: int, tile: str) -> HomeTile:
+    db.expire_all()
+    return db.query(HomeTile).filter(HomeTile.user_id == user_id, HomeTile.tile == tile).one()
+
+
+def test_invalidation_during_compute_leaves_tile_stale(db, monkeypatch):
+    user_id = _user(db, "race")
+    home.assemble_home(db, user_id)
+    assert not _row(db, user_id, home.FAVORITES).stale
+
+    def build_then_invalidate(tile_db, uid):
+        payload = home.tile_favorites(tile_db, uid)
+        other = SessionLocal()  # e.g. a like committed while this tile was being built
+        try:
+            home.invalidate_home_tiles(other, uid, [home.FAVORITES])
+            other.commit()
+        finally:
+            other.close()
+        return payload
+
+    home.invalidate_home_tiles(db, user_id, [home.FAVORITES])
+    db.commit()
+    monkeypatch.setattr(home, "TILES", [(t, build_then_invalidate if t == home.FAVORITES else b)
+                                        for t, b in home.TILES])
+    home.assemble_home(db, user_id)
+    assert _row(db, user_id, home.FAVORITES).stale  # the old result was not stored as fresh
+
+    monkeypatch.undo()
+    home.assemble_home(db, user_id)
+    assert not _row(db, user_id, home.FAVORITES).stale
+
+
+def test_slow_tile_is_built_once_and_cached_late(db, monkeypatch):
+    user_id = _user(db, "slow")
+    release = threading.Event()
+    calls = []
+
+    def slow_favorites(tile_db, uid):
+        calls.append(uid)
+        release.wait(5)
+        return home.tile_favorites(tile_db, uid)
+
+    monkeypatch.setattr(home, "HOME_TILE_DEADLINE", 0.05)
+    monkeypatch.setattr(home, "TILES", [(t, slow_favorites if t == home.FAVORITES else b) for t, b in home.TILES])
+    for _ in range(3):  # each request times out on the tile and finds the same build in flight
+        timings = {}
+        home.assemble_home(db, user_id, timings=timings)
+        assert timings[home.FAVORITES] is None
+    assert len(calls) == 1
+
+    release.set()
+    for _ in range(50):
+        if not _row(db, user_id, home.FAVORITES).stale:
+            break
+        time.sleep(0.05)
+    assert not _row(db, user_id, home.FAVORITES).stale  # stored by the build itself
+    timings = {}
+    home.assemble_home(db, user_id, timings=timings)
+    assert timings[home.FAVORITES] == 0.0 and len(calls) == 1
+
+
+def test_failing_tile_falls_back_without_failing_the_page(db, monkeypatch):
+    user_id = _user(db, "flaky")
+    home.assemble_home(db, user_id)
+    before = _row(db, user_id, home.FAVORITES).payload
+    home.invalidate_home_tiles(db, user_id, [home.FAVORITES, home.NEWLY_ADDED])
+    db.commit()
+
+    def broken(tile_db, uid):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(home, "TILES", [(t, broken if t == home.FAVORITES else b) for t, b in home.TILES])
+    timings = {}
+    page = home.assemble_home(db, user_id, timings=timings)
+    assert page["etag"]
+    assert timings[home.FAVORITES] is None and timings[home.NEWLY_ADDED] is not None
+    assert _row(db, user_id, home.FAVORITES).stale and _row(db, user_id, home.FAVORITES).payload == before
+    assert home.tile_timing_stats()[home.FAVORITES]["failed"] == 1
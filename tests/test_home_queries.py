@@ -0,0 +1,71 @@
+# tests/test_home_queries.py
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from models import ContextProgress, HomeTile, Like, PlayEvent, Song, User
+from services.home import assemble_home
+from services.rollups import apply_plays
+from utils import query_stats
+
+AMS = ZoneInfo("Europe/Amsterdam")
+
+
+def _user_with_history(db, name: str, n: int) -> int:
+    user = User(username=name, password_hash="x")
+    db.add(user)
+    db.flush()
+    songs = [Song(title=f"{name} {i}", artist=f"Artist {i % 7}", filename=f"{i}.mp3",
+                  filepath=f"{name}/{i}.mp3", duration=200) for i in range(n)]
+    db.add_all(songs)
+    db.flush()
+    now = datetime.now(tz=AMS)
+    plays = []
+    for i, s in enumerate(songs):
+        started = now - timedelta(days=2, minutes=20 * i)
+        plays.append(PlayEvent(user_id=user.id, track_id=s.id, context_type="playlist", context_id=str(i % 3),
+                               started_at=started, ended_at=started + timedelta(seconds=120),
+                               duration_played_sec=120, is_skip=False))
+        db.add(Like(user_id=user.id, song_id=s.id, created_at=now - timedelta(minutes=i)))
+        db.add(ContextProgress(user_id=user.id, context_type="playlist", context_id=f"p{i}",
+                               last_index=1, last_track_id=s.id, played_pct=0.5, updated_at=now))
+    db.add_all(plays)
+    apply_plays(db, plays)
+    db.commit()
+    return user.id
+
+
+def _count_queries(db, user_id: int) -> tuple[int, dict]:
+    rq, token = query_stats.begin_request()
+    try:
+        page = assemble_home(db, user_id)
+    finally:
+        query_stats.end_request("test assemble_home", rq, token)
+    return rq.count, page
+
+
+def test_assemble_home_query_count_does_not_grow_with_history(db):
+    counts = []
+    for name, n in (("few", 5), ("many", 60)):
+        user_id = _user_with_history(db, name, n)
+        count, page = _count_queries(db, user_id)
+        assert {t["type"] for t in page["tiles"]} >= {"recently_played", "favorites_hub", "continue_listening"}
+        counts.append(count)
+    assert counts[0] == counts[1], counts
+
+
+def test_cached_home_is_one_query(db):
+    user_id = _user_with_history(db, "cached", 10)
+    _count_queries(db, user_id)
+    assert db.query(HomeTile).filter(HomeTile.user_id == user_id).count() > 0
+    count, _ = _count_queries(db, user_id)
+    assert count == 1
+
+
+def test_cold_home_reports_no_repeated_statements(db):
+    user_id = _user_with_history(db, "cold", 10)
+    rq, token = query_stats.begin_request()
+    try:
+        assemble_home(db, user_id)
+    finally:
+        query_stats.end_request("test assemble_home", rq, token)
+    assert rq.repeated() == {}
@@ -0,0 +1,82 @@
+# tests/test_pagination.py
+from datetime import datetime, timedelta
+
+from conftest import auth_headers
+from models import Folder, Like, Playlist, PlaylistTrack, Song, User
+
+
+def _user_with_songs(db, name: str, n: int):
+    user = User(username=name, password_hash="x")
+    db.add(user)
+    db.flush()
+    folder = Folder(path=f"/music/{name}", user_id=user.id)
+    db.add(folder)
+    db.flush()
+    songs = [Song(title=f"{name} {i}", filename=f"{i}.mp3", filepath=f"{i}.mp3", folder_id=folder.id)
+             for i in range(n)]
+    db.add_all(songs)
+    db.flush()
+    return user, songs
+
+
+def _pages(client, url: str, headers: dict, on_page=None) -> list[str]:
+    titles, cursor = [], None
+    while True:
+        r = client.get(url, params={"limit": 3, **({"cursor": cursor} if cursor else {})}, headers=headers)
+        assert r.status_code == 200, r.text
+        body = r.json()
+        titles += [s["title"] for s in body["items"]]
+        cursor = body["nextCursor"]
+        if cursor is None:
+            return titles
+        if on_page:
+            on_page(titles)
+
+
+def test_liked_pages_survive_unliking_the_cursor_row(db, client):
+    user, songs = _user_with_songs(db, "liker", 10)
+    t0 = datetime(2026, 5, 1, 12, 0, 0)
+    for i, s in enumerate(songs):  # pairs share a timestamp, so the id tie-break matters
+        db.add(Like(user_id=user.id, song_id=s.id, created_at=t0 + timedelta(seconds=i // 2)))
+    db.commit()
+    headers = auth_headers(user.id)
+    expected = [s.title for s in reversed(songs)]
+    assert _pages(client, "/api/songs/liked", headers) == expected
+
+    def unlike_last_seen(titles):
+        if len(titles) == 3:
+            song = next(s for s in songs if s.title == titles[-1])
+            db.query(Like).filter(Like.user_id == user.id, Like.song_id == song.id).delete()
+            db.commit()
+
+    assert _pages(client, "/api/songs/liked", headers, unlike_last_seen) == expected
+
+    r = client.get("/api/songs/liked", params={"cursor": "not-a-cursor"}, headers=headers)
+    assert r.status_code == 400
+
+
+
+def test_playlist_pages_survive_removing_the_cursor_track(db, client):
+    user, songs = _user_with_songs(db, "lister", 10)
+    pl = Playlist(name="p", user_id=user.id, track_count=len(songs))
+    db.add(pl)
+    db.flush()
+    for i, s in enumerate(songs):
+        db.add(PlaylistTrack(playlist_id=pl.id, track_id=s.id, order_index=(i + 1) * 1024))
+    db.commit()
+    headers = auth_headers(user.id)
+    url = f"/api/playlists/{pl.id}/tracks"
+    expected = [s.title for s in songs]
+    assert _pages(client, url, headers) == expected
+
+    def remove_last_seen(titles):
+        if len(titles) == 3:
+            song = next(s for s in songs if s.title == titles[-1])
+            db.query(PlaylistTrack).filter(PlaylistTrack.playlist_id == pl.id,
+                                           PlaylistTrack.track_id == song.id).delete()
+            db.commit()
+
+    assert _pages(client, url, headers, remove_last_seen) == expected
+
+    r = client.get(url, params={"cursor": "WzFd"}, headers=headers)  # [1]: one key part short
+    assert r.status_code == 400
@@ -0,0 +1,103 @@
+# tests/test_play_events.py
+from datetime import datetime, timedelta
+
+from models import Folder, Like, Playlist, PlaylistTrack, Song, User
+from services.play_events import context_position, context_progress_row
+
+
+def _library(db, name: str):
+    user = User(username=name, password_hash="x")
+    db.add(user)
+    db.flush()
+    folder = Folder(path=f"/music/{name}", user_id=user.id)
+    db.add(folder)
+    db.flush()
+    t0 = datetime(2026, 1, 1)
+    # pairs of songs share a created_at, so the id tie-break matters
+    songs = [Song(title=f"s{i}", filename=f"{i}.mp3", filepath=f"{i}.mp3", folder_id=folder.id,
+                  duration=100, created_at=t0 + timedelta(minutes=i // 2)) for i in range(10)]
+    db.add_all(songs)
+    db.flush()
+    return user, songs
+
+
+def test_positions_match_the_listing_order(db):
+    user, songs = _library(db, "ctx")
+    liked = [songs[i] for i in (3, 7, 1, 8)]
+    for i, s in enumerate(liked):
+        db.add(Like(user_id=user.id, song_id=s.id, created_at=datetime(2026, 2, 1) + timedelta(hours=i)))
+    pl = Playlist(name="p", user_id=user.id)
+    db.add(pl)
+    db.flush()
+    order = [songs[5], songs[2], songs[5], songs[9]]  # a track can appear twice
+    for i, s in enumerate(order):
+        db.add(PlaylistTrack(playlist_id=pl.id, track_id=s.id, order_index=(i + 1) * 1024))
+    db.commit()
+
+    library = [s.id for s in sorted(songs, key=lambda s: (s.created_at, s.id), reverse=True)]
+    likes = [s.id for s in reversed(liked)]
+    playlist = [s.id for s in order]
+    for ctx_type, ctx_id, ids in (("library", "allTracks", library), ("library", "likes", likes),
+                                  ("likes", "x", likes), ("playlist", f"pl:{pl.id}", playlist)):
+        for tid in set(ids):
+            assert context_position(db, user.id, ctx_type, ctx_id, tid) == (ids.index(tid), len(ids)), (ctx_type, tid)
+
+    assert context_position(db, user.id, "library", "likes", songs[0].id) is None  # not liked
+    assert context_position(db, user.id, "library", "home", songs[0].id) is None   # no fixed order
+
+
+def test_progress_row(db):
+    user, songs = _library(db, "prog")
+    row = context_progress_row(db, user.id, "library", "allTracks", songs[9].id, 50, 100, datetime(2026, 3, 1))
+    assert row["last_index"] == 0 and row["played_pct"] == 0.05
+    row = context_progress_row(db, user.id, "library", "home", songs[9].id, 50, 100, datetime(2026, 3, 1))
+    assert row["last_index"] is None and row["played_pct"] == 0.0
+
+
+def test_late_batch_does_not_overwrite_newer_progress(db):
+    from zoneinfo import ZoneInfo
+    from models import ContextProgress
+    from services.play_events import ingest_events
+
+    ams = ZoneInfo("Europe/Amsterdam")
+    user, songs = _library(db, "offline")
+    pl = Playlist(name="p", user_id=user.id)
+    db.add(pl)
+    db.flush()
+    for i, s in enumerate(songs):
+        db.add(PlaylistTrack(playlist_id=pl.id, track_id=s.id, order_index=(i + 1) * 1024))
+    db.commit()
+
+    def play(key, song, ended_at):
+        return {"client_event_id": key, "track_id": song.id, "context_type": "playlist", "context_id": str(pl.id),
+                "started_at": ended_at - timedelta(seconds=50), "ended_at": ended_at,
+                "position_start_sec": 0, "position_end_sec": 50}
+
+    now = datetime.now(tz=ams)
+    ingest_events(db, user.id, [play("recent", songs[6], now - timedelta(minutes=5))])
+    ingest_events(db, user.id, [play("offline", songs[2], now - timedelta(days=2))])  # replayed late
+
+    progress = db.query(ContextProgress).filter(ContextProgress.user_id == user.id).one()
+    assert (progress.last_track_id, progress.last_index) == (songs[6].id, 6)
+
+
+def test_batch_retry_after_archiving_is_a_duplicate(db):
+    from zoneinfo import ZoneInfo
+    from models import ListeningDaily, PlayEvent
+    from services.play_events import ingest_events
+    from services.retention import archive_play_events
+
+    user, songs = _library(db, "archived")
+    started = datetime.now(tz=ZoneInfo("Europe/Amsterdam")) - timedelta(days=40)
+    event = {"client_event_id": "k1", "track_id": songs[0].id, "started_at": started,
+             "ended_at": started + timedelta(seconds=90), "position_start_sec": 0, "position_end_sec": 90}
+    [first] = ingest_events(db, user.id, [event])
+    archive_play_events(db, older_than_days=30)
+    db.commit()
+    assert db.query(PlayEvent).filter(PlayEvent.user_id == user.id).count() == 0
+
+    [retry] = ingest_events(db, user.id, [event])
+    assert retry == {"client_event_id": "k1", "event_id": first["event_id"], "status": "duplicate"}
+    assert db.query(PlayEvent).filter(PlayEvent.user_id == user.id).count() == 0
+    plays = db.query(ListeningDaily.play_count).filter(ListeningDaily.user_id == user.id).scalar()
+    assert plays == 1
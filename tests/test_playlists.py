@@ -0,0 +1,62 @@
+# tests/test_playlists.py
+from itertools import count
+
+import pytest
+
+from conftest import auth_headers
+from models import Folder, Playlist, PlaylistTrack, Song, User
+from services.playlists import PlaylistEditError, apply_track_ops
+
+
+_users = count()
+
+
+@pytest.fixture
+def playlist(db):
+    name = f"editor{next(_users)}"
+    user = User(username=name, password_hash="x")
+    db.add(user)
+    db.flush()
+    folder = Folder(path=f"/music/{name}", user_id=user.id)
+    db.add(folder)
+    db.flush()
+    songs = [Song(title=f"t{i}", filename=f"{i}.mp3", filepath=f"{i}.mp3", folder_id=folder.id) for i in range(4)]
+    db.add_all(songs)
+    db.flush()
+    pl = Playlist(name="p", user_id=user.id)
+    db.add(pl)
+    db.flush()
+    for i, s in enumerate(songs[:3]):
+        db.add(PlaylistTrack(playlist_id=pl.id, track_id=s.id, order_index=(i + 1) * 1024))
+    db.commit()
+    return user, pl, songs
+
+
+def _order(db, playlist_id):
+    return [tid for (tid,) in db.query(PlaylistTrack.track_id)
+            .filter(PlaylistTrack.playlist_id == playlist_id)
+            .order_by(PlaylistTrack.order_index, PlaylistTrack.id)]
+
+
+@pytest.mark.parametrize("op", ["move", "insert_at"])
+def test_positioned_op_without_position_is_rejected(db, client, playlist, op):
+    user, pl, songs = playlist
+    before = _order(db, pl.id)
+    song = songs[2] if op == "move" else songs[3]
+    r = client.post(f"/api/playlists/{pl.id}/tracks/ops", headers=auth_headers(user.id),
+                    json={"ops": [{"op": "add", "song_id": songs[3].id}, {"op": op, "song_id": song.id}]})
+    assert r.status_code == 422
+    db.expire_all()
+    assert _order(db, pl.id) == before
+
+    with pytest.raises(PlaylistEditError):
+        apply_track_ops(db, pl.id, [{"op": op, "song_id": song.id}])
+
+
+def test_move_to_position(db, client, playlist):
+    user, pl, songs = playlist
+    r = client.post(f"/api/playlists/{pl.id}/tracks/ops", headers=auth_headers(user.id),
+                    json={"ops": [{"op": "move", "song_id": songs[0].id, "position": 2}]})
+    assert r.status_code == 200, r.text
+    db.expire_all()
+    assert _order(db, pl.id) == [songs[1].id, songs[2].id, songs[0].id]
@@ -0,0 +1,33 @@
+# tests/test_rollups.py
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from database import engine
+from migrations import run_migrations
+from models import ListeningDaily, PlayEvent, User
+
+AMS = ZoneInfo("Europe/Amsterdam")
+
+
+def test_migrations_backfill_empty_rollups_from_play_history(db):
+    user = User(username="backfill", password_hash="x")
+    db.add(user)
+    db.flush()
+    started = datetime(2026, 3, 2, 20, 0, tzinfo=AMS)
+    db.add_all([
+        PlayEvent(user_id=user.id, track_id=7, started_at=started, ended_at=started + timedelta(seconds=200),
+                  duration_played_sec=200),
+        PlayEvent(user_id=user.id, track_id=7, started_at=started + timedelta(minutes=5),
+                  ended_at=started + timedelta(minutes=5, seconds=10), duration_played_sec=10, is_skip=True),
+        PlayEvent(user_id=user.id, track_id=8, started_at=started + timedelta(minutes=9)),  # still playing
+    ])
+    db.query(ListeningDaily).delete()  # a database from before the rollups
+    db.commit()
+
+    run_migrations(engine)
+    run_migrations(engine)  # only fills an empty table
+
+    rows = db.query(ListeningDaily).filter(ListeningDaily.user_id == user.id).all()
+    assert [(r.track_id, r.day.isoformat(), r.seconds_played, r.play_count, r.skip_count) for r in rows] == [
+        (7, "2026-03-02", 200, 1, 1),
+    ]
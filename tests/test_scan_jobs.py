@@ -0,0 +1,40 @@
+# tests/test_scan_jobs.py
+import time
+from datetime import datetime, timedelta
+
+import services.scan_jobs as scan_jobs
+from models import Folder, ScanJob, User
+from services.scanner import ScanResult
+
+
+def test_heartbeat_stays_fresh_during_a_long_walk(db, tmp_path, monkeypatch):
+    user = User(username="scanner", password_hash="x")
+    db.add(user)
+    db.flush()
+    folder = Folder(path=str(tmp_path), user_id=user.id)
+    db.add(folder)
+    db.flush()
+    claimed_at = datetime.now(tz=scan_jobs.AMS) - timedelta(hours=1)
+    job = ScanJob(folder_id=folder.id, user_id=user.id, status="running", worker=scan_jobs._worker_id(),
+                  heartbeat_at=claimed_at)
+    db.add(job)
+    db.commit()
+
+    beats = []
+
+    def slow_walk(scan_db, f, uid, resume_after=None, progress=None):
+        time.sleep(0.3)  # no batch committed yet: the walk is still going
+        check = scan_jobs.SessionLocal()
+        try:
+            beats.append(check.get(ScanJob, job.id).heartbeat_at)
+        finally:
+            check.close()
+        return ScanResult()
+
+    monkeypatch.setattr(scan_jobs, "SCAN_JOB_HEARTBEAT_SECONDS", 0.05)
+    monkeypatch.setattr(scan_jobs, "scan_folder", slow_walk)
+    scan_jobs.run_job(job.id)
+
+    assert beats[0].replace(tzinfo=None) > claimed_at.replace(tzinfo=None) + timedelta(minutes=59)
+    db.expire_all()
+    assert db.get(ScanJob, job.id).status == "done"
@@ -0,0 +1,79 @@
+# tests/test_spotify.py
+import time
+
+from conftest import auth_headers
+from models import Folder, Setting, Song, User
+from services import spotify
+from utils.rate_limit import TokenBucket
+
+
+def test_try_acquire_fails_fast_while_paused():
+    bucket = TokenBucket(rate=5, burst=1)
+    assert bucket.try_acquire() == 0
+    assert 0 < bucket.try_acquire() <= 0.2       # empty: next token in 1/rate seconds
+    assert bucket.try_acquire(max_wait=0.5) == 0  # ... which is short enough to wait for
+    bucket.pause(30)
+    started = time.monotonic()
+    assert bucket.try_acquire(max_wait=1) > 29
+    assert time.monotonic() - started < 0.1
+
+
+def test_enrich_returns_429_instead_of_waiting_out_a_pause(db, client, monkeypatch):
+    user = User(username="enricher", password_hash="x")
+    db.add(user)
+    db.flush()
+    folder = Folder(path="/music/enricher", user_id=user.id)
+    db.add(folder)
+    db.flush()
+    song = Song(title="Some Song", artist="Someone", filename="a.mp3", filepath="a.mp3", folder_id=folder.id)
+    db.add_all([song, Setting(user_id=user.id, key="spotify_client_id", value="id"),
+                Setting(user_id=user.id, key="spotify_client_secret", value="secret")])
+    db.commit()
+
+    bucket = TokenBucket(rate=5, burst=10)
+    bucket.pause(30)
+    monkeypatch.setattr(spotify, "_bucket", bucket)
+    monkeypatch.setattr(spotify._session, "request", lambda *a, **kw: (_ for _ in ()).throw(AssertionError("called out")))
+
+    started = time.monotonic()
+    r = client.post(f"/api/songs/{song.id}/enrich", headers=auth_headers(user.id))
+    assert r.status_code == 429
+    assert int(r.headers["Retry-After"]) >= 29
+    assert time.monotonic() - started < 1
+
+
+class _Response:
+    def __init__(self, status_code: int, body: dict):
+        self.status_code = status_code
+        self._body = body
+        self.headers = {}
+        self.text = str(body)
+
+    def json(self):
+        return self._body
+
+
+def test_only_an_empty_200_is_cached_as_no_results(db, client, monkeypatch):
+    user = User(username="searcher", password_hash="x")
+    db.add(user)
+    db.flush()
+    folder = Folder(path="/music/searcher", user_id=user.id)
+    db.add(folder)
+    db.flush()
+    song = Song(title="Nothing Like It", filename="b.mp3", filepath="b.mp3", folder_id=folder.id)
+    db.add_all([song, Setting(user_id=user.id, key="spotify_client_id", value="id"),
+                Setting(user_id=user.id, key="spotify_client_secret", value="secret")])
+    db.commit()
+    monkeypatch.setitem(spotify._last_token_cache, (user.id, "app"), ("tok", time.time() + 600))
+    monkeypatch.setattr(spotify, "_bucket", TokenBucket(rate=100, burst=100))
+    queries = ['track:"nothing like it"']
+
+    monkeypatch.setattr(spotify._session, "request", lambda *a, **kw: _Response(404, {"error": "no"}))
+    r = client.post(f"/api/songs/{song.id}/enrich", headers=auth_headers(user.id))
+    assert r.status_code == 502
+    assert spotify.search_cache.lookup(db, queries) == {}
+
+    monkeypatch.setattr(spotify._session, "request", lambda *a, **kw: _Response(200, {"tracks": {"items": []}}))
+    r = client.post(f"/api/songs/{song.id}/enrich", headers=auth_headers(user.id))
+    assert r.json() == {"song_id": song.id, "updated": False}
+    assert spotify.search_cache.lookup(db, queries) == {queries[0]: []}
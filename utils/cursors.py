@@ -0,0 +1,23 @@
+# utils/cursors.py
+"""
+Opaque keyset-pagination cursors. A cursor carries the last row's sort key itself, so the
+next page doesn't depend on that row still existing (e.g. unliked or removed meanwhile).
+"""
+import base64
+import json
+
+
+def encode_cursor(*key) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key, separators=(",", ":")).encode()).rstrip(b"=").decode("ascii")
+
+
+def decode_cursor(token: str, types: tuple[type, ...]) -> list:
+    """The key values, checked against `types`; ValueError for anything else."""
+    try:
+        key = json.loads(base64.urlsafe_b64decode((token + "=" * (-len(token) % 4)).encode("ascii")))
+    except (ValueError, UnicodeEncodeError) as e:
+        raise ValueError("malformed cursor") from e
+    if (not isinstance(key, list) or len(key) != len(types)
+            or not all(type(v) is t for v, t in zip(key, types))):
+        raise ValueError("malformed cursor")
+    return key
@@ -0,0 +1,12 @@
+# utils/paths.py
+import os
+
+
+def normalize_folder_path(path: str) -> str:
+    """
+    The form Folder.path is stored in: absolute, without a trailing separator or "..".
+    Scans build Song.filepath below it and the watcher matches events against it, so
+    both must see the same string. Relative paths resolve against the working directory,
+    as scans always did.
+    """
+    return os.path.abspath(path)
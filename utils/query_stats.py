@@ -0,0 +1,133 @@
+# utils/query_stats.py
+import os
+import re
+import time
+import threading
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Configure via env
+QUERY_WARN_THRESHOLD = int(os.getenv("QUERY_WARN_THRESHOLD", "25"))     # queries per request
+REPEATED_SHAPE_THRESHOLD = int(os.getenv("REPEATED_SHAPE_THRESHOLD", "5"))  # same statement N times → likely N+1
+DEV_MODE = os.getenv("DEV_MODE", "false").lower() == "true"
+
+# execution option for statements that intentionally run once per item (e.g. a per-tile
+# compare-and-set): counted, but left out of the repeated-shape (N+1) check
+PER_ITEM = "smuzzi_per_item"
+
+_IN_LIST = re.compile(r"\(\s*(?:\?|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%\(\w+\)s|:\w+))*\s*\)")
+_WS = re.compile(r"\s+")
+
+
+def statement_shape(statement: str) -> str:
+    """Collapse whitespace and IN-lists so equivalent statements group together."""
+    s = _WS.sub(" ", statement).strip()
+    return _IN_LIST.sub("(?…)", s)
+
+
+class RequestQueries:
+    """Per-request collector; lives in a ContextVar so threadpool endpoints see it too."""
+
+    __slots__ = ("count", "db_seconds", "shapes", "lock")
+
+    def __init__(self):
+        self.lock = threading.Lock()  # /home tiles run their queries on worker threads
+        self.count = 0
+        self.db_seconds = 0.0
+        self.shapes: dict[str, int] = {}
+
+    def repeated(self) -> dict[str, int]:
+        return {k: v for k, v in self.shapes.items() if v >= REPEATED_SHAPE_THRESHOLD}
+
+
+_current: ContextVar[Optional[RequestQueries]] = ContextVar("smuzzi_request_queries", default=None)
+
+
+# ---------- Engine hooks ----------
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("smuzzi_query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    rq = _current.get()
+    if rq is None:
+        return
+    starts = conn.info.get("smuzzi_query_start")
+    elapsed = time.perf_counter() - starts.pop() if starts else 0.0
+    per_item = context is not None and context.execution_options.get(PER_ITEM, False)
+    shape = None if per_item else statement_shape(statement)
+    with rq.lock:
+        rq.db_seconds += elapsed
+        rq.count += 1
+        if shape is not None:
+            rq.shapes[shape] = rq.shapes.get(shape, 0) + 1
+
+
+# ---------- Aggregates ----------
+_lock = threading.Lock()
+_routes: dict[str, dict] = {}
+
+
+def begin_request() -> tuple[RequestQueries, object]:
+    rq = RequestQueries()
+    return rq, _current.set(rq)
+
+
+def end_request(route: str, rq: RequestQueries, token) -> None:
+    _current.reset(token)
+    repeated = rq.repeated()
+    with _lock:
+        agg = _routes.setdefault(route, {
+            "requests": 0,
+            "queries": 0,
+            "max_queries": 0,
+            "db_ms": 0.0,
+            "max_db_ms": 0.0,
+            "repeated_shapes": {},
+        })
+        agg["requests"] += 1
+        agg["queries"] += rq.count
+        agg["max_queries"] = max(agg["max_queries"], rq.count)
+        agg["db_ms"] += rq.db_seconds * 1000
+        agg["max_db_ms"] = max(agg["max_db_ms"], rq.db_seconds * 1000)
+        for shape, n in repeated.items():
+            seen = agg["repeated_shapes"].setdefault(shape, {"requests": 0, "max_per_request": 0})
+            seen["requests"] += 1
+            seen["max_per_request"] = max(seen["max_per_request"], n)
+
+    if DEV_MODE and (rq.count > QUERY_WARN_THRESHOLD or repeated):
+        print(f"⚠️ {route}: {rq.count} queries in {rq.db_seconds * 1000:.1f} ms")
+        for shape, n in sorted(repeated.items(), key=lambda kv: -kv[1]):
+            print(f"   {n}x {shape[:160]}")
+
+
+def snapshot() -> dict:
+    with _lock:
+        out = {}
+        for route, agg in _routes.items():
+            reqs = agg["requests"] or 1
+            out[route] = {
+                "requests": agg["requests"],
+                "avg_queries": round(agg["queries"] / reqs, 2),
+                "max_queries": agg["max_queries"],
+                "avg_db_ms": round(agg["db_ms"] / reqs, 2),
+                "max_db_ms": round(agg["max_db_ms"], 2),
+                "repeated_shapes": [
+                    {"statement": shape, **seen}
+                    for shape, seen in sorted(
+                        agg["repeated_shapes"].items(), key=lambda kv: -kv[1]["max_per_request"]
+                    )
+                ],
+            }
+        return out
+
+
+def reset() -> None:
+    with _lock:
+        _routes.clear()
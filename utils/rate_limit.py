@@ -0,0 +1,64 @@
+# utils/rate_limit.py
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` tokens per second, at most `burst` saved up.
+    acquire() blocks until a token is free; pause() (e.g. a server's Retry-After)
+    holds every caller until it has passed. try_acquire() is for callers that would
+    rather give up than wait (a request thread with a user waiting on it).
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self) -> float:
+        """Take a token and return 0, or return the seconds until one is free."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._updated:  # paused
+                return self._updated - now
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self) -> None:
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def try_acquire(self, max_wait: float = 0.0) -> float:
+        """
+        Take a token if one is free within `max_wait` seconds and return 0; otherwise take
+        nothing and return how long the caller would have had to wait (e.g. a pause).
+        """
+        while True:
+            wait = self._take()
+            if not wait or wait > max_wait:
+                return wait
+            time.sleep(wait)
+
+    def available(self) -> float:
+        """Tokens that could be taken right now (0 while paused)."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._updated:
+                return 0.0
+            return min(self.burst, self._tokens + (now - self._updated) * self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Hand out nothing for `seconds`, then start refilling from empty."""
+        with self._lock:
+            self._tokens = 0.0
+            self._updated = max(self._updated, time.monotonic() + seconds)
@@ -0,0 +1,44 @@
+# utils/tags.py
+# Tag reading for scans. Kept free of app imports so process-pool workers start fast.
+import os
+from typing import Optional
+
+from mutagen import File as MutagenFile
+from mutagen import MutagenError
+
+
+def read_tags(file_path: str) -> Optional[dict]:
+    """Title/artist/album/duration from the file, or None when it can't be read."""
+    filename = os.path.basename(file_path)
+    try:
+        audio = MutagenFile(file_path, easy=True)
+        title = (
+            audio.get("title", [os.path.splitext(filename)[0]])[0]
+            if audio else os.path.splitext(filename)[0]
+        )
+        artist = (audio.get("artist", ["Unknown Artist"])[0] if audio else None)
+        album = (audio.get("album", ["Unknown Album"])[0] if audio else None)
+        duration = (
+            int(audio.info.length)
+            if audio and getattr(audio, "info", None) and getattr(audio.info, "length", None)
+            else None
+        )
+    except MutagenError as e:
+        print(f"⚠️ Skipping unreadable file {file_path}: {e}")
+        return None
+    except Exception as e:
+        print(f"⚠️ Unknown error reading {file_path}: {e}")
+        return None
+    return {"title": title, "artist": artist, "album": album, "duration": duration}
+
+
+def read_many(paths: list[str], read=read_tags) -> list[Optional[dict]]:
+    """read() over a chunk of files (one pool task); a failing file yields None, not a failed chunk."""
+    out = []
+    for path in paths:
+        try:
+            out.append(read(path))
+        except Exception as e:
+            print(f"⚠️ Tag reader failed on {path}: {e}")
+            out.append(None)
+    return out